@@ -148,6 +148,7 @@ for line_name in ["316","527","602"]:
 #the lines to extend to resolve infeasibilities can
 #be found by
 #uncommenting the lines below to allow the network to be extended
+#(then optimise with network.lopf, since network.lopf_rolling cannot extend capacities)
 
 #network.lines["s_nom_original"] = network.lines.s_nom
 
@@ -165,14 +166,9 @@ print("Performing linear OPF for one day, {} snapshots at a time:".format(group_
 
 network.storage_units.state_of_charge_initial = 0.
 
-for i in range(int(24/group_size)):
-    #set the initial state of charge based on previous round
-    if i>0:
-        network.storage_units.state_of_charge_initial = network.storage_units_t.state_of_charge.loc[network.snapshots[group_size*i-1]]
-    network.lopf(network.snapshots[group_size*i:group_size*i+group_size],
-                 solver_name=solver_name,
-                 keep_files=True)
-    network.lines.s_nom = network.lines.s_nom_opt
+#the state of charge is carried over from one group to the next
+network.lopf_rolling(network.snapshots[:24], horizon=group_size,
+                     solver_name=solver_name)
 
 #if lines are extended, look at which ones are bigger
 #network.lines[["s_nom_original","s_nom"]][abs(network.lines.s_nom - contingency_factor*network.lines.s_nom_original) > 1]
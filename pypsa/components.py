@@ -61,10 +61,11 @@ from .pf import (network_lpf, sub_network_lpf, network_pf,
                  calculate_PTDF, calculate_B_H, calculate_dependent_values)
 
 from .contingency import (calculate_BODF, network_lpf_contingency,
-                          network_sclopf)
+                          network_lpf_contingency_overloads,
+                          network_lpf_contingency_nk, network_sclopf)
 
 
-from .opf import network_lopf, network_opf
+from .opf import network_lopf, network_lopf_rolling, network_opf
 
 from .plot import plot, iplot
 
@@ -200,6 +201,8 @@ class Network(Basic):
 
     lopf = network_lopf
 
+    lopf_rolling = network_lopf_rolling
+
     opf = network_opf
 
     plot = plot
@@ -210,6 +213,10 @@ class Network(Basic):
 
     lpf_contingency = network_lpf_contingency
 
+    lpf_contingency_overloads = network_lpf_contingency_overloads
+
+    lpf_contingency_nk = network_lpf_contingency_nk
+
     sclopf = network_sclopf
 
     graph = graph
@@ -252,7 +259,7 @@ class Network(Basic):
         else:
             self.component_attrs = override_component_attrs
 
-        for c_type in set(self.components.type.unique()) - {np.nan}:
+        for c_type in set(self.components.type.dropna().unique()):
             setattr(self, c_type + "_components",
                     set(self.components.index[self.components.type == c_type]))
 
@@ -35,19 +35,36 @@ logger = logging.getLogger(__name__)
 import numpy as np
 import pandas as pd
 
-import collections
+import collections, six, hashlib, os
 
-from .pf import calculate_PTDF, _as_snapshots
+from .pf import (calculate_PTDF, calculate_B_H, factorize_B, _as_snapshots,
+                 _matrix_cache, _B_key)
 
-from .opt import l_constraint
+from .opt import l_constraint, l_constraint_array
+from .opf import (network_lopf_build_model, network_lopf_prepare_solver,
+                  network_lopf_solve, PersistentSolver)
+from .profiling import profiling, stage
 
 
-def calculate_BODF(sub_network, skip_pre=False):
+#outages with |1 - PTDF_ll| below this split the sub-network
+_bridge_tol = 1e-10
+
+def _inverse_denominator(branch_PTDF_diag):
+    """1/(1 - PTDF_ll), infinite for outages which split the sub-network."""
+    one_minus_diag = 1-branch_PTDF_diag
+    connected = np.abs(one_minus_diag) > _bridge_tol
+    inverse = np.full(len(one_minus_diag), np.inf)
+    inverse[connected] = 1/one_minus_diag[connected]
+    return inverse
+
+def calculate_BODF(sub_network, skip_pre=False, lazy=False, cache=None):
     """
     Calculate the Branch Outage Distribution Factor (BODF) for
     sub_network.
 
-    Sets sub_network.BODF as a (dense) numpy array.
+    Sets sub_network.BODF as a (dense) numpy array, or with lazy=True
+    as a LazyBODF, which computes the requested columns or rows from
+    the sparse factorization of B when it is indexed.
 
     The BODF is a num_branch x num_branch 2d array.
 
@@ -62,10 +79,25 @@ def calculate_BODF(sub_network, skip_pre=False):
     ----------
     sub_network : pypsa.SubNetwork
     skip_pre: bool, default False
-        Skip the preliminary step of computing the PTDF.
+        Skip the preliminary step of computing the PTDF (or B and H
+        with lazy=True).
+    lazy : bool, default False
+        Do not compute the dense BODF, see LazyBODF
+    cache : None|string
+        With lazy=True, name of a file in which the computed columns
+        are kept as a memory-mapped array, see LazyBODF
 
     """
 
+    if lazy:
+        if not skip_pre:
+            calculate_B_H(sub_network)
+        if cache is None:
+            sub_network.BODF = _lazy_bodf(sub_network)
+        else:
+            sub_network.BODF = LazyBODF(sub_network, cache=cache)
+        return
+
     if not skip_pre:
         calculate_PTDF(sub_network)
 
@@ -74,7 +106,9 @@ def calculate_BODF(sub_network, skip_pre=False):
     #build LxL version of PTDF
     branch_PTDF = sub_network.PTDF*sub_network.K
 
-    denominator = csr_matrix((1/(1-np.diag(branch_PTDF)),(r_[:num_branches],r_[:num_branches])))
+    #outages which split the sub-network have 1 - PTDF_ll = 0 up to
+    #rounding; their columns are made infinite
+    denominator = csr_matrix((_inverse_denominator(np.diag(branch_PTDF)),(r_[:num_branches],r_[:num_branches])))
 
     sub_network.BODF = branch_PTDF*denominator
 
@@ -82,16 +116,244 @@ def calculate_BODF(sub_network, skip_pre=False):
     np.fill_diagonal(sub_network.BODF,-1)
 
 
+class LazyBODF(object):
+    """
+    Branch Outage Distribution Factors of a sub-network, computed on
+    demand.
+
+    Neither the PTDF nor the dense num_branch x num_branch BODF are
+    built; instead a column l (the outage of branch l) is computed
+    from one solve with the cached sparse factorization of B (see
+    pypsa.pf.factorize_B)
+
+    BODF_{kl} = BPTDF_{kl}/(1 - BPTDF_{ll}), BPTDF_{:,l} = H B^{-1} K_{:,l}
+
+    and a row k (the flows on branch k for all outages) from one solve
+    with H_{k,:} and the diagonal of BPTDF, which is computed once in
+    blocks.
+
+    Indexing like a numpy array, e.g. bodf[:, outages] or
+    bodf[branches, :], with integer positions in
+    sub_network.branches_i() returns dense arrays; unlike numpy, two
+    integer arrays select rows and columns independently.
+
+    Parameters
+    ----------
+    sub_network : pypsa.SubNetwork
+        B, H and K must have been calculated with calculate_B_H
+    cache : None|string
+        Name of a file in which the computed columns are kept as a
+        memory-mapped num_branch x num_branch array; only the columns
+        which are requested are ever written. Which columns have been
+        computed is recorded in the file cache + ".computed" and a
+        fingerprint of B, H, K and the bus ordering in cache + ".key",
+        so that a later LazyBODF (also in another run) with the same
+        cache reuses the columns if the sub-network is unchanged and
+        otherwise starts the files afresh.
+    block_size : int, default 256
+        Number of right-hand sides solved at once
+
+    """
+
+    def __init__(self, sub_network, cache=None, block_size=256):
+
+        self.lu = factorize_B(sub_network)
+        self.K = csr_matrix(sub_network.K)
+        self.H = csr_matrix(sub_network.H)
+        self.block_size = block_size
+
+        num_branches = self.K.shape[1]
+        self.shape = (num_branches, num_branches)
+
+        self._diagonal = None
+
+        self._key = _B_key(sub_network, sub_network.B, sub_network.H, sub_network.K)
+
+        if cache is None:
+            self._columns = None
+        else:
+            self._open_cache(cache, _fingerprint(self._key))
+
+    def _open_cache(self, cache, fingerprint):
+        """Open the memory-mapped columns and the mask of computed
+        columns in cache, reusing them if they were written for the
+        same fingerprint."""
+
+        key_file = cache + ".key"
+        computed_file = cache + ".computed"
+
+        reuse = False
+        if all(os.path.exists(f) for f in (cache, computed_file, key_file)):
+            with open(key_file) as f:
+                reuse = f.read().strip() == fingerprint
+
+        if reuse:
+            logger.debug("Reusing the BODF columns in %s", cache)
+            mode = "r+"
+        else:
+            mode = "w+"
+            #the key is written last, so that files which were not
+            #completely initialised are never reused
+            if os.path.exists(key_file):
+                os.remove(key_file)
+
+        self._columns = np.memmap(cache, dtype=float, mode=mode, shape=self.shape, order="F")
+        self._computed = np.memmap(computed_file, dtype=bool, mode=mode, shape=(self.shape[1],))
+
+        if not reuse:
+            self._computed.flush()
+            with open(key_file, "w") as f:
+                f.write(fingerprint)
+
+    def _solve(self, rhs):
+        """B^{-1} rhs for the rows of rhs ordered like buses_o, with
+        zero in the slack row."""
+        x = np.zeros((rhs.shape[0], rhs.shape[1]))
+        x[1:] = self.lu.solve(np.asarray(rhs[1:].todense()))
+        return x
+
+    def diagonal(self):
+        """Return BPTDF_{ll} for all branches l."""
+
+        if self._diagonal is None:
+            diagonal = np.empty(self.shape[0])
+            for i in range(0, self.shape[0], self.block_size):
+                block = r_[i:min(i+self.block_size, self.shape[0])]
+                x = self._solve(self.K[:, block])
+                diagonal[block] = np.asarray(self.H[block].multiply(x.T).sum(axis=1)).ravel()
+            self._diagonal = diagonal
+
+        return self._diagonal
+
+    def branch_PTDF(self, columns):
+        """Return the columns BPTDF_{:,l} = H B^{-1} K_{:,l} of the
+        branch PTDF for the branches at the integer positions columns."""
+        return self.H*self._solve(self.K[:, np.asarray(columns, dtype=int).reshape(-1)])
+
+    def _compute_columns(self, outages):
+        columns = np.empty((self.shape[0], len(outages)))
+        for i in range(0, len(outages), self.block_size):
+            block = outages[i:i+self.block_size]
+            branch_PTDF = self.branch_PTDF(block)
+            inverse = _inverse_denominator(branch_PTDF[block, r_[:len(block)]])
+            with np.errstate(invalid="ignore"):
+                columns[:, i:i+len(block)] = branch_PTDF*inverse
+            columns[block, r_[i:i+len(block)]] = -1
+        return columns
+
+    def columns(self, outages):
+        """Return the columns of the BODF for the outages of the
+        branches at the integer positions outages."""
+
+        outages = np.asarray(outages, dtype=int).reshape(-1)
+
+        if self._columns is None:
+            return self._compute_columns(outages)
+
+        missing = np.unique(outages[~self._computed[outages]])
+        if len(missing):
+            #flush the columns before marking them as computed
+            self._columns[:, missing] = self._compute_columns(missing)
+            self._columns.flush()
+            self._computed[missing] = True
+            self._computed.flush()
+
+        return np.array(self._columns[:, outages])
+
+    def rows(self, branches):
+        """Return the rows of the BODF for the flows on the branches at
+        the integer positions branches."""
+
+        branches = np.asarray(branches, dtype=int).reshape(-1)
+
+        #B is symmetric, so (H_k B^{-1} K)^T = K^T B^{-1} H_k^T
+        branch_PTDF = (self.K.T*self._solve(self.H[branches].T)).T
+        with np.errstate(invalid="ignore"):
+            rows = branch_PTDF*_inverse_denominator(self.diagonal())
+        rows[r_[:len(branches)], branches] = -1
+        return rows
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+
+        if isinstance(columns, slice) and not isinstance(rows, slice):
+            rows = np.arange(self.shape[0])[rows]
+            result = self.rows(rows)[:, columns]
+            return result[0] if np.ndim(rows) == 0 else result
+
+        columns = np.arange(self.shape[1])[columns]
+        result = self.columns(columns)[rows]
+        return result[..., 0] if np.ndim(columns) == 0 else result
+
+
+def _fingerprint(key):
+    """Hexadecimal hash of a key from pypsa.pf._B_key."""
+
+    h = hashlib.sha1()
+    for part in key:
+        h.update(part if isinstance(part, bytes) else repr(part).encode("utf-8"))
+    return h.hexdigest()
+
+def _lazy_bodf(sub_network):
+    """
+    Return sub_network.BODF if it is a LazyBODF for the current B, H
+    and K, e.g. with a file cache from calculate_BODF(lazy=True,
+    cache=...), so that its computed columns are reused. Otherwise
+    return a LazyBODF without a file cache, which is cached at the
+    level of the network like the factorization of B.
+    """
+
+    key = _B_key(sub_network, sub_network.B, sub_network.H, sub_network.K)
+
+    bodf = getattr(sub_network, "BODF", None)
+    if isinstance(bodf, LazyBODF) and bodf._key == key:
+        return bodf
+
+    cache = _matrix_cache(sub_network.network)
+    entry = cache.get(("LazyBODF", sub_network.name))
+    if entry is None or entry["key"] != key:
+        entry = dict(key=key, bodf=LazyBODF(sub_network))
+        cache[("LazyBODF", sub_network.name)] = entry
+
+    return entry["bodf"]
+
+def _branch_outages(network, branch_outages, passive_branches):
+    """Return the branch_outages as a list of (component, name)
+    tuples, all of network.passive_branches() if None."""
+
+    if branch_outages is None:
+        return list(passive_branches.index)
+
+    outages = []
+    for branch in branch_outages:
+        if type(branch) is not tuple:
+            logger.warning("No type given for {}, assuming it is a line".format(branch))
+            branch = ("Line",branch)
+        outages.append(branch)
+    return outages
+
+def _base_flows(network, snapshots, passive_branches):
+    """Return the flows p0 of the passive branches as a snapshots x
+    branches array ordered like passive_branches."""
+
+    return np.hstack([network.pnl(c).p0.loc[snapshots, network.df(c).index].values
+                      for c in network.passive_branch_components])
+
 def network_lpf_contingency(network, snapshots=None, branch_outages=None):
     """
     Computes linear power flow for a selection of branch outages.
 
+    The base case is calculated with a single linear power flow for
+    all snapshots and the flows after each outage are found from the
+    BODF (see calculate_BODF) as array products over all snapshots,
+    branches and outages.
+
     Parameters
     ----------
     snapshots : list-like|single snapshot
         A subset or an elements of network.snapshots on which to run
-        the power flow, defaults to network.snapshots
-        NB: currently this only works for a single snapshot
+        the power flow, defaults to network.snapshots (with a warning
+        if there are several; earlier versions used only the first)
     branch_outages : list-like
         A list of passive branches which are to be tested for outages.
         If None, it's take as all network.passive_branches_i()
@@ -99,69 +361,386 @@ def network_lpf_contingency(network, snapshots=None, branch_outages=None):
     Returns
     -------
     p0 : pandas.DataFrame
-        num_passive_branch x num_branch_outages DataFrame of new power flows
+        num_passive_branch x num_branch_outages DataFrame of new power
+        flows for a single snapshot, with the flows of the base case in
+        the column "base"; for several snapshots the frames of the
+        snapshots are stacked, i.e. the index is (snapshot, type, name).
+        Flows on branches outside the sub-network of an outage are NaN.
 
     """
 
-    if snapshots is None:
-        snapshots = network.snapshots
+    if snapshots is None and len(network.snapshots) > 1:
+        logger.warning("Computing the contingency flows for all %d snapshots, which are returned "
+                       "stacked; previously only the first snapshot was used, pass "
+                       "snapshots=network.snapshots[0] for a single frame",
+                       len(network.snapshots))
 
-    if isinstance(snapshots, collections.Iterable):
-        logger.warning("Apologies LPF contingency, this only works for single snapshots at the moment, taking the first snapshot.")
-        snapshot = snapshots[0]
-    else:
-        snapshot = snapshots
+    single = _single_snapshot(snapshots)
+    snapshots = _as_snapshots(network, snapshots)
 
-    network.lpf(snapshot)
+    network.lpf(snapshots)
 
     # Store the flows from the base case
 
     passive_branches = network.passive_branches()
 
-    if branch_outages is None:
-        branch_outages = passive_branches.index
+    outages = _branch_outages(network, branch_outages, passive_branches)
 
+    p0_base = _base_flows(network, snapshots, passive_branches)
 
-    p0_base = pd.Series(index=passive_branches.index)
+    #flows in the base case and after each outage
+    p0 = np.full((len(snapshots), len(passive_branches), 1 + len(outages)), np.nan)
+    p0[:,:,0] = p0_base
 
-    for c in network.passive_branch_components:
-        pnl = network.pnl(c)
-        p0_base[c] = pnl.p0.loc[snapshot]
+    outage_sub_networks = passive_branches.sub_network.reindex(outages)
 
-    for sn in network.sub_networks.obj:
-        sn._branches = sn.branches()
-        sn.calculate_BODF()
+    for name, outage_i in pd.Series(np.arange(len(outages))).groupby(outage_sub_networks.values):
+        sn = network.sub_networks.at[name,"obj"]
+        sn.calculate_B_H(skip_pre=True)
 
-    p0 = pd.DataFrame(index=passive_branches.index)
+        branches_i = sn.branches_i()
+        rows = passive_branches.index.get_indexer(branches_i)
+        outage_i = outage_i.values
+        outage_positions = passive_branches.index.get_indexer([outages[i] for i in outage_i])
+        bodf = _lazy_bodf(sn).columns(branches_i.get_indexer([outages[i] for i in outage_i]))
 
-    p0["base"] = p0_base
+        #f_k^after = f_k^before + BODF_{kl} f_l^before for all snapshots
+        p0[:, rows[:,newaxis], 1 + outage_i] = (p0_base[:, rows, newaxis]
+                                                + bodf[newaxis,:,:]*p0_base[:, newaxis, outage_positions])
 
-    for branch in branch_outages:
-        if type(branch) is not tuple:
-            logger.warning("No type given for {}, assuming it is a line".format(branch))
-            branch = ("Line",branch)
+    return _contingency_frame(p0, snapshots, passive_branches, ["base"] + outages, single)
+
+
+def network_lpf_contingency_nk(network, snapshots=None, outage_sets=None):
+    """
+    Computes linear power flow for a selection of simultaneous branch
+    outages (N-k contingencies).
+
+    For an outage set M of k branches in a sub-network the flows after
+    the outage are given by the generalised BODF (also called LODF)
+
+    f^after = f^before + BPTDF_{:,M} (1 - BPTDF_{M,M})^{-1} f_M^before
+
+    with the branch PTDF BPTDF (see LazyBODF), which needs a k x k
+    solve per outage set. The solves are batched over all outage sets
+    with the same k and all snapshots. Outage sets spanning several
+    sub-networks are treated separately in each of them.
+
+    If 1 - BPTDF_{M,M} is singular, the outage set splits its
+    sub-network into islands; the flows after such outages are NaN
+    and a warning is given.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    outage_sets : list-like
+        A list of outage sets, each a list of passive branches as in
+        the branch_outages of network_lpf_contingency
+
+    Returns
+    -------
+    p0 : pandas.DataFrame
+        num_passive_branch x (1 + num_outage_sets) DataFrame of new
+        power flows for a single snapshot; the columns are "base" and
+        the outage sets as tuples of branches. For several snapshots
+        the frames are stacked with the index (snapshot, type, name).
+
+    """
+
+    single = _single_snapshot(snapshots)
+    snapshots = _as_snapshots(network, snapshots)
+
+    network.lpf(snapshots)
+
+    passive_branches = network.passive_branches()
+
+    outage_sets = [tuple(collections.OrderedDict.fromkeys(_branch_outages(network, outage_set, passive_branches)))
+                   for outage_set in outage_sets]
+
+    p0_base = _base_flows(network, snapshots, passive_branches)
+
+    p0 = np.full((len(snapshots), len(passive_branches), 1 + len(outage_sets)), np.nan)
+    p0[:,:,0] = p0_base
+
+    #the part of each outage set in each sub-network
+    parts = collections.defaultdict(list)
+    for s, outage_set in enumerate(outage_sets):
+        for name, branches in pd.Series(list(outage_set)).groupby(passive_branches.sub_network.reindex(outage_set).values):
+            parts[name].append((s, list(branches)))
+
+    islanded = np.zeros(len(outage_sets), dtype=bool)
+
+    for name, sn_parts in parts.items():
+        sn = network.sub_networks.at[name,"obj"]
+        sn.calculate_B_H(skip_pre=True)
+
+        branches_i = sn.branches_i()
+        rows = passive_branches.index.get_indexer(branches_i)
+
+        set_i = np.array([s for s, branches in sn_parts])
+        positions = [branches_i.get_indexer(branches) for s, branches in sn_parts]
+
+        #branch PTDF columns of all branches in the outage sets
+        outaged, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        branch_PTDF = _lazy_bodf(sn).branch_PTDF(outaged)
 
-        sn = network.sub_networks.obj[passive_branches.sub_network[branch]]
+        #start from the base flows and add the changes for each k
+        p0[:, rows[:,newaxis], 1 + set_i] = p0_base[:, rows, newaxis]
 
-        branch_i = sn._branches.index.get_loc(branch)
+        lengths = np.array([len(m) for m in positions])
+        offsets = np.r_[0, np.cumsum(lengths)]
+        for k in np.unique(lengths):
+            group = np.flatnonzero(lengths == k)
+            #columns in branch_PTDF of the outaged branches, sets x k
+            columns = np.array([inverse[offsets[g]:offsets[g]+k] for g in group])
+            M = outaged[columns]
 
-        p0_new = p0_base + pd.Series(sn.BODF[:,branch_i]*p0_base[branch],sn._branches.index)
+            #1 - BPTDF_{M,M} for each set, sets x k x k
+            A = np.eye(k)[newaxis,:,:] - branch_PTDF[M[:,:,newaxis], columns[:,newaxis,:]]
+            singular = np.linalg.svd(A, compute_uv=False).min(axis=1) <= _bridge_tol
+            A[singular] = np.eye(k)
 
-        p0[branch] = p0_new
+            #flows before the outage on the outaged branches, sets x k x snapshots
+            f_M = p0_base[:, rows[M]].transpose(1, 2, 0)
+            x = np.linalg.solve(A, f_M)
 
-    return p0
+            #snapshots x branches x sets
+            p0[:, rows[:,newaxis], 1 + set_i[group]] += np.einsum("lsk,skt->tls", branch_PTDF[:, columns], x)
 
+            #the outaged branches carry no flow
+            for g, m in zip(group, M):
+                p0[:, rows[m], 1 + set_i[g]] = 0.
 
+            islanded[set_i[group[singular]]] = True
+
+    if islanded.any():
+        logger.warning("The outage sets {} split their sub-networks; their flows are NaN"
+                       .format(", ".join(str(outage_sets[s]) for s in np.flatnonzero(islanded))))
+        p0[:, :, 1 + np.flatnonzero(islanded)] = np.nan
+
+    return _contingency_frame(p0, snapshots, passive_branches, ["base"] + outage_sets, single)
+
+def _single_snapshot(snapshots):
+    """Whether snapshots is a single snapshot rather than a list of them."""
+    return snapshots is not None and (isinstance(snapshots, six.string_types) or
+                                      not isinstance(snapshots, (collections.Sequence, pd.Index)))
+
+def _contingency_frame(p0, snapshots, passive_branches, columns, single):
+    """DataFrame of the snapshots x branches x cases array p0, stacked
+    with the index (snapshot, type, name) unless single."""
+
+    columns = pd.Index(columns, tupleize_cols=False)
+
+    if single:
+        return pd.DataFrame(p0[0], index=passive_branches.index, columns=columns)
+
+    index = pd.MultiIndex.from_arrays([snapshots.repeat(len(passive_branches))]
+                                      + [np.tile(passive_branches.index.get_level_values(i), len(snapshots))
+                                         for i in range(2)],
+                                      names=["snapshot"] + list(passive_branches.index.names))
+
+    return pd.DataFrame(p0.reshape(-1, len(columns)), index=index, columns=columns)
+
+
+
+
+_overload_columns = ["snapshot", "outage_type", "outage", "branch_type", "branch", "p0", "loading"]
+
+def iter_lpf_contingency_overloads(network, snapshots=None, branch_outages=None, rating_factor=1.,
+                                   block_size=100, snapshot_block_size=100):
+    """
+    Screen branch outages for overloads with the linear power flow.
+
+    The flows after the outages are computed as in
+    network_lpf_contingency, but only for blocks of block_size outages
+    and snapshot_block_size snapshots at a time, so that the memory
+    needed is bounded by the block sizes instead of the number of
+    branches times the number of outages. Only the overloads, i.e. the
+    flows larger than rating_factor times s_nom, are kept.
+
+    Outages which disconnect their sub-network (and for which the BODF
+    is singular) are skipped with a warning.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    branch_outages : list-like
+        A list of passive branches which are to be tested for outages.
+        If None, it's take as all network.passive_branches_i()
+    rating_factor : float, default 1.
+        Fraction of s_nom which may be used after an outage
+    block_size : int, default 100
+        Number of outages screened at once
+    snapshot_block_size : int, default 100
+        Number of snapshots screened at once
+
+    Yields
+    ------
+    overloads : pandas.DataFrame
+        The overloads in a block with the columns "snapshot",
+        "outage_type", "outage", "branch_type", "branch", "p0" (the
+        flow after the outage) and "loading" (abs(p0)/s_nom)
+    """
+
+    snapshots = _as_snapshots(network, snapshots)
+
+    network.lpf(snapshots)
+
+    passive_branches = network.passive_branches()
+
+    outages = _branch_outages(network, branch_outages, passive_branches)
+
+    p0_base = _base_flows(network, snapshots, passive_branches)
+    s_nom = passive_branches.s_nom.values
+
+    outage_types = np.array([o[0] for o in outages], dtype=object)
+    outage_names = np.array([o[1] for o in outages], dtype=object)
+
+    for t_i, o_i, b_i, bodf, p0 in _overload_blocks(network, snapshots, passive_branches, outages, p0_base,
+                                                    rating_factor*s_nom, block_size, snapshot_block_size):
+        yield pd.DataFrame(dict(snapshot=snapshots.values[t_i],
+                                outage_type=outage_types[o_i],
+                                outage=outage_names[o_i],
+                                branch_type=passive_branches.index.get_level_values(0).values[b_i],
+                                branch=passive_branches.index.get_level_values(1).values[b_i],
+                                p0=p0,
+                                loading=np.abs(p0)/s_nom[b_i]),
+                           columns=_overload_columns)
+
+def _overload_blocks(network, snapshots, passive_branches, outages, p0_base, limit,
+                     block_size=100, snapshot_block_size=100):
+    """
+    Yield the flows after the outages which exceed limit, in blocks of
+    outages and snapshots, as arrays of the positions of the snapshot
+    (in snapshots), the outage (in outages) and the branch (in
+    passive_branches), the BODF entry of the branch and the outage and
+    the flow after the outage. Outages which split their sub-network
+    are skipped with a warning.
+    """
+
+    outage_sub_networks = passive_branches.sub_network.reindex(outages)
+
+    for name, outage_i in pd.Series(np.arange(len(outages))).groupby(outage_sub_networks.values):
+        sn = network.sub_networks.at[name,"obj"]
+        sn.calculate_B_H(skip_pre=True)
+        sn_bodf = _lazy_bodf(sn)
+
+        branches_i = sn.branches_i()
+        rows = passive_branches.index.get_indexer(branches_i)
+        sn_limit = limit[rows]
+        outage_i = outage_i.values
+        outage_rows = branches_i.get_indexer([outages[i] for i in outage_i])
+
+        for o in range(0, len(outage_i), block_size):
+            bodf = sn_bodf.columns(outage_rows[o:o+block_size])
+            block_outage_i = outage_i[o:o+block_size]
+            block = outage_rows[o:o+block_size]
+
+            singular = ~np.isfinite(bodf).all(axis=0)
+            if singular.any():
+                logger.warning("Skipping the outages of {}, which disconnect sub-network {}"
+                               .format(", ".join(str(outages[i]) for i in block_outage_i[singular]), name))
+                bodf = bodf[:, ~singular]
+                block_outage_i = block_outage_i[~singular]
+                block = block[~singular]
+                if len(block) == 0:
+                    continue
+
+            for t in range(0, len(snapshots), snapshot_block_size):
+                f = p0_base[t:t+snapshot_block_size][:, rows]
+
+                #snapshots x monitored branches x outages
+                flows = f[:,:,newaxis] + bodf[newaxis,:,:]*f[:,newaxis,block]
+
+                t_i, b_i, o_i = np.nonzero(np.abs(flows) > sn_limit[newaxis,:,newaxis])
+                if len(t_i) == 0:
+                    continue
+
+                yield t + t_i, block_outage_i[o_i], rows[b_i], bodf[b_i, o_i], flows[t_i, b_i, o_i]
+
+def network_lpf_contingency_overloads(network, snapshots=None, branch_outages=None, rating_factor=1.,
+                                      block_size=100, snapshot_block_size=100, filename=None):
+    """
+    Find the branches which are overloaded after branch outages with
+    the linear power flow, see iter_lpf_contingency_overloads.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    branch_outages : list-like
+        A list of passive branches which are to be tested for outages.
+        If None, it's take as all network.passive_branches_i()
+    rating_factor : float, default 1.
+        Fraction of s_nom which may be used after an outage
+    block_size : int, default 100
+        Number of outages screened at once
+    snapshot_block_size : int, default 100
+        Number of snapshots screened at once
+    filename : None|string
+        If given, the overloads are appended block by block to this
+        file instead of being returned; a table "overloads" in an HDF5
+        store if it ends with ".h5" or ".hdf5" (needs pytables), else
+        a CSV file, which is overwritten.
+
+    Returns
+    -------
+    overloads : pandas.DataFrame|int
+        The overloads with the columns "snapshot", "outage_type",
+        "outage", "branch_type", "branch", "p0" and "loading", or
+        their number if they are written to filename
+    """
+
+    blocks = iter_lpf_contingency_overloads(network, snapshots, branch_outages, rating_factor,
+                                            block_size, snapshot_block_size)
+
+    if filename is None:
+        return pd.concat([pd.DataFrame(columns=_overload_columns)] + list(blocks), ignore_index=True)
+
+    n_overloads = 0
+    if filename.endswith((".h5", ".hdf5")):
+        names = network.passive_branches().index
+        min_itemsize = dict(outage_type=max(map(len, names.levels[0])), branch_type=max(map(len, names.levels[0])),
+                            outage=max(map(len, names.levels[1])), branch=max(map(len, names.levels[1])))
+        with pd.HDFStore(filename, mode="w") as store:
+            for block in blocks:
+                store.append("overloads", block, format="table", index=False,
+                             min_itemsize=min_itemsize)
+                n_overloads += len(block)
+    else:
+        pd.DataFrame(columns=_overload_columns).to_csv(filename, index=False)
+        for block in blocks:
+            block.to_csv(filename, mode="a", header=False, index=False)
+            n_overloads += len(block)
+
+    logger.info("Wrote %d overloads to %s", n_overloads, filename)
+
+    return n_overloads
 
 
 def network_sclopf(network, snapshots=None, branch_outages=None, solver_name="glpk",
                    skip_pre=False, extra_functionality=None, solver_options={},
-                   keep_files=False, formulation="angles", ptdf_tolerance=0.):
+                   keep_files=False, formulation="angles", ptdf_tolerance=0.,
+                   profile_file=None, profile_format="json", lazy=False,
+                   max_iterations=20, tolerance=1e-3):
     """
     Computes Security-Constrained Linear Optimal Power Flow (SCLOPF).
 
     This ensures that no branch is overloaded even given the branch outages.
 
+    With lazy=True the contingency constraints are generated
+    iteratively: the LOPF is solved without them, the flows after all
+    outages are screened with the BODF, constraints are added only for
+    the violated (outage, branch, snapshot) combinations and the LOPF
+    is re-solved, until no violations remain. If the solver is a pyomo
+    persistent solver (e.g. "gurobi_persistent"), the constraints are
+    added to the solver's model instead of rebuilding it.
+
     Parameters
     ----------
     snapshots : list or index slice
@@ -192,12 +771,39 @@ def network_sclopf(network, snapshots=None, branch_outages=None, solver_name="gl
         Formulation of the linear power flow equations to use; must be
         one of ["angles","cycles","kirchoff","ptdf"]
     ptdf_tolerance : float
+    profile_file : None|string
+        Wall time, CPU time and memory usage of each stage of the
+        optimisation are recorded in network.profile (see
+        pypsa.profiling.Profile); if not None, the profile is also
+        dumped to this file.
+    profile_format : string, default "json"
+        Format of `profile_file`, either "json" or "chrome" for the
+        Chrome trace event format.
+    lazy : bool, default False
+        Generate the contingency constraints iteratively, see above
+    max_iterations : int, default 20
+        With lazy=True, maximal number of times the LOPF is solved
+    tolerance : float, default 1e-3
+        With lazy=True, flows after an outage which exceed s_nom by
+        less than tolerance (in MW) are not considered violations
 
     Returns
     -------
-    None
+    status : string
+    termination_condition : string
+        As returned by network.lopf, of the last solve with lazy=True
     """
 
+    with profiling(network, "sclopf", profile_file, profile_format) as profile:
+        return _network_sclopf(network, snapshots, branch_outages, solver_name, skip_pre,
+                               extra_functionality, solver_options, keep_files,
+                               formulation, ptdf_tolerance, profile, lazy,
+                               max_iterations, tolerance)
+
+def _network_sclopf(network, snapshots, branch_outages, solver_name, skip_pre,
+                    extra_functionality, solver_options, keep_files, formulation,
+                    ptdf_tolerance, profile, lazy=False, max_iterations=20, tolerance=1e-3):
+
     if not skip_pre:
         network.determine_network_topology()
 
@@ -208,11 +814,18 @@ def network_sclopf(network, snapshots=None, branch_outages=None, solver_name="gl
     if branch_outages is None:
         branch_outages = passive_branches.index
 
+    if lazy:
+        return _network_sclopf_lazy(network, snapshots, branch_outages, solver_name,
+                                    extra_functionality, solver_options, keep_files,
+                                    formulation, ptdf_tolerance, profile, max_iterations,
+                                    tolerance)
+
     #prepare the sub networks by calculating BODF and preparing helper DataFrames
 
     for sn in network.sub_networks.obj:
 
-        sn.calculate_BODF()
+        with stage(profile, "calculate_BODF"):
+            sn.calculate_BODF()
 
         sn._branches = sn.branches()
         sn._branches["_i"] = range(sn._branches.shape[0])
@@ -246,7 +859,7 @@ def network_sclopf(network, snapshots=None, branch_outages=None, solver_name="gl
 
             flow_lower.update({(branch[0],branch[1],b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn]),(sub.BODF[sub._branches.at[b,"_i"],branch_i],network.model.passive_branch_p[branch[0],branch[1],sn])],">=",-sub._fixed_branches.at[b,"s_nom"]] for b in sub._fixed_branches.index for sn in snapshots})
 
-            flow_upper.update({(branch[0],branch[1],b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn]),(sub.BODF[sub._branches.at[b,"_i"],branch_i],network.model.passive_branch_p[branch[0],branch[1],sn]),(1,network.model.passive_branch_s_nom[b[0],b[1]])],">=",0] for b in sub._extendable_branches.index for sn in snapshots})
+            flow_lower.update({(branch[0],branch[1],b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn]),(sub.BODF[sub._branches.at[b,"_i"],branch_i],network.model.passive_branch_p[branch[0],branch[1],sn]),(1,network.model.passive_branch_s_nom[b[0],b[1]])],">=",0] for b in sub._extendable_branches.index for sn in snapshots})
 
 
         l_constraint(network.model,"contingency_flow_upper",flow_upper,branch_outage_keys,snapshots)
@@ -259,7 +872,104 @@ def network_sclopf(network, snapshots=None, branch_outages=None, solver_name="gl
 
     #need to skip preparation otherwise it recalculates the sub-networks
 
-    network.lopf(snapshots=snapshots, solver_name=solver_name, skip_pre=True,
-                 extra_functionality=add_contingency_constraints,
-                 solver_options=solver_options, keep_files=keep_files,
-                 formulation=formulation, ptdf_tolerance=ptdf_tolerance)
+    return network.lopf(snapshots=snapshots, solver_name=solver_name, skip_pre=True,
+                        extra_functionality=add_contingency_constraints,
+                        solver_options=solver_options, keep_files=keep_files,
+                        formulation=formulation, ptdf_tolerance=ptdf_tolerance)
+
+
+def _network_sclopf_lazy(network, snapshots, branch_outages, solver_name,
+                         extra_functionality, solver_options, keep_files, formulation,
+                         ptdf_tolerance, profile, max_iterations, tolerance):
+
+    passive_branches = network.passive_branches()
+
+    outages = _branch_outages(network, branch_outages, passive_branches)
+
+    for sn in network.sub_networks.obj:
+        sn.calculate_B_H()
+
+    network_lopf_build_model(network, snapshots, skip_pre=True, formulation=formulation,
+                             ptdf_tolerance=ptdf_tolerance)
+
+    if extra_functionality is not None:
+        extra_functionality(network, snapshots)
+
+    network_lopf_prepare_solver(network, solver_name=solver_name)
+
+    #the (outage, branch, snapshot, sign) for which constraints were added
+    added = set()
+
+    for iteration in range(max_iterations):
+
+        status, termination_condition = network_lopf_solve(network, snapshots, formulation=formulation,
+                                                           solver_options=solver_options,
+                                                           keep_files=keep_files, free_memory=set())
+
+        if (status, termination_condition) not in [("ok", "optimal"), ("warning", "other")]:
+            return status, termination_condition
+
+        with stage(profile, "screen_contingencies"):
+            passive_branches = network.passive_branches()
+            s_nom = passive_branches.s_nom_opt.where(passive_branches.s_nom_extendable,
+                                                     passive_branches.s_nom).values
+            p0_base = _base_flows(network, snapshots, passive_branches)
+
+            violations = []
+            for t_i, o_i, b_i, bodf, p0 in _overload_blocks(network, snapshots, passive_branches, outages,
+                                                            p0_base, s_nom + tolerance):
+                for t, o, b, coefficient, sign in zip(t_i, o_i, b_i, bodf, np.sign(p0)):
+                    key = (outages[o], passive_branches.index[b], snapshots[t], sign)
+                    if key not in added:
+                        added.add(key)
+                        violations.append(key + (coefficient,))
+
+        if not violations:
+            logger.info("No contingency violations left after %d iteration(s) with %d contingency constraints",
+                        iteration + 1, len(added))
+            break
+
+        if iteration == max_iterations - 1:
+            logger.warning("Stopping the SCLOPF after max_iterations=%d iterations with %d contingency violations left",
+                           max_iterations, len(violations))
+            break
+
+        logger.info("Adding %d contingency constraints in iteration %d", len(violations), iteration + 1)
+
+        with stage(profile, "add_contingency_constraints"):
+            _add_contingency_constraints(network, "contingency_flow_{}".format(iteration),
+                                         violations, passive_branches)
+
+    return status, termination_condition
+
+def _add_contingency_constraints(network, name, violations, passive_branches):
+    """Add the constraints |p_b + BODF_bc p_c| <= s_nom_b for the
+    violations (c, b, snapshot, sign, BODF_bc) as model.name, where sign
+    selects the upper or lower bound."""
+
+    model = network.model
+
+    index = []
+    var_ids = np.empty((len(violations), 3), dtype=object)
+    coeffs = np.zeros((len(violations), 3))
+    sense = []
+    rhs = np.zeros(len(violations))
+
+    for k, (outage, branch, snapshot, sign, coefficient) in enumerate(violations):
+        index.append(outage + branch + (snapshot,))
+        var_ids[k, 0] = model.passive_branch_p[branch + (snapshot,)]
+        var_ids[k, 1] = model.passive_branch_p[outage + (snapshot,)]
+        coeffs[k, :2] = (1., coefficient)
+        sense.append("<=" if sign > 0 else ">=")
+        if passive_branches.at[branch, "s_nom_extendable"]:
+            var_ids[k, 2] = model.passive_branch_s_nom[branch]
+            coeffs[k, 2] = -sign
+        else:
+            rhs[k] = sign*passive_branches.at[branch, "s_nom"]
+
+    l_constraint_array(model, name, index, var_ids, coeffs, sense, rhs)
+
+    if isinstance(network.opt, PersistentSolver):
+        constraints = getattr(model, name)
+        for key in index:
+            network.opt.add_constraint(constraints[key])
@@ -0,0 +1,934 @@
+## Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Array-based building of the linear optimal power flow.
+
+Each function mirrors the function of the same name in pypsa.opf, but
+defines its variables and constraints for all components and
+snapshots at once on the LinearProblem network.lp.
+"""
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+from six import iteritems
+
+__author__ = "Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)"
+__copyright__ = "Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS), GNU GPL 3"
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, coo_matrix, identity, kron
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .pf import (find_bus_controls, calculate_B_H, calculate_PTDF,
+                 find_tree, find_cycles)
+from .linopt import LinearProblem
+from .descriptors import get_switchable_as_dense, Dict, zsum
+from .profiling import active_profile, profiled, stage
+
+pd.Series.zsum = zsum
+
+inf = np.inf
+
+
+def _frame(value, snapshots, columns):
+    """DataFrame of snapshots x columns filled with value."""
+    return pd.DataFrame(value, index=snapshots, columns=columns, dtype=float)
+
+def _shift(ids, fill=-1):
+    """Shift an array of variable ids by one snapshot, filling the
+    first snapshot with `fill`."""
+    ids = np.asarray(ids, dtype=int)
+    return np.concatenate([np.full((1,) + ids.shape[1:], fill, dtype=int), ids[:-1]])
+
+def _snapshot_terms(ids, matrix):
+    """Apply the local sparse matrix (m x n) in each snapshot to the
+    variable ids (snapshots x n); the result is a sparse matrix with
+    one row per snapshot and row of `matrix` (snapshot-major)."""
+
+    ids = np.asarray(ids, dtype=int)
+    matrix = coo_matrix(matrix)
+    num_snapshots = ids.shape[0]
+    rows = (np.arange(num_snapshots)[:,np.newaxis]*matrix.shape[0] + matrix.row).ravel()
+    cols = ids[:, matrix.col].ravel()
+    vals = np.tile(matrix.data, num_snapshots)
+    keep = cols >= 0
+    return coo_matrix((vals[keep], (rows[keep], cols[keep])),
+                      shape=(num_snapshots*matrix.shape[0], cols.max()+1 if keep.any() else 0))
+
+def _balance_matrix(network, buses=None):
+    """Sparse matrix of the nodal balance expressions for the buses
+    (snapshot-major rows) with variable ids as columns."""
+
+    balance = network._p_balance
+    num_buses = len(network.buses.index)
+    num_snapshots = len(balance.constant.index)
+    B = csr_matrix((np.concatenate(balance.vals), (np.concatenate(balance.rows), np.concatenate(balance.cols))),
+                   shape=(num_snapshots*num_buses, network.lp.num_variables))
+    if buses is not None:
+        bus_i = network.buses.index.get_indexer(buses)
+        B = B[(np.arange(num_snapshots)[:,np.newaxis]*num_buses + bus_i).ravel()]
+    return B
+
+def _add_to_balance(network, buses, coeffs, ids):
+    """Add coeffs*x[ids] to the nodal balance of the buses, where ids
+    is a snapshots x components array and buses has one entry per
+    component."""
+
+    balance = network._p_balance
+    ids = np.asarray(ids, dtype=int)
+    num_buses = len(network.buses.index)
+    bus_i = network.buses.index.get_indexer(buses)
+    rows = np.arange(ids.shape[0])[:,np.newaxis]*num_buses + bus_i
+    keep = ids >= 0
+    balance.rows.append(rows[keep])
+    balance.cols.append(ids[keep])
+    balance.vals.append(np.broadcast_to(np.asarray(coeffs, dtype=float), ids.shape)[keep])
+
+
+def define_generator_variables_constraints(network,snapshots):
+
+    lp = network.lp
+    gens = network.generators
+
+    extendable_gens_i = gens.index[gens.p_nom_extendable]
+    fixed_gens_i = gens.index[~gens.p_nom_extendable & ~gens.committable]
+    fixed_committable_gens_i = gens.index[~gens.p_nom_extendable & gens.committable]
+
+    if (gens.p_nom_extendable & gens.committable).any():
+        logger.warning("The following generators have both investment optimisation and unit commitment:\n{}\nCurrently PyPSA cannot do both these functions, so PyPSA is choosing investment optimisation for these generators.".format(gens.index[gens.p_nom_extendable & gens.committable]))
+
+    p_min_pu = get_switchable_as_dense(network, 'Generator', 'p_min_pu', snapshots)
+    p_max_pu = get_switchable_as_dense(network, 'Generator', 'p_max_pu', snapshots)
+
+    ## Define generator dispatch variables ##
+
+    lower = p_min_pu.multiply(gens.p_nom)
+    upper = p_max_pu.multiply(gens.p_nom)
+    lower.loc[:, gens.index.difference(fixed_gens_i)] = -inf
+    upper.loc[:, gens.index.difference(fixed_gens_i)] = inf
+
+    p = lp.add_variables("generator_p", lower, upper)
+
+    ## Define generator capacity variables if generator is extendable ##
+
+    p_nom = lp.add_variables("generator_p_nom",
+                             gens.loc[extendable_gens_i, "p_nom_min"].clip(lower=0.),
+                             gens.loc[extendable_gens_i, "p_nom_max"])
+
+    ## Define generator dispatch constraints for extendable generators ##
+
+    zeros = _frame(0., snapshots, extendable_gens_i)
+
+    lp.add_constraints("generator_p_lower",
+                       [(1, p[extendable_gens_i]), (-p_min_pu[extendable_gens_i], p_nom.values)],
+                       ">=", zeros)
+
+    lp.add_constraints("generator_p_upper",
+                       [(1, p[extendable_gens_i]), (-p_max_pu[extendable_gens_i], p_nom.values)],
+                       "<=", zeros)
+
+    ## Define committable generator statuses ##
+
+    status = lp.add_variables("generator_status",
+                              _frame(0., snapshots, fixed_committable_gens_i),
+                              1., binary=True)
+
+    var_lower = p_min_pu[fixed_committable_gens_i].multiply(gens.loc[fixed_committable_gens_i, 'p_nom'])
+    var_upper = p_max_pu[fixed_committable_gens_i].multiply(gens.loc[fixed_committable_gens_i, 'p_nom'])
+
+    zeros = _frame(0., snapshots, fixed_committable_gens_i)
+
+    lp.add_constraints("committable_gen_p_lower",
+                       [(var_lower, status), (-1, p[fixed_committable_gens_i])],
+                       "<=", zeros)
+
+    lp.add_constraints("committable_gen_p_upper",
+                       [(var_upper, status), (-1, p[fixed_committable_gens_i])],
+                       ">=", zeros)
+
+    num_snapshots = len(snapshots)
+
+    ## Deal with minimum up time ##
+
+    up_time_gens = fixed_committable_gens_i[gens.loc[fixed_committable_gens_i,"min_up_time"] > 0]
+
+    for gen_i, gen in enumerate(up_time_gens):
+
+        min_up_time = int(gens.at[gen,"min_up_time"])
+        initial_status = gens.at[gen,"initial_status"]
+
+        blocks = max(1,num_snapshots-min_up_time+1)
+
+        gen_status = status[gen].values
+        window = np.arange(blocks)[:,np.newaxis] + np.arange(min_up_time)
+        window_ids = np.where(window < num_snapshots, gen_status[np.minimum(window, num_snapshots-1)], -1)
+
+        rhs = pd.Series(0., index=range(blocks))
+        rhs.iat[0] = -min_up_time*initial_status
+
+        lp.add_constraints("gen_up_time_{}".format(gen_i),
+                           [(1, window_ids[:,j]) for j in range(min_up_time)]
+                           + [(-min_up_time, gen_status[:blocks]),
+                              (min_up_time, _shift(gen_status[:blocks]))],
+                           ">=", rhs)
+
+    ## Deal with minimum down time ##
+
+    down_time_gens = fixed_committable_gens_i[gens.loc[fixed_committable_gens_i,"min_down_time"] > 0]
+
+    for gen_i, gen in enumerate(down_time_gens):
+
+        min_down_time = int(gens.at[gen,"min_down_time"])
+        initial_status = gens.at[gen,"initial_status"]
+
+        blocks = max(1,num_snapshots-min_down_time+1)
+
+        gen_status = status[gen].values
+        window = np.arange(blocks)[:,np.newaxis] + np.arange(min_down_time)
+        window_ids = np.where(window < num_snapshots, gen_status[np.minimum(window, num_snapshots-1)], -1)
+
+        #sum of 1-status
+        rhs = pd.Series(-float(min_down_time), index=range(blocks))
+        rhs.iat[0] += min_down_time*initial_status
+
+        lp.add_constraints("gen_down_time_{}".format(gen_i),
+                           [(-1, window_ids[:,j]) for j in range(min_down_time)]
+                           + [(min_down_time, gen_status[:blocks]),
+                              (-min_down_time, _shift(gen_status[:blocks]))],
+                           ">=", rhs)
+
+    ## Deal with start up costs ##
+
+    suc_gens = fixed_committable_gens_i[gens.loc[fixed_committable_gens_i,"start_up_cost"] > 0]
+
+    start_up_cost = lp.add_variables("generator_start_up_cost", _frame(0., snapshots, suc_gens))
+
+    suc = gens.loc[suc_gens, "start_up_cost"]
+    rhs = _frame(0., snapshots, suc_gens)
+    rhs.iloc[0] = -suc*gens.loc[suc_gens, "initial_status"]
+
+    lp.add_constraints("generator_start_up",
+                       [(1, start_up_cost), (-suc, status[suc_gens]), (suc, _shift(status[suc_gens]))],
+                       ">=", rhs)
+
+    ## Deal with shut down costs ##
+
+    sdc_gens = fixed_committable_gens_i[gens.loc[fixed_committable_gens_i,"shut_down_cost"] > 0]
+
+    shut_down_cost = lp.add_variables("generator_shut_down_cost", _frame(0., snapshots, sdc_gens))
+
+    sdc = gens.loc[sdc_gens, "shut_down_cost"]
+    rhs = _frame(0., snapshots, sdc_gens)
+    rhs.iloc[0] = sdc*gens.loc[sdc_gens, "initial_status"]
+
+    lp.add_constraints("generator_shut_down",
+                       [(1, shut_down_cost), (sdc, status[sdc_gens]), (-sdc, _shift(status[sdc_gens]))],
+                       ">=", rhs)
+
+    ## Deal with ramp limits without unit commitment ##
+
+    p_nom_ids = p_nom.reindex(gens.index, fill_value=-1)
+    status_ids = status.reindex(columns=gens.index, fill_value=-1)
+
+    fix_b = ~gens.p_nom_extendable & ~gens.committable
+
+    for direction in ["up", "down"]:
+        r_gens = gens.index[gens["ramp_limit_" + direction].notnull()]
+        g = gens.loc[r_gens]
+
+        p_cur = p.loc[snapshots[1:], r_gens]
+        p_prev = p.loc[snapshots[:-1], r_gens].values
+        s_cur = status_ids.loc[snapshots[1:], r_gens].values
+        s_prev = status_ids.loc[snapshots[:-1], r_gens].values
+
+        if direction == "up":
+            lhs = [(1, p_cur), (-1, p_prev),
+                   (-g.ramp_limit_up, p_nom_ids[r_gens].values),
+                   ((g.ramp_limit_start_up - g.ramp_limit_up)*g.p_nom, s_prev),
+                   (-g.ramp_limit_start_up*g.p_nom, s_cur)]
+            rhs = (g.ramp_limit_up*g.p_nom).where(fix_b[r_gens], 0.)
+            sense = "<="
+        else:
+            lhs = [(1, p_cur), (-1, p_prev),
+                   (g.ramp_limit_down, p_nom_ids[r_gens].values),
+                   ((g.ramp_limit_down - g.ramp_limit_shut_down)*g.p_nom, s_cur),
+                   (g.ramp_limit_shut_down*g.p_nom, s_prev)]
+            rhs = (-g.ramp_limit_down*g.p_nom).where(fix_b[r_gens], 0.)
+            sense = ">="
+
+        lp.add_constraints("ramp_" + direction, lhs, sense,
+                           _frame(0., snapshots[1:], r_gens) + rhs)
+
+
+
+def define_storage_variables_constraints(network,snapshots):
+
+    lp = network.lp
+    sus = network.storage_units
+    ext_sus_i = sus.index[sus.p_nom_extendable]
+    fix_sus_i = sus.index[~ sus.p_nom_extendable]
+
+    ## Define storage dispatch variables ##
+
+    p_max_pu = get_switchable_as_dense(network, 'StorageUnit', 'p_max_pu', snapshots)
+    p_min_pu = get_switchable_as_dense(network, 'StorageUnit', 'p_min_pu', snapshots)
+
+    upper = p_max_pu.multiply(sus.p_nom)
+    upper.loc[:, ext_sus_i] = inf
+    p_dispatch = lp.add_variables("storage_p_dispatch", 0., upper)
+
+    upper = -p_min_pu.multiply(sus.p_nom)
+    upper.loc[:, ext_sus_i] = inf
+    p_store = lp.add_variables("storage_p_store", 0., upper)
+
+    ## Define spillage variables only for hours with inflow>0. ##
+    inflow = get_switchable_as_dense(network, 'StorageUnit', 'inflow', snapshots)
+    p_spill = lp.add_variables("storage_p_spill", 0., inflow, mask=(inflow > 0).values)
+
+    ## Define generator capacity variables if generator is extendable ##
+
+    p_nom = lp.add_variables("storage_p_nom",
+                             sus.loc[ext_sus_i, "p_nom_min"].clip(lower=0.),
+                             sus.loc[ext_sus_i, "p_nom_max"])
+
+    ## Define generator dispatch constraints for extendable generators ##
+
+    zeros = _frame(0., snapshots, ext_sus_i)
+
+    lp.add_constraints("storage_p_upper",
+                       [(1, p_dispatch[ext_sus_i]), (-p_max_pu[ext_sus_i], p_nom.values)],
+                       "<=", zeros)
+
+    lp.add_constraints("storage_p_lower",
+                       [(1, p_store[ext_sus_i]), (p_min_pu[ext_sus_i], p_nom.values)],
+                       "<=", zeros)
+
+    ## Now define state of charge constraints ##
+
+    soc = lp.add_variables("state_of_charge", _frame(0., snapshots, sus.index))
+
+    p_nom_ids = p_nom.reindex(sus.index, fill_value=-1).values
+
+    rhs = _frame(0., snapshots, sus.index)
+    rhs.loc[:, fix_sus_i] += (sus.max_hours*sus.p_nom)[fix_sus_i]
+
+    lp.add_constraints("state_of_charge_upper",
+                       [(1, soc), (-sus.max_hours, p_nom_ids)],
+                       "<=", rhs)
+
+    #this builds the constraint previous_soc + p_store - p_dispatch + inflow - spill == soc
+    #it is complicated by the fact that sometimes previous_soc and soc are floats, not variables
+    elapsed_hours = network.snapshot_weightings.loc[snapshots].values[:,np.newaxis]
+    standing = (1-sus.standing_loss).values**elapsed_hours
+
+    soc_ids = soc.values
+    non_cyclic = ~sus.cyclic_state_of_charge.values.astype(bool)
+
+    previous = np.roll(soc_ids, 1, axis=0)
+    previous[0, non_cyclic] = -1
+
+    rhs = np.zeros(soc_ids.shape)
+    rhs[0, non_cyclic] -= standing[0, non_cyclic]*sus.state_of_charge_initial.values[non_cyclic]
+
+    #store the combinations with a fixed soc
+    state_of_charge_set = get_switchable_as_dense(network, 'StorageUnit', 'state_of_charge_set', snapshots)
+    fixed = state_of_charge_set.notnull().values
+    rhs += np.where(fixed, state_of_charge_set.fillna(0.).values, 0.)
+
+    rhs -= inflow.values*elapsed_hours
+
+    lp.add_constraints("state_of_charge_constraint",
+                       [(standing, previous),
+                        (-1, np.where(fixed, -1, soc_ids)),
+                        (sus.efficiency_store.values*elapsed_hours, p_store),
+                        (-(1/sus.efficiency_dispatch.values)*elapsed_hours, p_dispatch),
+                        (-elapsed_hours, p_spill)],
+                       "==", _frame(rhs, snapshots, sus.index))
+
+    #make sure the variable is also set to the fixed state of charge
+    lp.add_constraints("state_of_charge_constraint_fixed", [(1, soc)],
+                       "==", state_of_charge_set.fillna(0.), mask=fixed)
+
+
+
+def define_store_variables_constraints(network,snapshots):
+
+    lp = network.lp
+    stores = network.stores
+    ext_stores = stores.index[stores.e_nom_extendable]
+    fix_stores = stores.index[~ stores.e_nom_extendable]
+
+    e_max_pu = get_switchable_as_dense(network, 'Store', 'e_max_pu', snapshots)
+    e_min_pu = get_switchable_as_dense(network, 'Store', 'e_min_pu', snapshots)
+
+    ## Define store dispatch variables ##
+
+    store_p = lp.add_variables("store_p", _frame(-inf, snapshots, stores.index))
+
+    ## Define store energy variables ##
+
+    lower = e_min_pu.multiply(stores.e_nom)
+    upper = e_max_pu.multiply(stores.e_nom)
+    lower.loc[:, ext_stores] = -inf
+    upper.loc[:, ext_stores] = inf
+
+    store_e = lp.add_variables("store_e", lower, upper)
+
+    ## Define energy capacity variables if store is extendable ##
+
+    e_nom = lp.add_variables("store_e_nom",
+                             stores.loc[ext_stores, "e_nom_min"],
+                             stores.loc[ext_stores, "e_nom_max"])
+
+    ## Define energy capacity constraints for extendable generators ##
+
+    zeros = _frame(0., snapshots, ext_stores)
+
+    lp.add_constraints("store_e_upper",
+                       [(1, store_e[ext_stores]), (-e_max_pu[ext_stores], e_nom.values)],
+                       "<=", zeros)
+
+    lp.add_constraints("store_e_lower",
+                       [(1, store_e[ext_stores]), (-e_min_pu[ext_stores], e_nom.values)],
+                       ">=", zeros)
+
+    ## Builds the constraint previous_e - p == e ##
+
+    elapsed_hours = network.snapshot_weightings.loc[snapshots].values[:,np.newaxis]
+    standing = (1-stores.standing_loss).values**elapsed_hours
+
+    non_cyclic = ~stores.e_cyclic.values.astype(bool)
+
+    previous = np.roll(store_e.values, 1, axis=0)
+    previous[0, non_cyclic] = -1
+
+    rhs = np.zeros(store_e.shape)
+    rhs[0, non_cyclic] -= standing[0, non_cyclic]*stores.e_initial.values[non_cyclic]
+
+    lp.add_constraints("store_constraint",
+                       [(-1, store_e), (standing, previous), (-elapsed_hours, store_p)],
+                       "==", _frame(rhs, snapshots, stores.index))
+
+
+
+def define_branch_extension_variables(network,snapshots):
+
+    lp = network.lp
+
+    passive_branches = network.passive_branches()
+
+    extendable_passive_branches = passive_branches[passive_branches.s_nom_extendable.astype(bool)]
+
+    lp.add_variables("passive_branch_s_nom",
+                     extendable_passive_branches.s_nom_min.astype(float).clip(lower=0.),
+                     extendable_passive_branches.s_nom_max.astype(float))
+
+    extendable_links = network.links[network.links.p_nom_extendable]
+
+    lp.add_variables("link_p_nom",
+                     extendable_links.p_nom_min.clip(lower=0.),
+                     extendable_links.p_nom_max)
+
+
+def define_link_flows(network,snapshots):
+
+    lp = network.lp
+    links = network.links
+
+    extendable_links_i = links.index[links.p_nom_extendable]
+
+    fixed_links_i = links.index[~ links.p_nom_extendable]
+
+    p_max_pu = get_switchable_as_dense(network, 'Link', 'p_max_pu', snapshots)
+    p_min_pu = get_switchable_as_dense(network, 'Link', 'p_min_pu', snapshots)
+
+    link_p = lp.add_variables("link_p", _frame(-inf, snapshots, links.index))
+
+    p_nom_ids = lp.variables.link_p_nom.reindex(links.index, fill_value=-1).values
+
+
+    rhs = p_max_pu.multiply(links.p_nom)
+    rhs.loc[:, extendable_links_i] = 0.
+
+    lp.add_constraints("link_p_upper",
+                       [(1, link_p), (-p_max_pu, p_nom_ids)],
+                       "<=", rhs)
+
+    rhs = p_min_pu.multiply(links.p_nom)
+    rhs.loc[:, extendable_links_i] = 0.
+
+    lp.add_constraints("link_p_lower",
+                       [(1, link_p), (-p_min_pu, p_nom_ids)],
+                       ">=", rhs)
+
+
+
+def define_passive_branch_flows(network,snapshots,formulation="angles",ptdf_tolerance=0.):
+
+    if formulation == "angles":
+        define_passive_branch_flows_with_angles(network,snapshots)
+    elif formulation == "ptdf":
+        define_passive_branch_flows_with_PTDF(network,snapshots,ptdf_tolerance)
+    elif formulation == "cycles":
+        define_passive_branch_flows_with_cycles(network,snapshots)
+    elif formulation == "kirchhoff":
+        define_passive_branch_flows_with_kirchhoff(network,snapshots)
+
+
+def define_passive_branch_flows_with_angles(network,snapshots):
+
+    lp = network.lp
+
+    voltage_angles = lp.add_variables("voltage_angles", _frame(-inf, snapshots, network.buses.index))
+
+    slack_buses = network.sub_networks.slack_bus
+
+    lp.add_constraints("slack_angle", [(1, voltage_angles.loc[:, slack_buses].values)],
+                       "==", _frame(0., snapshots, network.sub_networks.index))
+
+    passive_branches = network.passive_branches()
+
+    passive_branch_p = lp.add_variables("passive_branch_p", _frame(-inf, snapshots, passive_branches.index))
+
+    carrier = passive_branches.sub_network.map(network.sub_networks.carrier)
+    y = 1/passive_branches.x_pu_eff.where(carrier != "DC", passive_branches.r_pu_eff).astype(float)
+
+    is_transformer = passive_branches.index.get_level_values(0) == "Transformer"
+    shift = np.where(is_transformer,
+                     passive_branches.phase_shift.fillna(0.).astype(float)*np.pi/180., 0.)
+
+    lp.add_constraints("passive_branch_p_def",
+                       [(y.values, voltage_angles.loc[:, passive_branches.bus0].values),
+                        (-y.values, voltage_angles.loc[:, passive_branches.bus1].values),
+                        (-1, passive_branch_p)],
+                       "==", _frame(0., snapshots, passive_branches.index) + y.values*shift)
+
+
+def define_passive_branch_flows_with_PTDF(network,snapshots,ptdf_tolerance=0.):
+
+    lp = network.lp
+
+    passive_branches = network.passive_branches()
+
+    passive_branch_p = lp.add_variables("passive_branch_p", _frame(-inf, snapshots, passive_branches.index))
+
+    num_snapshots = len(snapshots)
+    num_branches = len(passive_branches.index)
+
+    flows = []
+    rhs = _frame(0., snapshots, passive_branches.index)
+
+    for sub_network in network.sub_networks.obj:
+        find_bus_controls(sub_network)
+
+        branches_i = sub_network.branches_i()
+        if len(branches_i) == 0:
+            continue
+
+        calculate_PTDF(sub_network)
+
+        #kill small PTDF values
+        sub_network.PTDF[abs(sub_network.PTDF) < ptdf_tolerance] = 0
+
+        PTDF = csr_matrix(sub_network.PTDF)
+        branch_pos = passive_branches.index.get_indexer(branches_i)
+
+        #PTDF times the nodal balance in each snapshot
+        flow = (kron(identity(num_snapshots), PTDF) * _balance_matrix(network, sub_network.buses_o)).tocoo()
+        rows = (np.arange(num_snapshots)[:,np.newaxis]*num_branches + branch_pos).ravel()[flow.row]
+        flows.append(coo_matrix((flow.data, (rows, flow.col)),
+                                shape=(num_snapshots*num_branches, lp.num_variables)))
+
+        rhs.iloc[:, branch_pos] = -(PTDF * network._p_balance.constant.loc[:, sub_network.buses_o].values.T).T
+
+    lp.add_constraints("passive_branch_p_def", flows + [(-1, passive_branch_p)], "==", rhs)
+
+
+def define_sub_network_cycle_constraints(network, snapshots, name="cycle_constraints"):
+    """Constructs cycle constraints for all sub-networks and returns the
+    index of the cycles"""
+
+    lp = network.lp
+    passive_branch_p = lp.variables.passive_branch_p
+    passive_branches_i = passive_branch_p.columns
+
+    cycle_index = []
+    cycle_terms = []
+
+    for subnetwork in network.sub_networks.obj:
+        branches = subnetwork.branches()
+        attribute = "r_pu_eff" if network.sub_networks.at[subnetwork.name,"carrier"] == "DC" else "x_pu_eff"
+
+        C = csr_matrix(subnetwork.C)
+        cycles_j = np.unique(C.nonzero()[1])
+        if len(cycles_j) == 0:
+            continue
+
+        weights = C[:, cycles_j].T.multiply(1e5 * branches[attribute].values.astype(float))
+        branch_ids = passive_branch_p.values[:, passive_branches_i.get_indexer(branches.index)]
+
+        cycle_index.extend((subnetwork.name, j) for j in cycles_j)
+        cycle_terms.append((weights, branch_ids))
+
+    cycle_index = pd.MultiIndex.from_tuples(cycle_index) if cycle_index else pd.Index([])
+
+    num_snapshots = len(snapshots)
+    num_cycles = len(cycle_index)
+    lhs = []
+    offset = 0
+    for weights, branch_ids in cycle_terms:
+        term = _snapshot_terms(branch_ids, weights)
+        rows = (np.arange(num_snapshots)[:,np.newaxis]*num_cycles + offset + np.arange(weights.shape[0])).ravel()[term.row]
+        lhs.append(coo_matrix((term.data, (rows, term.col)),
+                              shape=(num_snapshots*num_cycles, lp.num_variables)))
+        offset += weights.shape[0]
+
+    lp.add_constraints(name, lhs, "==", _frame(0., snapshots, cycle_index))
+
+    return cycle_index
+
+
+def define_passive_branch_flows_with_cycles(network,snapshots):
+
+    lp = network.lp
+
+    for sub_network in network.sub_networks.obj:
+        find_tree(sub_network)
+        find_cycles(sub_network)
+
+        #following is necessary to calculate angles post-facto
+        find_bus_controls(sub_network)
+        if len(sub_network.branches_i()) > 0:
+            calculate_B_H(sub_network)
+
+    passive_branches = network.passive_branches()
+
+    passive_branch_p = lp.add_variables("passive_branch_p", _frame(-inf, snapshots, passive_branches.index))
+
+    cycle_index = define_sub_network_cycle_constraints(network, snapshots)
+
+    cycles = lp.add_variables("cycles", _frame(-inf, snapshots, cycle_index))
+
+    num_snapshots = len(snapshots)
+    num_branches = len(passive_branches.index)
+
+    flows = []
+    rhs = _frame(0., snapshots, passive_branches.index)
+
+    for subnetwork in network.sub_networks.obj:
+        branches_i = subnetwork.branches_i()
+        if len(branches_i) == 0:
+            continue
+
+        buses_i = subnetwork.buses_i()
+        branch_pos = passive_branches.index.get_indexer(branches_i)
+        branch_rows = (np.arange(num_snapshots)[:,np.newaxis]*num_branches + branch_pos).ravel()
+
+        def add_flow(flow):
+            flow = flow.tocoo()
+            flows.append(coo_matrix((flow.data, (branch_rows[flow.row], flow.col)),
+                                    shape=(num_snapshots*num_branches, lp.num_variables)))
+
+        C = csr_matrix(subnetwork.C)
+        cycles_j = np.unique(C.nonzero()[1])
+        if len(cycles_j):
+            cycle_ids = cycles.loc[:, [(subnetwork.name, j) for j in cycles_j]].values
+            add_flow(_snapshot_terms(cycle_ids, C[:, cycles_j]))
+
+        T = csr_matrix(subnetwork.T)
+        add_flow(kron(identity(num_snapshots), T) * _balance_matrix(network, buses_i))
+
+        rhs.iloc[:, branch_pos] = -(T * network._p_balance.constant.loc[:, buses_i].values.T).T
+
+    lp.add_constraints("passive_branch_p_def", flows + [(-1, passive_branch_p)], "==", rhs)
+
+
+
+def define_passive_branch_flows_with_kirchhoff(network,snapshots,skip_vars=False):
+    """ define passive branch flows with the kirchoff method """
+
+    lp = network.lp
+
+    for sub_network in network.sub_networks.obj:
+        find_tree(sub_network)
+        find_cycles(sub_network)
+
+        #following is necessary to calculate angles post-facto
+        find_bus_controls(sub_network)
+        if len(sub_network.branches_i()) > 0:
+            calculate_B_H(sub_network)
+
+    passive_branches = network.passive_branches()
+
+    if not skip_vars:
+        lp.add_variables("passive_branch_p", _frame(-inf, snapshots, passive_branches.index))
+
+    define_sub_network_cycle_constraints(network, snapshots)
+
+
+def define_passive_branch_constraints(network,snapshots):
+
+    lp = network.lp
+
+    passive_branches = network.passive_branches()
+    extendable_b = passive_branches.s_nom_extendable.astype(bool).values
+
+    s_max_pu = pd.concat({c : get_switchable_as_dense(network, c, 's_max_pu', snapshots)
+                          for c in network.passive_branch_components}, axis=1, sort=False) \
+                 .reindex(columns=passive_branches.index)
+
+    passive_branch_p = lp.variables.passive_branch_p
+    s_nom_ids = lp.variables.passive_branch_s_nom.reindex(passive_branches.index, fill_value=-1).values
+
+    s_max = s_max_pu.multiply(np.where(extendable_b, 0., passive_branches.s_nom.astype(float).values), axis=1)
+
+    lp.add_constraints("flow_upper", [(1, passive_branch_p), (-s_max_pu, s_nom_ids)],
+                       "<=", s_max)
+
+    lp.add_constraints("flow_lower", [(1, passive_branch_p), (s_max_pu, s_nom_ids)],
+                       ">=", -s_max)
+
+
+def define_nodal_balances(network,snapshots):
+    """Construct the nodal balance for all elements except the passive
+    branches.
+
+    Store the nodal balance as sparse triplets and a constant in
+    network._p_balance.
+    """
+
+    lp = network.lp
+
+    network._p_balance = Dict(rows=[], cols=[], vals=[],
+                              constant=_frame(0., snapshots, network.buses.index))
+
+    links = network.links
+    link_p = lp.variables.link_p
+
+    efficiency = get_switchable_as_dense(network, 'Link', 'efficiency', snapshots)
+
+    _add_to_balance(network, links.bus0, -1, link_p)
+    _add_to_balance(network, links.bus1, efficiency, link_p)
+
+    #Add any other buses to which the links are attached
+    for i in [int(col[3:]) for col in links.columns if col[:3] == "bus" and col not in ["bus0","bus1"]]:
+        efficiency = get_switchable_as_dense(network, 'Link', 'efficiency{}'.format(i), snapshots)
+        links_i = links.index[links["bus{}".format(i)] != ""]
+        _add_to_balance(network, links.loc[links_i, "bus{}".format(i)],
+                        efficiency[links_i], link_p[links_i])
+
+    gens = network.generators
+    _add_to_balance(network, gens.bus, gens.sign.values, lp.variables.generator_p)
+
+    loads = network.loads
+    load_p_set = get_switchable_as_dense(network, 'Load', 'p_set', snapshots)
+    network._p_balance.constant += (load_p_set.multiply(loads.sign)
+                                    .groupby(loads.bus, axis=1).sum()
+                                    .reindex(columns=network.buses.index, fill_value=0.))
+
+    sus = network.storage_units
+    _add_to_balance(network, sus.bus, sus.sign.values, lp.variables.storage_p_dispatch)
+    _add_to_balance(network, sus.bus, -sus.sign.values, lp.variables.storage_p_store)
+
+    stores = network.stores
+    _add_to_balance(network, stores.bus, stores.sign.values, lp.variables.store_p)
+
+
+def define_nodal_balance_constraints(network,snapshots):
+
+    lp = network.lp
+
+    passive_branches = network.passive_branches()
+    passive_branch_p = lp.variables.passive_branch_p
+
+    _add_to_balance(network, passive_branches.bus0, -1, passive_branch_p)
+    _add_to_balance(network, passive_branches.bus1, 1, passive_branch_p)
+
+    lp.add_constraints("power_balance", [_balance_matrix(network)],
+                       "==", -network._p_balance.constant)
+
+
+def define_sub_network_balance_constraints(network,snapshots):
+
+    lp = network.lp
+
+    buses = network.buses
+    sub_networks_i = network.sub_networks.index
+    S = csr_matrix((np.ones(len(buses.index)),
+                    (sub_networks_i.get_indexer(buses.sub_network), np.arange(len(buses.index)))),
+                   shape=(len(sub_networks_i), len(buses.index)))
+
+    lhs = kron(identity(len(snapshots)), S) * _balance_matrix(network)
+    rhs = -(S * network._p_balance.constant.values.T).T
+
+    lp.add_constraints("sub_network_balance_constraint", [lhs],
+                       "==", _frame(rhs, snapshots, sub_networks_i))
+
+
+def define_global_constraints(network,snapshots):
+
+    lp = network.lp
+
+    global_constraints = network.global_constraints
+
+    rows = []
+    cols = []
+    vals = []
+    rhs = pd.Series(0., index=global_constraints.index)
+    is_primary_energy = (global_constraints.type == "primary_energy").values
+
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,np.newaxis]
+
+    for i, gc in enumerate(global_constraints.index):
+        if not is_primary_energy[i]:
+            continue
+
+        constant = global_constraints.at[gc,"constant"]
+
+        carrier_attribute = global_constraints.at[gc,"carrier_attribute"]
+
+        for carrier in network.carriers.index:
+            attribute = network.carriers.at[carrier,carrier_attribute]
+            if attribute == 0.:
+                continue
+
+            #for generators, use the prime mover carrier
+            gens = network.generators.index[network.generators.carrier == carrier]
+            ids = lp.variables.generator_p.loc[:, gens].values
+            coeffs = attribute * (1/network.generators.loc[gens, "efficiency"].values) * weightings
+            cols.append(ids.ravel())
+            vals.append(np.broadcast_to(coeffs, ids.shape).ravel())
+
+            #for storage units, use the prime mover carrier
+            #take difference of energy at end and start of period
+            sus = network.storage_units.index[(network.storage_units.carrier == carrier) & (~network.storage_units.cyclic_state_of_charge)]
+            cols.append(lp.variables.state_of_charge.loc[snapshots[-1], sus].values)
+            vals.append(np.full(len(sus), -attribute))
+            constant -= attribute*network.storage_units.loc[sus, "state_of_charge_initial"].zsum()
+
+            #for stores, inherit the carrier from the bus
+            #take difference of energy at end and start of period
+            stores = network.stores.index[(network.stores.bus.map(network.buses.carrier) == carrier) & (~network.stores.e_cyclic)]
+            cols.append(lp.variables.store_e.loc[snapshots[-1], stores].values)
+            vals.append(np.full(len(stores), -attribute))
+            constant -= attribute*network.stores.loc[stores, "e_initial"].zsum()
+
+            rows.append(np.full(len(cols[-3]) + len(cols[-2]) + len(cols[-1]), i))
+
+        rhs.iat[i] = constant
+
+    cat = lambda l, dtype=float: np.concatenate(l) if l else np.empty(0, dtype=dtype)
+    lhs = coo_matrix((cat(vals), (cat(rows, int), cat(cols, int))),
+                     shape=(len(global_constraints.index), lp.num_variables))
+
+    lp.add_constraints("global_constraints", [lhs], global_constraints.sense.values,
+                       rhs, mask=is_primary_energy)
+
+
+
+def define_linear_objective(network,snapshots):
+
+    lp = network.lp
+
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,np.newaxis]
+
+    for c, attr, var in [("Generator", "marginal_cost", "generator_p"),
+                         ("StorageUnit", "marginal_cost", "storage_p_dispatch"),
+                         ("Store", "marginal_cost", "store_p"),
+                         ("Link", "marginal_cost", "link_p")]:
+        marginal_cost = get_switchable_as_dense(network, c, attr, snapshots)
+        lp.add_objective(marginal_cost.values * weightings, lp.variables[var])
+
+    #NB: for capital costs we subtract the costs of existing infrastructure p_nom/s_nom
+
+    passive_branches = network.passive_branches()
+
+    for df, attr, var in [(network.generators, "p_nom", "generator_p_nom"),
+                          (network.storage_units, "p_nom", "storage_p_nom"),
+                          (network.stores, "e_nom", "store_e_nom"),
+                          (passive_branches, "s_nom", "passive_branch_s_nom"),
+                          (network.links, "p_nom", "link_p_nom")]:
+        ext = df[df[attr + "_extendable"].astype(bool)]
+        lp.add_objective(ext.capital_cost.values.astype(float), lp.variables[var],
+                         -(ext.capital_cost * ext[attr]).zsum())
+
+    ## Unit commitment costs
+
+    lp.add_objective(1, lp.variables.generator_start_up_cost)
+
+    lp.add_objective(1, lp.variables.generator_shut_down_cost)
+
+
+def network_lopf_build_linear_problem(network, snapshots, formulation="angles", ptdf_tolerance=0.):
+    """
+    Build the linear optimal power flow for a group of snapshots as
+    an array-based LinearProblem.
+
+    The preliminary steps of computing topology, calculating dependent
+    values and finding slack buses must have been performed, as in
+    pypsa.opf.network_lopf_build_model.
+
+    Parameters
+    ----------
+    snapshots : pandas.Index
+        Snapshots to optimise
+    formulation : string
+        Formulation of the linear power flow equations to use; must be
+        one of ["angles","cycles","kirchhoff","ptdf"]
+    ptdf_tolerance : float
+        Value below which PTDF entries are ignored
+
+    Returns
+    -------
+    network.lp : pypsa.linopt.LinearProblem
+    """
+
+    network.lp = LinearProblem("Linear Optimal Power Flow")
+
+    profile = active_profile(network)
+
+    profiled(profile, define_generator_variables_constraints, network, snapshots)
+
+    profiled(profile, define_storage_variables_constraints, network, snapshots)
+
+    profiled(profile, define_store_variables_constraints, network, snapshots)
+
+    profiled(profile, define_branch_extension_variables, network, snapshots)
+
+    profiled(profile, define_link_flows, network, snapshots)
+
+    profiled(profile, define_nodal_balances, network, snapshots)
+
+    profiled(profile, define_passive_branch_flows, network, snapshots, formulation, ptdf_tolerance)
+
+    profiled(profile, define_passive_branch_constraints, network, snapshots)
+
+    if formulation in ["angles", "kirchhoff"]:
+        profiled(profile, define_nodal_balance_constraints, network, snapshots)
+    elif formulation in ["ptdf", "cycles"]:
+        profiled(profile, define_sub_network_balance_constraints, network, snapshots)
+
+    profiled(profile, define_global_constraints, network, snapshots)
+
+    profiled(profile, define_linear_objective, network, snapshots)
+
+    #tidy up auxilliary expressions
+    del network._p_balance
+
+    with stage(profile, "compile"):
+        return network.lp.compile()
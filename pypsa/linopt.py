@@ -0,0 +1,499 @@
+## Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tools for building linear problems from blocks of arrays.
+
+In contrast to pypsa.opt, which builds the pyomo objects element by
+element, a LinearProblem keeps variables, constraints and the
+objective in numpy arrays and a scipy sparse matrix, so that a whole
+family of constraints, e.g. one constraint for each generator and
+snapshot, is defined in a single vectorised operation.
+
+"""
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+from six import iteritems
+
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, issparse
+
+from pyomo.environ import Var, Reals, Binary
+
+from .descriptors import Dict
+from .opt import LExpression, l_objective, l_constraint_array, _set_constraint_data
+
+__author__ = "Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)"
+__copyright__ = "Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS), GNU GPL 3"
+
+
+def _like(values, like):
+    """Wrap the numpy array values in a pandas object shaped like `like`."""
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    else:
+        return pd.Series(values, index=like.index)
+
+
+class LinearProblem(object):
+    """Linear (mixed-integer) problem built from blocks of arrays.
+
+    Variables and constraints are numbered consecutively in the order
+    in which they are added. For each family of variables or
+    constraints the integer ids are stored in a pandas object with the
+    same shape as the data it was built from (e.g. a snapshots x
+    generators DataFrame) in ``lp.variables[name]`` and
+    ``lp.constraints[name]``. Entries which were masked out are
+    marked with -1.
+
+    After calling ``lp.compile()`` the problem
+
+    min c*x + objective_constant
+    s.t. A*x sense rhs, lower <= x <= upper
+
+    is available in the attributes `c`, `A` (scipy.sparse.csr_matrix),
+    `sense`, `rhs`, `lower`, `upper` and `binary`.
+
+    Parameters
+    ----------
+    name : string
+
+    """
+
+    def __init__(self, name=""):
+
+        self.name = name
+
+        self.variables = Dict()
+        self.constraints = Dict()
+
+        self.num_variables = 0
+        self.num_constraints = 0
+
+        self.objective_constant = 0.
+
+        self._lower = []
+        self._upper = []
+        self._binary = []
+
+        self._rows = []
+        self._cols = []
+        self._vals = []
+        self._sense = []
+        self._rhs = []
+
+        self._obj_cols = []
+        self._obj_vals = []
+
+        self._compiled = False
+
+    def __repr__(self):
+        return ("LinearProblem {} with {} variables in {} families and {} constraints in {} families"
+                .format(self.name, self.num_variables, len(self.variables),
+                        self.num_constraints, len(self.constraints)))
+
+    @staticmethod
+    def _new_ids(start, shape, mask):
+        if mask is None:
+            n = int(np.prod(shape))
+            return np.arange(start, start + n).reshape(shape)
+        mask = np.broadcast_to(np.asarray(mask, dtype=bool), shape)
+        ids = np.full(shape, -1, dtype=int)
+        ids[mask] = np.arange(start, start + mask.sum())
+        return ids
+
+    def add_variables(self, name, lower=-np.inf, upper=np.inf, binary=False, mask=None):
+        """
+        Add a family of variables.
+
+        Parameters
+        ----------
+        name : string
+            Name of the variable family
+        lower : pandas.DataFrame|pandas.Series|float
+            Lower bounds; -inf for no bound
+        upper : pandas.DataFrame|pandas.Series|float
+            Upper bounds; inf for no bound. At least one of lower and
+            upper must be a pandas object, which determines the shape.
+        binary : bool, default False
+            Restrict the variables to {0,1}
+        mask : array-like of bool, optional
+            Only define variables where mask is True
+
+        Returns
+        -------
+        ids : pandas.DataFrame|pandas.Series
+            Integer ids of the variables, -1 where masked out
+        """
+
+        like = lower if isinstance(lower, (pd.DataFrame, pd.Series)) else upper
+        shape = like.shape
+
+        ids = self._new_ids(self.num_variables, shape, mask)
+        b = ids >= 0
+
+        self._lower.append(np.broadcast_to(np.asarray(lower, dtype=float), shape)[b])
+        self._upper.append(np.broadcast_to(np.asarray(upper, dtype=float), shape)[b])
+        self._binary.append(np.repeat(bool(binary), b.sum()))
+
+        self.num_variables += int(b.sum())
+        self._compiled = False
+
+        self.variables[name] = ids = _like(ids, like)
+        return ids
+
+    def add_constraints(self, name, lhs, sense, rhs, mask=None):
+        """
+        Add a family of linear constraints `lhs sense rhs`.
+
+        Parameters
+        ----------
+        name : string
+            Name of the constraint family
+        lhs : list
+            Terms of the left-hand side. Each term is either a tuple
+            (coefficients, variable ids) where both are broadcastable
+            to the shape of rhs, or a scipy.sparse matrix whose rows
+            correspond to the flattened (C order) entries of rhs and
+            whose columns are variable ids. Variable ids of -1 are
+            skipped; repeated variables are summed up.
+        sense : string|array-like
+            One of "==", "<=", ">=", or an array of these
+            broadcastable to the shape of rhs
+        rhs : pandas.DataFrame|pandas.Series
+            Constant right-hand side; determines the shape and index
+            of the constraint family
+        mask : array-like of bool, optional
+            Only define constraints where mask is True
+
+        Returns
+        -------
+        ids : pandas.DataFrame|pandas.Series
+            Integer ids of the constraints, -1 where masked out
+        """
+
+        shape = rhs.shape
+        ids = self._new_ids(self.num_constraints, shape, mask)
+        b = ids >= 0
+
+        for term in lhs:
+            if issparse(term):
+                term = term.tocoo()
+                rows = ids.ravel()[term.row]
+                keep = rows >= 0
+                self._rows.append(rows[keep])
+                self._cols.append(term.col[keep])
+                self._vals.append(term.data[keep])
+            else:
+                coeff, var = term
+                var = np.broadcast_to(np.asarray(var, dtype=int), shape)
+                keep = b & (var >= 0)
+                self._rows.append(ids[keep])
+                self._cols.append(var[keep])
+                self._vals.append(np.broadcast_to(np.asarray(coeff, dtype=float), shape)[keep])
+
+        self._sense.append(np.broadcast_to(np.asarray(sense), shape)[b])
+        self._rhs.append(np.asarray(rhs, dtype=float)[b])
+
+        self.num_constraints += int(b.sum())
+        self._compiled = False
+
+        self.constraints[name] = ids = _like(ids, rhs)
+        return ids
+
+    def add_objective(self, coeffs, ids, constant=0.):
+        """
+        Add the terms coeffs*x[ids] (+ constant) to the objective.
+
+        Parameters
+        ----------
+        coeffs : array-like|float
+            Coefficients broadcastable to the shape of ids
+        ids : array-like
+            Variable ids; -1 is skipped
+        constant : float
+        """
+
+        ids = np.asarray(ids, dtype=int)
+        keep = ids >= 0
+        self._obj_cols.append(ids[keep])
+        self._obj_vals.append(np.broadcast_to(np.asarray(coeffs, dtype=float), ids.shape)[keep])
+        self.objective_constant += constant
+        self._compiled = False
+
+    def compile(self):
+        """Assemble the arrays `lower`, `upper`, `binary`, `c`, `A`,
+        `sense` and `rhs` from the blocks added so far."""
+
+        if self._compiled:
+            return self
+
+        def cat(blocks, dtype=float):
+            return np.concatenate(blocks) if blocks else np.empty(0, dtype=dtype)
+
+        self.lower = cat(self._lower)
+        self.upper = cat(self._upper)
+        self.binary = cat(self._binary, dtype=bool)
+
+        self.c = np.bincount(cat(self._obj_cols, dtype=int),
+                             weights=cat(self._obj_vals),
+                             minlength=self.num_variables)
+
+        self.A = coo_matrix((cat(self._vals), (cat(self._rows, dtype=int), cat(self._cols, dtype=int))),
+                            shape=(self.num_constraints, self.num_variables)).tocsr()
+        self.A.sum_duplicates()
+
+        self.sense = cat(self._sense, dtype="<U2")
+        self.rhs = cat(self._rhs)
+
+        self._compiled = True
+
+        return self
+
+    def get_values(self, name):
+        """Return the solution values of the variable family `name` as a
+        pandas.Series indexed like the pyomo variable of the same name."""
+        return self._get(self.variables[name], self.solution)
+
+    def get_duals(self, name):
+        """Return the dual values of the constraint family `name` as a
+        pandas.Series indexed like the pyomo constraint of the same name."""
+        return self._get(self.constraints[name], self.dual)
+
+    def get_value_grid(self, name):
+        """Return the solution values of the variable family `name`
+        shaped like its ids (e.g. snapshots x components), NaN where
+        masked out."""
+        return self._grid(self.variables[name], self.solution)
+
+    def get_dual_grid(self, name):
+        """Return the dual values of the constraint family `name`
+        shaped like its ids (e.g. snapshots x components), NaN where
+        masked out."""
+        return self._grid(self.constraints[name], self.dual)
+
+    @staticmethod
+    def _grid(ids, values):
+        i = ids.values.astype(int)
+        if len(values) == 0:
+            return _like(np.full(i.shape, np.nan), ids)
+        return _like(np.where(i >= 0, values[np.maximum(i, 0)], np.nan), ids)
+
+    @staticmethod
+    def _get(ids, values):
+        keys, flat = _pyomo_index(ids)
+        if len(keys) == 0:
+            return pd.Series()
+        if isinstance(keys[0], tuple):
+            keys = pd.MultiIndex.from_tuples(keys)
+        return pd.Series(values[flat], index=keys)
+
+
+def _pyomo_index(ids):
+    """Return the pyomo indices and the flat ids of the non-masked
+    entries of `ids`, ordered component first as in pypsa.opf."""
+
+    if isinstance(ids, pd.DataFrame):
+        values = ids.values.T
+        comp_i, sn_i = np.nonzero(values >= 0)
+        keys = [(c if isinstance(c, tuple) else (c,)) + (sn,)
+                for c, sn in zip(ids.columns[comp_i], ids.index[sn_i])]
+        return keys, values[comp_i, sn_i].astype(int)
+    else:
+        values = ids.values
+        b = values >= 0
+        return list(ids.index[b]), values[b].astype(int)
+
+
+def to_pyomo(lp, model):
+    """
+    Translate a LinearProblem into pyomo components of `model`.
+
+    Each variable and constraint family becomes a pyomo Var or
+    Constraint of the same name, indexed by the component names
+    followed by the snapshot, exactly as those built by pypsa.opf.
+
+    Parameters
+    ----------
+    lp : LinearProblem
+    model : pyomo.environ.ConcreteModel
+
+    Returns
+    -------
+    model
+    """
+
+    lp.compile()
+
+    def to_bound(b):
+        return [None if np.isinf(x) else x for x in b.tolist()]
+
+    lower = to_bound(lp.lower)
+    upper = to_bound(lp.upper)
+
+    pyomo_variables = np.empty(lp.num_variables, dtype=object)
+    pyomo_constraints = np.empty(lp.num_constraints, dtype=object)
+
+    for name, ids in iteritems(lp.variables):
+        keys, flat = _pyomo_index(ids)
+        binary = len(flat) > 0 and lp.binary[flat].all()
+        setattr(model, name, Var(keys, within=Binary if binary else Reals))
+        var = getattr(model, name)
+        for k, i in zip(keys, flat.tolist()):
+            v = var[k]
+            v.setlb(lower[i])
+            v.setub(upper[i])
+            pyomo_variables[i] = v
+
+    for name, ids in iteritems(lp.constraints):
+        keys, flat = _pyomo_index(ids)
+        l_constraint_array(model, name, keys, pyomo_variables, lp.A[flat],
+                           lp.sense[flat], lp.rhs[flat])
+        v = getattr(model, name)
+        for k, i in zip(keys, flat.tolist()):
+            pyomo_constraints[i] = (v, k)
+
+    l_objective(model, _objective_expression(lp, pyomo_variables))
+
+    lp.model = model
+    lp.pyomo_variables = pyomo_variables
+    lp.pyomo_constraints = pyomo_constraints
+
+    return model
+
+
+def _objective_expression(lp, pyomo_variables):
+    nz = lp.c.nonzero()[0]
+    objective = LExpression(constant=lp.objective_constant)
+    objective.add_terms(lp.c[nz].tolist(), pyomo_variables[nz].tolist())
+    return objective
+
+
+def _set_row(lp, pyomo_variables, v, k, i):
+    s, e = lp.A.indptr[i], lp.A.indptr[i+1]
+    _set_constraint_data(v, k, lp.A.data[s:e].tolist(),
+                         pyomo_variables[lp.A.indices[s:e]].tolist(),
+                         lp.sense[i], float(lp.rhs[i]))
+
+
+def has_same_structure(lp, other):
+    """
+    Check whether two LinearProblems have the same families of
+    variables and constraints and the same sparsity pattern, so that
+    they only differ in bounds, coefficients and right-hand sides.
+    """
+
+    lp.compile()
+    other.compile()
+
+    if (lp.num_variables != other.num_variables or
+        lp.num_constraints != other.num_constraints or
+        list(lp.variables) != list(other.variables) or
+        list(lp.constraints) != list(other.constraints)):
+        return False
+
+    for families, other_families in [(lp.variables, other.variables),
+                                     (lp.constraints, other.constraints)]:
+        for name, ids in iteritems(families):
+            if not np.array_equal(ids.values, other_families[name].values):
+                return False
+
+    return (np.array_equal(lp.A.indptr, other.A.indptr) and
+            np.array_equal(lp.A.indices, other.A.indices) and
+            np.array_equal(lp.sense, other.sense) and
+            np.array_equal(lp.binary, other.binary))
+
+
+def update_pyomo(lp, skeleton, opt=None):
+    """
+    Update the pyomo model translated from `skeleton` in place, so
+    that it represents `lp`, which must have the same structure (see
+    has_same_structure).
+
+    Only bounds, constraints and the objective which differ between
+    the two problems are touched. Afterwards `lp` owns the pyomo model.
+
+    Parameters
+    ----------
+    lp : LinearProblem
+    skeleton : LinearProblem
+        Problem which was previously translated with to_pyomo
+    opt : None|pyomo.solvers.plugins.solvers.persistent_solver.PersistentSolver
+        Persistent solver whose instance is the model; the changed
+        bounds, constraints and objective are passed on to it, so that
+        set_instance need not be called again
+
+    Returns
+    -------
+    model
+    """
+
+    lp.compile()
+
+    model = skeleton.model
+    pyomo_variables = skeleton.pyomo_variables
+    pyomo_constraints = skeleton.pyomo_constraints
+
+    for i in np.flatnonzero((lp.lower != skeleton.lower) | (lp.upper != skeleton.upper)):
+        v = pyomo_variables[i]
+        v.setlb(None if np.isinf(lp.lower[i]) else lp.lower[i])
+        v.setub(None if np.isinf(lp.upper[i]) else lp.upper[i])
+        if opt is not None:
+            opt.update_var(v)
+
+    changed = (lp.rhs != skeleton.rhs)
+    changed[np.repeat(np.arange(lp.num_constraints), np.diff(lp.A.indptr))[lp.A.data != skeleton.A.data]] = True
+    for i in np.flatnonzero(changed):
+        v, k = pyomo_constraints[i]
+        #the constraint data is replaced, so the solver has to swap it
+        if opt is not None:
+            opt.remove_constraint(v[k])
+        _set_row(lp, pyomo_variables, v, k, i)
+        if opt is not None:
+            opt.add_constraint(v[k])
+
+    if (lp.objective_constant != skeleton.objective_constant or
+        not np.array_equal(lp.c, skeleton.c)):
+        model.del_component(model.objective)
+        l_objective(model, _objective_expression(lp, pyomo_variables))
+        if opt is not None:
+            opt.set_objective(model.objective)
+
+    lp.model = model
+    lp.pyomo_variables = pyomo_variables
+    lp.pyomo_constraints = pyomo_constraints
+
+    return model
+
+
+def read_pyomo_solution(lp, objective_value=np.nan):
+    """
+    Read the solution of the pyomo model of `lp` (see to_pyomo) into
+    ``lp.solution`` and ``lp.dual``; the dual values are taken from
+    the suffix ``model.dual``.
+    """
+
+    lp.solution = np.array([np.nan if v.value is None else v.value
+                            for v in lp.pyomo_variables], dtype=float)
+
+    duals = lp.model.dual
+    lp.dual = np.array([duals.get(v[k], np.nan) for v, k in lp.pyomo_constraints], dtype=float)
+
+    lp.objective_value = objective_value
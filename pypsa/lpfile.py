@@ -0,0 +1,639 @@
+## Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Write a LinearProblem to an LP or MPS file without pyomo, run a
+solver binary on it and read the solution back, or solve it in-process
+with the HiGHS solver shipped with scipy.
+
+Variables are named ``x<id>`` and constraints ``c<id>`` after their
+ids in the LinearProblem. The files are written in chunks of rows or
+columns from the arrays of the compiled problem.
+
+"""
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+from six import iteritems
+
+__author__ = "Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)"
+__copyright__ = "Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS), GNU GPL 3"
+
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+import scipy
+from scipy.optimize import linprog
+
+from distutils.version import LooseVersion
+_scipy_version = LooseVersion(scipy.__version__)
+
+from .profiling import stage
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+lp_senses = {"==" : "=", "<=" : "<=", ">=" : ">="}
+mps_senses = {"==" : "E", "<=" : "L", ">=" : "G"}
+
+
+def _fmt(values):
+    """Format floats with full precision and explicit sign."""
+    return np.char.mod("%+.17g", np.asarray(values, dtype=float))
+
+def _names(prefix, ids):
+    return np.char.add(prefix, np.asarray(ids).astype(str))
+
+def _nonempty_rows(lp):
+    """Ids of the constraints with variables; only those are written
+    to the problem file."""
+    return np.flatnonzero(np.diff(lp.A.indptr) > 0)
+
+def _violated_empty_rows(lp, tol=1e-6):
+    """Ids of the constraints without variables which are violated,
+    i.e. for which 0 <sense> rhs does not hold."""
+    rows = np.flatnonzero(np.diff(lp.A.indptr) == 0)
+    sense, rhs = lp.sense[rows], lp.rhs[rows]
+    holds = np.where(sense == "==", np.abs(rhs) <= tol,
+                     np.where(sense == "<=", rhs >= -tol, rhs <= tol))
+    return rows[~holds]
+
+def _check_empty_rows(lp):
+    """Raise a ValueError if constraints without variables are violated,
+    since they cannot be written to the problem file."""
+    violated = _violated_empty_rows(lp)
+    if len(violated):
+        raise ValueError("The problem is infeasible, since the constraints {} have no "
+                         "variables and are violated".format(", ".join(_names("c", violated[:10]))
+                                                            + (", ..." if len(violated) > 10 else "")))
+
+def _referenced_columns(lp):
+    """Ids of the variables which appear in the objective or in a
+    constraint; only those are written to the problem file."""
+    referenced = np.zeros(lp.num_variables, dtype=bool)
+    referenced[lp.A.indices] = True
+    referenced[lp.c != 0] = True
+    return np.flatnonzero(referenced)
+
+def _objective_terms(lp):
+    cols = np.flatnonzero(lp.c)
+    if len(cols) == 0 and lp.num_variables > 0:
+        #the objective must not be empty in the LP format
+        cols = _referenced_columns(lp)[:1]
+    return cols, lp.c[cols]
+
+
+def write_lp(lp, filename, chunksize=100000):
+    """
+    Write the LinearProblem `lp` to a file in CPLEX LP format.
+
+    Parameters
+    ----------
+    lp : pypsa.linopt.LinearProblem
+    filename : string
+    chunksize : int
+        Number of constraints formatted and written at once
+
+    Returns
+    -------
+    None
+
+    Constraints without variables are left out if they hold and raise
+    a ValueError if they are violated.
+    """
+
+    lp.compile()
+    _check_empty_rows(lp)
+    A = lp.A
+    A.sort_indices()
+
+    with open(filename, "w") as f:
+        f.write("\\* {} *\\\n\nmin\nobj:\n".format(lp.name or "Problem"))
+
+        cols, coeffs = _objective_terms(lp)
+        for s in range(0, len(cols), chunksize):
+            e = s + chunksize
+            f.write("\n".join(np.char.add(np.char.add(_fmt(coeffs[s:e]), " "),
+                                          _names("x", cols[s:e]))))
+            f.write("\n")
+
+        f.write("\ns.t.\n\n")
+
+        rows = _nonempty_rows(lp)
+        for s in range(0, len(rows), chunksize):
+            chunk = rows[s:s+chunksize]
+            lengths = A.indptr[chunk+1] - A.indptr[chunk]
+            #empty rows have no terms, so the terms of the chunk are contiguous
+            terms = np.arange(A.indptr[chunk[0]], A.indptr[chunk[-1]+1])
+
+            #one line for the name, one for each term, one for sense and rhs
+            offsets = np.concatenate([[0], np.cumsum(lengths + 2)])
+            lines = np.empty(offsets[-1], dtype=object)
+            lines[offsets[:-1]] = np.char.add(_names("c", chunk), ":")
+            lines[offsets[1:] - 1] = np.char.add(np.char.add([lp_senses[x] for x in lp.sense[chunk]], " "),
+                                                 _fmt(lp.rhs[chunk]))
+            term_pos = np.ones(offsets[-1], dtype=bool)
+            term_pos[offsets[:-1]] = False
+            term_pos[offsets[1:] - 1] = False
+            lines[term_pos] = np.char.add(np.char.add(_fmt(A.data[terms]), " "),
+                                          _names("x", A.indices[terms]))
+            f.write("\n".join(lines))
+            f.write("\n\n")
+
+        f.write("bounds\n")
+
+        cols = _referenced_columns(lp)
+        for s in range(0, len(cols), chunksize):
+            chunk = cols[s:s+chunksize]
+            lines = np.char.add(np.char.add(np.char.add(np.char.add(" ", _fmt(lp.lower[chunk])), " <= "),
+                                            _names("x", chunk)),
+                                np.char.add(" <= ", _fmt(lp.upper[chunk])))
+            f.write("\n".join(lines))
+            f.write("\n")
+
+        binaries = cols[lp.binary[cols]]
+        if len(binaries):
+            f.write("binary\n")
+            f.write("\n".join(_names(" x", binaries)))
+            f.write("\n")
+
+        f.write("end\n")
+
+
+def _mps_column_order(lp):
+    cols = _referenced_columns(lp)
+    binary = lp.binary[cols]
+    return np.concatenate([cols[~binary], cols[binary]]), binary.sum()
+
+
+def write_mps(lp, filename, chunksize=100000, free_tag=False):
+    """
+    Write the LinearProblem `lp` to a file in free MPS format.
+
+    Parameters
+    ----------
+    lp : pypsa.linopt.LinearProblem
+    filename : string
+    chunksize : int
+        Number of matrix entries or bounds formatted and written at once
+    free_tag : bool, default False
+        Mark the file as free MPS on the NAME line, which cbc needs to
+        parse the bounds correctly
+
+    Returns
+    -------
+    None
+
+    Constraints without variables are left out if they hold and raise
+    a ValueError if they are violated.
+    """
+
+    lp.compile()
+    _check_empty_rows(lp)
+
+    cols, num_binaries = _mps_column_order(lp)
+    rows = _nonempty_rows(lp)
+
+    position = np.full(lp.num_variables, -1, dtype=int)
+    position[cols] = np.arange(len(cols))
+
+    #the objective gets row number -1, so that it is sorted first
+    A = lp.A.tocoo()
+    obj = np.flatnonzero(lp.c)
+    entry_rows = np.concatenate([np.full(len(obj), -1), A.row])
+    entry_cols = np.concatenate([obj, A.col])
+    entry_vals = np.concatenate([lp.c[obj], A.data])
+    order = np.lexsort((entry_rows, position[entry_cols]))
+    entry_rows, entry_cols, entry_vals = entry_rows[order], entry_cols[order], entry_vals[order]
+
+    def write_lines(f, lines):
+        for s in range(0, len(lines), chunksize):
+            f.write("\n".join(lines[s:s+chunksize]))
+            f.write("\n")
+
+    with open(filename, "w") as f:
+        f.write("NAME {}{}\nROWS\n N obj\n".format(lp.name.replace(" ", "_") or "Problem",
+                                                 " FREE" if free_tag else ""))
+
+        write_lines(f, np.char.add(np.char.add([" " + mps_senses[x] + " " for x in lp.sense[rows]], "c"),
+                                   rows.astype(str)))
+
+        f.write("COLUMNS\n")
+
+        row_names = np.where(entry_rows >= 0, _names("c", entry_rows), "obj")
+        lines = np.char.add(np.char.add(np.char.add(np.char.add(" ", _names("x", entry_cols)), " "),
+                                        row_names),
+                            np.char.add(" ", _fmt(entry_vals)))
+
+        #binary columns come last and are wrapped in integer markers
+        split = np.searchsorted(position[entry_cols], len(cols) - num_binaries)
+        write_lines(f, lines[:split])
+        if num_binaries:
+            f.write(" MARKER 'MARKER' 'INTORG'\n")
+            write_lines(f, lines[split:])
+            f.write(" MARKER 'MARKER' 'INTEND'\n")
+
+        f.write("RHS\n")
+
+        nonzero = rows[lp.rhs[rows] != 0]
+        write_lines(f, np.char.add(np.char.add(_names(" RHS c", nonzero), " "), _fmt(lp.rhs[nonzero])))
+
+        f.write("BOUNDS\n")
+
+        lower, upper = lp.lower[cols], lp.upper[cols]
+        names = _names(" BND x", cols)
+        binary = lp.binary[cols]
+        free = ~binary & np.isinf(lower) & np.isinf(upper)
+        fixed = ~binary & (lower == upper)
+        rest = ~(binary | free | fixed)
+
+        write_lines(f, np.char.add(" BV", names[binary]))
+        write_lines(f, np.char.add(" FR", names[free]))
+        write_lines(f, np.char.add(np.char.add(" FX", names[fixed]), np.char.add(" ", _fmt(lower[fixed]))))
+
+        minus_inf = rest & np.isinf(lower)
+        write_lines(f, np.char.add(" MI", names[minus_inf]))
+        finite = rest & ~np.isinf(lower)
+        write_lines(f, np.char.add(np.char.add(" LO", names[finite]), np.char.add(" ", _fmt(lower[finite]))))
+        finite = rest & ~np.isinf(upper)
+        write_lines(f, np.char.add(np.char.add(" UP", names[finite]), np.char.add(" ", _fmt(upper[finite]))))
+
+        f.write("ENDATA\n")
+
+
+def _solution_from_names(lp, names, values, duals):
+    """Sort values read from a solution file into primal and dual
+    arrays, using the names x<id> and c<id>."""
+
+    solution = np.full(lp.num_variables, np.nan)
+    dual = np.full(lp.num_constraints, np.nan)
+
+    names = np.asarray(names)
+    kind = np.array([n[:1] for n in names])
+    ids = np.array([n[1:] for n in names])
+
+    is_var = kind == "x"
+    solution[ids[is_var].astype(int)] = np.asarray(values, dtype=float)[is_var]
+
+    is_con = kind == "c"
+    if duals is not None:
+        dual[ids[is_con].astype(int)] = np.asarray(duals, dtype=float)[is_con]
+
+    return solution, dual
+
+
+def read_cbc(lp, filename):
+    """Read a cbc solution file written with printingOptions all."""
+
+    with open(filename) as f:
+        header = f.readline()
+        names, values, duals = [], [], []
+        for line in f:
+            fields = line.replace("**", "").split()
+            if len(fields) < 4:
+                continue
+            names.append(fields[1])
+            values.append(fields[2])
+            duals.append(fields[3])
+
+    status = header.split("-")[0].strip().lower()
+    objective = float(header.split("objective value")[-1]) if "objective value" in header else np.nan
+
+    if status == "optimal":
+        status, termination_condition = "ok", "optimal"
+    elif status.startswith("stopped") and not np.isnan(objective):
+        status, termination_condition = "warning", "other"
+    elif "infeasible" in status:
+        status, termination_condition = "warning", "infeasible"
+    elif "unbounded" in status:
+        status, termination_condition = "warning", "unbounded"
+    else:
+        status, termination_condition = "error", status
+
+    solution, dual = _solution_from_names(lp, names, values, duals)
+
+    return status, termination_condition, objective, solution, dual
+
+
+def read_highs(lp, filename):
+    """Read a HiGHS solution file."""
+
+    with open(filename) as f:
+        lines = [l.strip() for l in f]
+
+    model_status = lines[lines.index("Model status") + 1].lower() if "Model status" in lines else ""
+
+    def section(header):
+        """Return names and values of the columns and rows following
+        header, and the objective value if given."""
+        if header not in lines:
+            return [], [], np.nan
+        i = lines.index(header)
+        names, values = [], []
+        objective = np.nan
+        while i < len(lines) and not lines[i].startswith("# Columns"):
+            if lines[i].startswith("Objective"):
+                objective = float(lines[i].split()[-1])
+            i += 1
+        for part in range(2):
+            if i >= len(lines):
+                break
+            count = int(lines[i].split()[-1])
+            for l in lines[i+1:i+1+count]:
+                name, value = l.split()[:2]
+                names.append(name)
+                values.append(value)
+            i += 1 + count
+        return names, values, objective
+
+    names, values, objective = section("# Primal solution values")
+    dual_names, dual_values, _ = section("# Dual solution values")
+    dual_values = dict(zip(dual_names, dual_values))
+    duals = [dual_values.get(n, np.nan) for n in names] if dual_values else None
+
+    if model_status == "optimal":
+        status, termination_condition = "ok", "optimal"
+    elif "infeasible" in model_status:
+        status, termination_condition = "warning", "infeasible"
+    elif "unbounded" in model_status:
+        status, termination_condition = "warning", "unbounded"
+    elif not np.isnan(objective):
+        status, termination_condition = "warning", "other"
+    else:
+        status, termination_condition = "error", model_status
+
+    solution, dual = _solution_from_names(lp, names, values, duals)
+
+    return status, termination_condition, objective, solution, dual
+
+
+def read_glpk(lp, filename, io="lp"):
+    """Read a glpk solution file in the raw format of glp_write_sol
+    and friends (glpk >= 4.57).
+
+    glpk numbers the rows and columns in the order in which they first
+    appear in the problem file, which is reconstructed here."""
+
+    if io == "mps":
+        cols = _mps_column_order(lp)[0]
+    else:
+        lp.A.sort_indices()
+        cols = np.concatenate([_objective_terms(lp)[0], lp.A.indices])
+        _, first = np.unique(cols, return_index=True)
+        cols = cols[np.sort(first)]
+    rows = _nonempty_rows(lp)
+
+    solution = np.full(lp.num_variables, np.nan)
+    dual = np.full(lp.num_constraints, np.nan)
+
+    objective = np.nan
+    kind = None
+    stat = "u"
+
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0] == "c":
+                continue
+            if fields[0] == "s":
+                kind = fields[1]
+                if kind == "bas":
+                    stat = "o" if fields[4] == "f" and fields[5] == "f" else fields[4]
+                else:
+                    stat = fields[4]
+                objective = float(fields[-1])
+            elif fields[0] == "i":
+                if kind != "mip":
+                    dual[rows[int(fields[1]) - 1]] = float(fields[-1])
+            elif fields[0] == "j":
+                value = fields[3] if kind == "bas" else fields[2]
+                solution[cols[int(fields[1]) - 1]] = float(value)
+
+    if stat == "o":
+        status, termination_condition = "ok", "optimal"
+    elif stat == "f":
+        status, termination_condition = "warning", "other"
+    elif stat in ("n", "i"):
+        status, termination_condition = "warning", "infeasible"
+    else:
+        status, termination_condition = "error", "undefined"
+
+    return status, termination_condition, objective, solution, dual
+
+
+def run_solver(lp, solver_name="glpk", io="lp", solver_options={}, solver_logfile=None,
+               keep_files=False, profile=None):
+    """
+    Write the LinearProblem `lp` to a problem file, solve it with a
+    solver binary and read back the solution.
+
+    The primal values are stored in ``lp.solution``, the dual values
+    of the constraints in ``lp.dual`` and the value of the objective
+    (including the constant part) in ``lp.objective_value``.
+
+    Parameters
+    ----------
+    lp : pypsa.linopt.LinearProblem
+    solver_name : string
+        One of "glpk", "cbc" or "highs"; the corresponding binary
+        (glpsol, cbc or highs) must be in the PATH
+    io : string
+        Problem file format, "lp" or "mps"
+    solver_options : dictionary
+        Options passed to the solver on the command line
+    solver_logfile : None|string
+        If not None, the output of the solver is written to this file
+    keep_files : bool, default False
+        Keep the problem and solution files
+    profile : None|pypsa.profiling.Profile
+        If given, writing the problem file, the solver run and reading
+        the solution are recorded as stages of it
+
+    Returns
+    -------
+    status, termination_condition
+    """
+
+    if solver_name not in ["glpk", "cbc", "highs"]:
+        raise NotImplementedError("Solver {} is not supported without pyomo, use one of glpk, cbc or highs".format(solver_name))
+    if io not in ["lp", "mps"]:
+        raise NotImplementedError("Problem file format {} is not supported, use lp or mps".format(io))
+
+    #constraints without variables are not written to the problem file,
+    #so a violated one is reported here rather than by the solver
+    lp.compile()
+    violated = _violated_empty_rows(lp)
+    if len(violated):
+        logger.warning("The problem is infeasible, since %d constraints have no variables "
+                       "and are violated, e.g. %s", len(violated), ", ".join(_names("c", violated[:10])))
+        lp.solution = np.full(lp.num_variables, np.nan)
+        lp.dual = np.full(lp.num_constraints, np.nan)
+        lp.objective_value = np.nan
+        return "warning", "infeasible"
+
+    fds, problem_fn = tempfile.mkstemp(prefix="pypsa-problem-", suffix="." + io)
+    os.close(fds)
+    fds, solution_fn = tempfile.mkstemp(prefix="pypsa-solve-", suffix=".sol")
+    os.close(fds)
+    filenames = [problem_fn, solution_fn]
+
+    logger.info("Writing problem to %s", problem_fn)
+    with stage(profile, "write_problem"):
+        if io == "lp":
+            write_lp(lp, problem_fn)
+        else:
+            write_mps(lp, problem_fn, free_tag=(solver_name == "cbc"))
+
+    if solver_name == "glpk":
+        command = ["glpsol", "--lp" if io == "lp" else "--freemps", problem_fn,
+                   "--write", solution_fn]
+        for k, v in iteritems(solver_options):
+            command += ["--" + k] + ([str(v)] if v is not None else [])
+    elif solver_name == "cbc":
+        command = ["cbc", problem_fn]
+        for k, v in iteritems(solver_options):
+            command += ["-" + k, str(v)]
+        command += ["-solve", "-printingOptions", "all", "-solu", solution_fn]
+    else:
+        fds, options_fn = tempfile.mkstemp(prefix="pypsa-options-", suffix=".opt")
+        with os.fdopen(fds, "w") as f:
+            f.write("".join("{} = {}\n".format(k, v) for k, v in iteritems(solver_options)))
+        filenames.append(options_fn)
+        command = ["highs", "--model_file", problem_fn, "--solution_file", solution_fn,
+                   "--options_file", options_fn]
+
+    logger.info("Solving problem using %s", solver_name)
+
+    with stage(profile, "solve"):
+        if solver_logfile is not None:
+            with open(solver_logfile, "w") as log:
+                subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+        else:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+            logger.debug(output.decode(errors="replace"))
+
+    if os.path.getsize(solution_fn) > 0:
+        with stage(profile, "read_solution"):
+            if solver_name == "glpk":
+                result = read_glpk(lp, solution_fn, io)
+            elif solver_name == "cbc":
+                result = read_cbc(lp, solution_fn)
+            else:
+                result = read_highs(lp, solution_fn)
+        status, termination_condition, objective, solution, dual = result
+    else:
+        status, termination_condition, objective = "error", "no solution file", np.nan
+        solution = np.full(lp.num_variables, np.nan)
+        dual = np.full(lp.num_constraints, np.nan)
+
+    if keep_files:
+        logger.info("Keeping problem and solution files %s", ", ".join(filenames))
+    else:
+        for fn in filenames:
+            os.remove(fn)
+
+    #variables which appear nowhere in the problem take their value
+    #closest to zero
+    unreferenced = np.ones(lp.num_variables, dtype=bool)
+    unreferenced[_referenced_columns(lp)] = False
+    solution[unreferenced] = np.clip(0., lp.lower[unreferenced], lp.upper[unreferenced])
+
+    lp.solution = solution
+    lp.dual = dual
+    lp.objective_value = objective + lp.objective_constant
+
+    return status, termination_condition
+
+
+def run_scipy_highs(lp, solver_options={}):
+    """
+    Solve the LinearProblem `lp` in-process with
+    scipy.optimize.linprog(method="highs").
+
+    The primal values are stored in ``lp.solution``, the dual values
+    of the constraints in ``lp.dual`` and the value of the objective
+    (including the constant part) in ``lp.objective_value``; the duals
+    follow the same sign convention as those of glpk and cbc.
+
+    Parameters
+    ----------
+    lp : pypsa.linopt.LinearProblem
+    solver_options : dictionary
+        Options passed to linprog, e.g. {"time_limit" : 60}
+
+    Returns
+    -------
+    status, termination_condition
+    """
+
+    if _scipy_version < LooseVersion("1.6"):
+        raise NotImplementedError("The solver scipy-highs requires scipy >= 1.6, "
+                                  "but scipy {} is installed".format(scipy.__version__))
+
+    lp.compile()
+
+    #linprog only knows <= and == constraints, so >= rows are negated
+    sign = np.where(lp.sense == ">=", -1., 1.)
+    eq = np.flatnonzero(lp.sense == "==")
+    ub = np.flatnonzero(lp.sense != "==")
+
+    A = lp.A.tocsr()
+    kwargs = {}
+    if len(ub):
+        kwargs["A_ub"] = A[ub].multiply(sign[ub][:,np.newaxis]).tocsr()
+        kwargs["b_ub"] = sign[ub]*lp.rhs[ub]
+    if len(eq):
+        kwargs["A_eq"] = A[eq]
+        kwargs["b_eq"] = lp.rhs[eq]
+    if lp.binary.any():
+        kwargs["integrality"] = lp.binary.astype(int)
+
+    bounds = np.column_stack([lp.lower, lp.upper])
+
+    logger.info("Solving problem using scipy-highs")
+
+    try:
+        res = linprog(lp.c, bounds=bounds, method="highs", options=solver_options, **kwargs)
+    except TypeError:
+        if "integrality" in kwargs:
+            raise NotImplementedError("Binary variables (e.g. for unit commitment) with scipy-highs require scipy >= 1.9")
+        raise
+
+    dual = np.full(lp.num_constraints, np.nan)
+    if getattr(res, "eqlin", None) is not None and len(eq):
+        dual[eq] = res.eqlin.marginals
+    if getattr(res, "ineqlin", None) is not None and len(ub):
+        dual[ub] = sign[ub]*res.ineqlin.marginals
+
+    if res.status == 0:
+        status, termination_condition = "ok", "optimal"
+    elif res.status == 1 and res.x is not None:
+        status, termination_condition = "warning", "other"
+    elif res.status == 2:
+        status, termination_condition = "warning", "infeasible"
+    elif res.status == 3:
+        status, termination_condition = "warning", "unbounded"
+    else:
+        status, termination_condition = "error", res.message
+
+    lp.solution = res.x if res.x is not None else np.full(lp.num_variables, np.nan)
+    lp.dual = dual
+    lp.objective_value = (res.fun if res.fun is not None else np.nan) + lp.objective_constant
+
+    return status, termination_condition
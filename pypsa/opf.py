@@ -30,7 +30,7 @@ __copyright__ = "Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS), Dav
 
 import numpy as np
 import pandas as pd
-from scipy.sparse.linalg import spsolve
+from scipy.sparse import coo_matrix, csr_matrix, identity, kron, vstack as svstack
 from pyomo.environ import (ConcreteModel, Var, Objective,
                            NonNegativeReals, Constraint, Reals,
                            Suffix, Expression, Binary, SolverFactory)
@@ -42,6 +42,7 @@ except ImportError:
     class PersistentSolver(): pass
 
 from itertools import chain
+from pickle import PicklingError
 
 import logging
 logger = logging.getLogger(__name__)
@@ -55,13 +56,19 @@ except ValueError:
 
 from .pf import (calculate_dependent_values, find_slack_bus,
                  find_bus_controls, calculate_B_H, calculate_PTDF, find_tree,
-                 find_cycles, _as_snapshots)
-from .opt import (l_constraint, l_objective, LExpression, LConstraint,
+                 find_cycles, factorize_B, _as_snapshots)
+from .opt import (l_constraint, l_constraint_array, l_objective, LExpression, LConstraint,
                   patch_optsolver_free_model_before_solving,
                   patch_optsolver_record_memusage_before_solving,
                   empty_network, free_pyomo_initializers)
 from .descriptors import (get_switchable_as_dense, get_switchable_as_iter,
-                          allocate_series_dataframes, zsum)
+                          allocate_series_dataframes, zsum, Dict)
+from .linopt import (LinearProblem, to_pyomo, has_same_structure, update_pyomo,
+                     read_pyomo_solution, _like)
+from .linopf import network_lopf_build_linear_problem
+from .lpfile import run_solver, run_scipy_highs
+from .profiling import (profiling, active_profile, stage, profiled,
+                        patch_optsolver_profile)
 
 pd.Series.zsum = zsum
 
@@ -74,6 +81,101 @@ def network_opf(network,snapshots=None):
 
 
 
+def _pyomo_var_array(var, components, snapshots):
+    """Return the variables (or constraints) var[component,snapshot] as
+    an object array of shape (len(components), len(snapshots))."""
+
+    a = np.empty((len(components), len(snapshots)), dtype=object)
+    for i, c in enumerate(components):
+        key = c if isinstance(c, tuple) else (c,)
+        for j, sn in enumerate(snapshots):
+            a[i,j] = var[key + (sn,)]
+    return a
+
+def _pyomo_id_grids(grids):
+    """Number the pyomo objects in the object grids consecutively.
+
+    Return the integer grids of their ids (-1 where there is none),
+    shaped like the ids of a LinearProblem, and the list of the
+    objects in the order of their ids."""
+
+    objects = []
+    ids = Dict()
+    for name, grid in iteritems(grids):
+        flat = grid.values.ravel()
+        present = np.array([o is not None for o in flat], dtype=bool)
+        i = np.full(len(flat), -1, dtype=int)
+        i[present] = np.arange(len(objects), len(objects) + present.sum())
+        objects.extend(flat[present])
+        ids[name] = _like(i.reshape(grid.shape), grid)
+    return ids, objects
+
+def _record_pyomo_grids(network, snapshots, formulation):
+    """Record the pyomo variables and constraints which are read by
+    extract_optimisation_results in network._pyomo_grids, as integer
+    DataFrames of snapshots x components (Series for families without
+    snapshots) of ids into flat lists of the pyomo objects, like the
+    ids of a LinearProblem."""
+
+    model = network.model
+
+    def grid(component, components):
+        return pd.DataFrame(_pyomo_var_array(component, components, snapshots).T,
+                            index=snapshots, columns=components)
+
+    def static(component, components):
+        return pd.Series([component._data.get(c) for c in components],
+                         index=components, dtype=object)
+
+    gens = network.generators
+    sus = network.storage_units
+    stores = network.stores
+    links = network.links
+    passive_branches = network.passive_branches()
+
+    variables = Dict(generator_p=grid(model.generator_p, gens.index),
+                     generator_p_nom=static(model.generator_p_nom, gens.index[gens.p_nom_extendable]),
+                     storage_p_dispatch=grid(model.storage_p_dispatch, sus.index),
+                     storage_p_store=grid(model.storage_p_store, sus.index),
+                     state_of_charge=grid(model.state_of_charge, sus.index),
+                     storage_p_nom=static(model.storage_p_nom, sus.index[sus.p_nom_extendable]),
+                     store_p=grid(model.store_p, stores.index),
+                     store_e=grid(model.store_e, stores.index),
+                     store_e_nom=static(model.store_e_nom, stores.index[stores.e_nom_extendable]),
+                     passive_branch_p=grid(model.passive_branch_p, passive_branches.index),
+                     passive_branch_s_nom=static(model.passive_branch_s_nom,
+                                                 passive_branches.index[passive_branches.s_nom_extendable]),
+                     link_p=grid(model.link_p, links.index),
+                     link_p_nom=static(model.link_p_nom, links.index[links.p_nom_extendable]),
+                     generator_status=grid(model.generator_status,
+                                           gens.index[~gens.p_nom_extendable & gens.committable]))
+
+    spill = np.empty((len(snapshots), len(sus.index)), dtype=object)
+    snapshots_i = pd.Index(snapshots)
+    for su,sn in model.storage_p_spill.keys():
+        spill[snapshots_i.get_loc(sn),sus.index.get_loc(su)] = model.storage_p_spill[su,sn]
+    variables["storage_p_spill"] = pd.DataFrame(spill, index=snapshots, columns=sus.index)
+
+    if formulation == "angles":
+        variables["voltage_angles"] = grid(model.voltage_angles, network.buses.index)
+
+    constraints = Dict(flow_lower=grid(model.flow_lower, passive_branches.index),
+                       flow_upper=grid(model.flow_upper, passive_branches.index),
+                       link_p_lower=grid(model.link_p_lower, links.index),
+                       link_p_upper=grid(model.link_p_upper, links.index),
+                       global_constraints=static(model.global_constraints,
+                                                 network.global_constraints.index))
+
+    if formulation in ["angles", "kirchhoff"]:
+        constraints["power_balance"] = grid(model.power_balance, network.buses.index)
+
+    variables, pyomo_variables = _pyomo_id_grids(variables)
+    constraints, pyomo_constraints = _pyomo_id_grids(constraints)
+
+    network._pyomo_grids = Dict(variables=variables, constraints=constraints,
+                                pyomo_variables=pyomo_variables,
+                                pyomo_constraints=pyomo_constraints)
+
 def define_generator_variables_constraints(network,snapshots):
 
     extendable_gens_i = network.generators.index[network.generators.p_nom_extendable]
@@ -424,68 +526,71 @@ def define_storage_variables_constraints(network,snapshots):
     network.model.state_of_charge = Var(list(network.storage_units.index), snapshots,
                                         domain=NonNegativeReals, bounds=(0,None))
 
-    upper = {(su,sn) : [[(1,model.state_of_charge[su,sn]),
-                         (-sus.at[su,"max_hours"],model.storage_p_nom[su])],"<=",0.]
-             for su in ext_sus_i for sn in snapshots}
-    upper.update({(su,sn) : [[(1,model.state_of_charge[su,sn])],"<=",
-                             sus.at[su,"max_hours"]*sus.at[su,"p_nom"]]
-                  for su in fix_sus_i for sn in snapshots})
+    sus_i = sus.index
+    ext_sus_b = sus.p_nom_extendable.values
+    shape = (len(sus_i), len(snapshots))
 
-    l_constraint(model, "state_of_charge_upper", upper,
-                 list(network.storage_units.index), snapshots)
+    index = [(su,sn) for su in sus_i for sn in snapshots]
 
+    soc_vars = _pyomo_var_array(model.state_of_charge, sus_i, snapshots)
 
-    #this builds the constraint previous_soc + p_store - p_dispatch + inflow - spill == soc
-    #it is complicated by the fact that sometimes previous_soc and soc are floats, not variables
-    soc = {}
+    var_ids = np.empty(shape + (2,), dtype=object)
+    var_ids[:,:,0] = soc_vars
+    var_ids[ext_sus_b,:,1] = np.array([model.storage_p_nom[su] for su in ext_sus_i],
+                                      dtype=object)[:,np.newaxis]
 
-    #store the combinations with a fixed soc
-    fixed_soc = {}
+    coeffs = np.empty(shape + (2,))
+    coeffs[:,:,0] = 1.
+    coeffs[:,:,1] = -sus.max_hours.values[:,np.newaxis]
 
-    state_of_charge_set = get_switchable_as_dense(network, 'StorageUnit', 'state_of_charge_set', snapshots)
+    rhs = np.repeat(np.where(ext_sus_b, 0., sus.max_hours.values*sus.p_nom.values)[:,np.newaxis],
+                    len(snapshots), axis=1)
 
-    for su in sus.index:
-        for i,sn in enumerate(snapshots):
+    l_constraint_array(model, "state_of_charge_upper", index, var_ids.reshape(-1, 2),
+                       coeffs.reshape(-1, 2), "<=", rhs.ravel())
 
-            soc[su,sn] =  [[],"==",0.]
 
-            elapsed_hours = network.snapshot_weightings[sn]
+    #this builds the constraint previous_soc + p_store - p_dispatch + inflow - spill == soc
+    #it is complicated by the fact that sometimes previous_soc and soc are floats, not variables
+    elapsed_hours = network.snapshot_weightings.loc[snapshots].values
+    standing = np.power((1-sus.standing_loss.values)[:,np.newaxis], elapsed_hours)
+    non_cyclic_b = ~sus.cyclic_state_of_charge.values.astype(bool)
 
-            if i == 0 and not sus.at[su,"cyclic_state_of_charge"]:
-                previous_state_of_charge = sus.at[su,"state_of_charge_initial"]
-                soc[su,sn][2] -= ((1-sus.at[su,"standing_loss"])**elapsed_hours
-                                  * previous_state_of_charge)
-            else:
-                previous_state_of_charge = model.state_of_charge[su,snapshots[i-1]]
-                soc[su,sn][0].append(((1-sus.at[su,"standing_loss"])**elapsed_hours,
-                                      previous_state_of_charge))
+    previous_soc = np.roll(soc_vars, 1, axis=1)
+    previous_soc[non_cyclic_b,0] = None
 
+    rhs = -inflow.loc[:,sus_i].values.T * elapsed_hours
+    rhs[non_cyclic_b,0] -= standing[non_cyclic_b,0] * sus.state_of_charge_initial.values[non_cyclic_b]
 
-            state_of_charge = state_of_charge_set.at[sn,su]
-            if pd.isnull(state_of_charge):
-                state_of_charge = model.state_of_charge[su,sn]
-                soc[su,sn][0].append((-1,state_of_charge))
-            else:
-                soc[su,sn][2] += state_of_charge
-                #make sure the variable is also set to the fixed state of charge
-                fixed_soc[su,sn] = [[(1,model.state_of_charge[su,sn])],"==",state_of_charge]
+    #store the combinations with a fixed soc
+    state_of_charge_set = get_switchable_as_dense(network, 'StorageUnit', 'state_of_charge_set', snapshots)
+    state_of_charge_set = state_of_charge_set.loc[:,sus_i].values.T
+    fixed_soc_b = ~np.isnan(state_of_charge_set)
 
-            soc[su,sn][0].append((sus.at[su,"efficiency_store"]
-                                  * elapsed_hours,model.storage_p_store[su,sn]))
-            soc[su,sn][0].append((-(1/sus.at[su,"efficiency_dispatch"]) * elapsed_hours,
-                                  model.storage_p_dispatch[su,sn]))
-            soc[su,sn][2] -= inflow.at[sn,su] * elapsed_hours
+    soc = soc_vars.copy()
+    soc[fixed_soc_b] = None
+    rhs[fixed_soc_b] += state_of_charge_set[fixed_soc_b]
 
+    snapshots_i = pd.Index(snapshots)
+    spill = np.empty(shape, dtype=object)
     for su,sn in spill_index:
-        elapsed_hours = network.snapshot_weightings.at[sn]
-        storage_p_spill = model.storage_p_spill[su,sn]
-        soc[su,sn][0].append((-1.*elapsed_hours,storage_p_spill))
+        spill[sus_i.get_loc(su),snapshots_i.get_loc(sn)] = model.storage_p_spill[su,sn]
+
+    var_ids = np.stack((previous_soc, soc, _pyomo_var_array(model.storage_p_store, sus_i, snapshots),
+                        _pyomo_var_array(model.storage_p_dispatch, sus_i, snapshots), spill), axis=-1)
+
+    coeffs = np.stack((standing, -np.ones(shape),
+                       sus.efficiency_store.values[:,np.newaxis] * elapsed_hours,
+                       -(1/sus.efficiency_dispatch.values[:,np.newaxis]) * elapsed_hours,
+                       -np.ones(shape) * elapsed_hours), axis=-1)
 
-    l_constraint(model,"state_of_charge_constraint",
-                 soc,list(network.storage_units.index), snapshots)
+    l_constraint_array(model, "state_of_charge_constraint", index,
+                       var_ids.reshape(-1, 5), coeffs.reshape(-1, 5), "==", rhs.ravel())
 
-    l_constraint(model, "state_of_charge_constraint_fixed",
-                 fixed_soc, list(fixed_soc.keys()))
+    #make sure the variable is also set to the fixed state of charge
+    l_constraint_array(model, "state_of_charge_constraint_fixed",
+                       [(sus_i[i],snapshots[j]) for i,j in zip(*fixed_soc_b.nonzero())],
+                       soc_vars[fixed_soc_b], 1., "==", state_of_charge_set[fixed_soc_b])
 
 
 
@@ -549,29 +654,27 @@ def define_store_variables_constraints(network,snapshots):
 
     ## Builds the constraint previous_e - p == e ##
 
-    e = {}
+    shape = (len(stores.index), len(snapshots))
 
-    for store in stores.index:
-        for i,sn in enumerate(snapshots):
+    elapsed_hours = network.snapshot_weightings.loc[snapshots].values
+    standing = np.power((1-stores.standing_loss.values)[:,np.newaxis], elapsed_hours)
+    non_cyclic_b = ~stores.e_cyclic.values.astype(bool)
 
-            e[store,sn] =  LConstraint(sense="==")
+    e_vars = _pyomo_var_array(model.store_e, stores.index, snapshots)
 
-            e[store,sn].lhs.variables.append((-1,model.store_e[store,sn]))
+    previous_e = np.roll(e_vars, 1, axis=1)
+    previous_e[non_cyclic_b,0] = None
 
-            elapsed_hours = network.snapshot_weightings[sn]
+    rhs = np.zeros(shape)
+    rhs[non_cyclic_b,0] = -standing[non_cyclic_b,0] * stores.e_initial.values[non_cyclic_b]
 
-            if i == 0 and not stores.at[store,"e_cyclic"]:
-                previous_e = stores.at[store,"e_initial"]
-                e[store,sn].lhs.constant += ((1-stores.at[store,"standing_loss"])**elapsed_hours
-                                         * previous_e)
-            else:
-                previous_e = model.store_e[store,snapshots[i-1]]
-                e[store,sn].lhs.variables.append(((1-stores.at[store,"standing_loss"])**elapsed_hours,
-                                              previous_e))
+    var_ids = np.stack((e_vars, previous_e, _pyomo_var_array(model.store_p, stores.index, snapshots)),
+                       axis=-1)
 
-            e[store,sn].lhs.variables.append((-elapsed_hours, model.store_p[store,sn]))
+    coeffs = np.stack((-np.ones(shape), standing, -np.ones(shape) * elapsed_hours), axis=-1)
 
-    l_constraint(model,"store_constraint", e, list(stores.index), snapshots)
+    l_constraint_array(model, "store_constraint", [(store,sn) for store in stores.index for sn in snapshots],
+                       var_ids.reshape(-1, 3), coeffs.reshape(-1, 3), "==", rhs.ravel())
 
 
 
@@ -620,30 +723,32 @@ def define_link_flows(network,snapshots):
 
     network.model.link_p = Var(list(network.links.index), snapshots)
 
-    p_upper = {(cb, sn) : LConstraint(LExpression([(1, network.model.link_p[cb, sn])],
-                                                 -fixed_upper.at[sn, cb]),"<=")
-               for cb in fixed_links_i for sn in snapshots}
+    links_i = network.links.index
+    extendable_b = network.links.p_nom_extendable.values
 
-    p_upper.update({(cb,sn) : LConstraint(LExpression([(1, network.model.link_p[cb, sn]),
-                                                       (-p_max_pu.at[sn, cb], network.model.link_p_nom[cb])]),
-                                          "<=")
-                    for cb in extendable_links_i for sn in snapshots})
+    index = [(cb, sn) for cb in links_i for sn in snapshots]
 
-    l_constraint(network.model, "link_p_upper", p_upper,
-                 list(network.links.index), snapshots)
+    var_ids = np.empty((len(links_i), len(snapshots), 2), dtype=object)
+    var_ids[:,:,0] = _pyomo_var_array(network.model.link_p, links_i, snapshots)
+    var_ids[extendable_b,:,1] = np.array([network.model.link_p_nom[cb] for cb in extendable_links_i],
+                                         dtype=object)[:,np.newaxis]
 
+    p_max_pu = p_max_pu.loc[:,links_i].values.T
+    p_min_pu = p_min_pu.loc[:,links_i].values.T
 
-    p_lower = {(cb, sn) : LConstraint(LExpression([(1, network.model.link_p[cb, sn])],
-                                                  -fixed_lower.at[sn, cb]),">=")
-               for cb in fixed_links_i for sn in snapshots}
+    rhs = np.zeros(p_max_pu.shape)
+    rhs[~extendable_b] = fixed_upper.values.T
 
-    p_lower.update({(cb,sn) : LConstraint(LExpression([(1, network.model.link_p[cb, sn]),
-                                                       (-p_min_pu.at[sn, cb], network.model.link_p_nom[cb])]),
-                                          ">=")
-                    for cb in extendable_links_i for sn in snapshots})
+    l_constraint_array(network.model, "link_p_upper", index, var_ids.reshape(-1, 2),
+                       np.stack((np.ones(p_max_pu.shape), -p_max_pu), axis=-1).reshape(-1, 2),
+                       "<=", rhs.ravel())
 
-    l_constraint(network.model, "link_p_lower", p_lower,
-                 list(network.links.index), snapshots)
+    rhs = np.zeros(p_min_pu.shape)
+    rhs[~extendable_b] = fixed_lower.values.T
+
+    l_constraint_array(network.model, "link_p_lower", index, var_ids.reshape(-1, 2),
+                       np.stack((np.ones(p_min_pu.shape), -p_min_pu), axis=-1).reshape(-1, 2),
+                       ">=", rhs.ravel())
 
 
 
@@ -701,7 +806,15 @@ def define_passive_branch_flows_with_PTDF(network,snapshots,ptdf_tolerance=0.):
 
     network.model.passive_branch_p = Var(list(passive_branches.index), snapshots)
 
-    flows = {}
+    passive_branch_ids = _balance_variable_ids(network, network.model.passive_branch_p,
+                                               passive_branches.index, snapshots)
+
+    B, variables = _balance_matrix(network)
+    constant = _balance_constant(network)
+
+    lhs = []
+    rhs = []
+    index = []
 
     for sub_network in network.sub_networks.obj:
         find_bus_controls(sub_network)
@@ -713,20 +826,19 @@ def define_passive_branch_flows_with_PTDF(network,snapshots,ptdf_tolerance=0.):
             #kill small PTDF values
             sub_network.PTDF[abs(sub_network.PTDF) < ptdf_tolerance] = 0
 
-        for i,branch in enumerate(branches_i):
-            bt = branch[0]
-            bn = branch[1]
+            PTDF = kron(csr_matrix(sub_network.PTDF), identity(len(snapshots)), format="csr")
+            rows = _balance_rows(network, sub_network.buses_o, snapshots)
 
-            for sn in snapshots:
-                lhs = sum(sub_network.PTDF[i,j]*network._p_balance[bus,sn]
-                          for j,bus in enumerate(sub_network.buses_o)
-                          if sub_network.PTDF[i,j] != 0)
-                rhs = LExpression([(1,network.model.passive_branch_p[bt,bn,sn])])
-                flows[bt,bn,sn] = LConstraint(lhs,"==",rhs)
+            lhs.append(PTDF.dot(B[rows]) -
+                       _snapshot_terms(identity(len(branches_i)),
+                                       passive_branch_ids[passive_branches.index.get_indexer(branches_i)],
+                                       len(variables)))
+            rhs.append(-PTDF.dot(constant[rows]))
+            index.extend((bt,bn,sn) for bt,bn in branches_i for sn in snapshots)
 
-
-    l_constraint(network.model, "passive_branch_p_def", flows,
-                 list(passive_branches.index), snapshots)
+    l_constraint_array(network.model, "passive_branch_p_def", index, variables,
+                       svstack(lhs, format="csr") if lhs else None, "==",
+                       np.concatenate(rhs) if rhs else 0.)
 
 
 def define_sub_network_cycle_constraints( subnetwork, snapshots, passive_branch_p, attribute):
@@ -800,32 +912,50 @@ def define_passive_branch_flows_with_cycles(network,snapshots):
 
     network.model.cycles = Var(cycle_index, snapshots, domain=Reals, bounds=(None,None))
 
-    flows = {}
+    passive_branch_ids = _balance_variable_ids(network, network.model.passive_branch_p,
+                                               passive_branches.index, snapshots)
+
+    cycle_ids = _balance_variable_ids(network, network.model.cycles, cycle_index, snapshots)
+    cycle_pos = pd.Series(np.arange(len(cycle_index)), pd.MultiIndex.from_tuples(cycle_index)
+                          if cycle_index else None)
+
+    B, variables = _balance_matrix(network)
+    constant = _balance_constant(network)
+
+    lhs = []
+    rhs = []
+    index = []
 
     for subnetwork in network.sub_networks.obj:
         branches = subnetwork.branches()
         buses = subnetwork.buses()
-        for i,branch in enumerate(branches.index):
-            bt = branch[0]
-            bn = branch[1]
 
-            cycle_is = subnetwork.C[i,:].nonzero()[1]
-            tree_is = subnetwork.T[i,:].nonzero()[1]
+        if len(branches) == 0: continue
 
-            if len(cycle_is) + len(tree_is) == 0: logger.error("The cycle formulation does not support infinite impedances, yet.")
+        C = csr_matrix(subnetwork.C)
+        T = csr_matrix(subnetwork.T)
 
-            for snapshot in snapshots:
-                expr = LExpression([(subnetwork.C[i,j], network.model.cycles[subnetwork.name,j,snapshot])
-                                    for j in cycle_is])
-                lhs = expr + sum(subnetwork.T[i,j]*network._p_balance[buses.index[j],snapshot]
-                                 for j in tree_is)
+        if ((abs(C).sum(axis=1) + abs(T).sum(axis=1)) == 0).any():
+            logger.error("The cycle formulation does not support infinite impedances, yet.")
 
-                rhs = LExpression([(1,network.model.passive_branch_p[bt,bn,snapshot])])
+        cycles_j = C.getnnz(axis=0).nonzero()[0]
 
-                flows[bt,bn,snapshot] = LConstraint(lhs,"==",rhs)
+        T = kron(T, identity(len(snapshots)), format="csr")
+        rows = _balance_rows(network, buses.index, snapshots)
 
-    l_constraint(network.model, "passive_branch_p_def", flows,
-                 list(passive_branches.index), snapshots)
+        lhs.append(_snapshot_terms(C[:,cycles_j],
+                                   cycle_ids[cycle_pos.loc[[(subnetwork.name,j) for j in cycles_j]].values],
+                                   len(variables)) +
+                   T.dot(B[rows]) -
+                   _snapshot_terms(identity(len(branches)),
+                                   passive_branch_ids[passive_branches.index.get_indexer(branches.index)],
+                                   len(variables)))
+        rhs.append(-T.dot(constant[rows]))
+        index.extend((bt,bn,sn) for bt,bn in branches.index for sn in snapshots)
+
+    l_constraint_array(network.model, "passive_branch_p_def", index, variables,
+                       svstack(lhs, format="csr") if lhs else None, "==",
+                       np.concatenate(rhs) if rhs else 0.)
 
 
 
@@ -868,129 +998,176 @@ def define_passive_branch_constraints(network,snapshots):
 
     passive_branches = network.passive_branches()
     extendable_branches = passive_branches[passive_branches.s_nom_extendable]
-    fixed_branches = passive_branches[~ passive_branches.s_nom_extendable]
-
 
     s_max_pu = pd.concat({c : get_switchable_as_dense(network, c, 's_max_pu', snapshots)
                           for c in network.passive_branch_components}, axis=1, sort=False)
 
-    flow_upper = {(b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn])],
-                                    "<=", s_max_pu.at[sn,b]*fixed_branches.at[b,"s_nom"]]
-                  for b in fixed_branches.index
-                  for sn in snapshots}
-
-    flow_upper.update({(b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn]),
-                                          (-s_max_pu.at[sn,b],network.model.passive_branch_s_nom[b[0],b[1]])],"<=",0]
-                       for b in extendable_branches.index
-                       for sn in snapshots})
-
-    l_constraint(network.model, "flow_upper", flow_upper,
-                 list(passive_branches.index), snapshots)
-
-    flow_lower = {(b[0],b[1],sn) : [[(1,network.model.passive_branch_p[b[0],b[1],sn])],
-                                    ">=", -s_max_pu.at[sn,b]*fixed_branches.at[b,"s_nom"]]
-                  for b in fixed_branches.index
-                  for sn in snapshots}
-
-    flow_lower.update({(b[0],b[1],sn): [[(1,network.model.passive_branch_p[b[0],b[1],sn]),
-                                         (s_max_pu.at[sn,b],network.model.passive_branch_s_nom[b[0],b[1]])],">=",0]
-                       for b in extendable_branches.index
-                       for sn in snapshots})
-
-    l_constraint(network.model, "flow_lower", flow_lower,
-                 list(passive_branches.index), snapshots)
+    s_max_pu = s_max_pu.loc[snapshots,passive_branches.index].values.T
+
+    extendable_b = passive_branches.s_nom_extendable.values
+
+    index = [(b[0],b[1],sn) for b in passive_branches.index for sn in snapshots]
+
+    var_ids = np.empty(s_max_pu.shape + (2,), dtype=object)
+    var_ids[:,:,0] = _pyomo_var_array(network.model.passive_branch_p, passive_branches.index, snapshots)
+    var_ids[extendable_b,:,1] = np.array([network.model.passive_branch_s_nom[b]
+                                          for b in extendable_branches.index],
+                                         dtype=object)[:,np.newaxis]
+    var_ids = var_ids.reshape(-1, 2)
+
+    s_nom = np.where(extendable_b, 0., passive_branches.s_nom.values)[:,np.newaxis]
+    ones = np.ones(s_max_pu.shape)
+
+    l_constraint_array(network.model, "flow_upper", index, var_ids,
+                       np.stack((ones, -s_max_pu), axis=-1).reshape(-1, 2),
+                       "<=", (s_max_pu*s_nom).ravel())
+
+    l_constraint_array(network.model, "flow_lower", index, var_ids,
+                       np.stack((ones, s_max_pu), axis=-1).reshape(-1, 2),
+                       ">=", (-s_max_pu*s_nom).ravel())
+
+def _snapshot_terms(matrix, ids, num_variables):
+    """Apply the sparse matrix (m x n) in each snapshot to the variables
+    with the ids (n x snapshots); the result has a row for each row of
+    `matrix` and snapshot (row-major) and a column for each variable."""
+
+    matrix = coo_matrix(matrix)
+    num_snapshots = ids.shape[1]
+    rows = (matrix.row[:,np.newaxis]*num_snapshots + np.arange(num_snapshots)).ravel()
+    cols = ids[matrix.col].ravel()
+    vals = np.repeat(matrix.data, num_snapshots)
+    return csr_matrix((vals, (rows, cols)), shape=(matrix.shape[0]*num_snapshots, num_variables))
+
+def _balance_variable_ids(network, var, components, snapshots):
+    """Register the variables var[component,snapshot] as columns of the
+    nodal balance matrix and return their ids (components x snapshots)."""
+
+    balance = network._p_balance
+    variables = _pyomo_var_array(var, components, snapshots)
+    ids = balance.num_variables + np.arange(variables.size).reshape(variables.shape)
+    balance.variables.append(variables.ravel())
+    balance.num_variables += variables.size
+    return ids
+
+def _add_to_balance(network, buses, coeffs, ids):
+    """Add coeffs*x[ids] to the nodal balance through the (bus x
+    component) incidence matrix of `buses`, where ids is a components
+    x snapshots array and coeffs is broadcastable to it."""
+
+    balance = network._p_balance
+    incidence = coo_matrix((np.ones(len(buses)),
+                            (network.buses.index.get_indexer(buses), np.arange(len(buses)))),
+                           shape=(len(network.buses.index), len(buses)))
+    coeffs = np.broadcast_to(np.asarray(coeffs, dtype=float), ids.shape)
+    num_snapshots = ids.shape[1]
+    balance.rows.append((incidence.row[:,np.newaxis]*num_snapshots + np.arange(num_snapshots)).ravel())
+    balance.cols.append(ids[incidence.col].ravel())
+    balance.vals.append((incidence.data[:,np.newaxis]*coeffs[incidence.col]).ravel())
+
+def _balance_matrix(network):
+    """Return the sparse matrix of the nodal balances, with a row for
+    each bus and snapshot (bus-major), and the array of the pyomo
+    variables of its columns."""
+
+    balance = network._p_balance
+    shape = (len(network.buses.index)*len(balance.constant.index), balance.num_variables)
+    B = csr_matrix((np.concatenate(balance.vals),
+                    (np.concatenate(balance.rows), np.concatenate(balance.cols))), shape=shape)
+    variables = (np.concatenate(balance.variables) if balance.variables
+                 else np.empty(0, dtype=object))
+    return B, variables
+
+def _balance_constant(network):
+    """Return the constant of the nodal balances (bus-major)."""
+    return network._p_balance.constant.values.T.ravel()
+
+def _balance_rows(network, buses, snapshots):
+    """Return the rows of the nodal balance matrix of buses."""
+    return (network.buses.index.get_indexer(buses)[:,np.newaxis]*len(snapshots)
+            + np.arange(len(snapshots))).ravel()
 
 def define_nodal_balances(network,snapshots):
     """Construct the nodal balance for all elements except the passive
     branches.
 
-    Store the nodal balance expression in network._p_balance.
+    Store the nodal balance in network._p_balance as sparse terms with
+    a row for each bus and snapshot and the pyomo variables of the
+    columns, see _balance_matrix.
     """
 
-    #dictionary for constraints
-    network._p_balance = {(bus,sn) : LExpression()
-                          for bus in network.buses.index
-                          for sn in snapshots}
+    network._p_balance = Dict(rows=[np.empty(0, dtype=int)], cols=[np.empty(0, dtype=int)],
+                              vals=[np.empty(0)], variables=[], num_variables=0,
+                              constant=pd.DataFrame(0., index=snapshots,
+                                                    columns=network.buses.index))
 
-    efficiency = get_switchable_as_dense(network, 'Link', 'efficiency', snapshots)
+    links = network.links
+    link_ids = _balance_variable_ids(network, network.model.link_p, links.index, snapshots)
 
-    for cb in network.links.index:
-        bus0 = network.links.at[cb,"bus0"]
-        bus1 = network.links.at[cb,"bus1"]
+    efficiency = get_switchable_as_dense(network, 'Link', 'efficiency', snapshots)
 
-        for sn in snapshots:
-            network._p_balance[bus0,sn].variables.append((-1,network.model.link_p[cb,sn]))
-            network._p_balance[bus1,sn].variables.append((efficiency.at[sn,cb],network.model.link_p[cb,sn]))
+    _add_to_balance(network, links.bus0, -1., link_ids)
+    _add_to_balance(network, links.bus1, efficiency.loc[:,links.index].values.T, link_ids)
 
     #Add any other buses to which the links are attached
-    for i in [int(col[3:]) for col in network.links.columns if col[:3] == "bus" and col not in ["bus0","bus1"]]:
+    for i in [int(col[3:]) for col in links.columns if col[:3] == "bus" and col not in ["bus0","bus1"]]:
         efficiency = get_switchable_as_dense(network, 'Link', 'efficiency{}'.format(i), snapshots)
-        for cb in network.links.index[network.links["bus{}".format(i)] != ""]:
-            bus = network.links.at[cb, "bus{}".format(i)]
-            for sn in snapshots:
-                network._p_balance[bus,sn].variables.append((efficiency.at[sn,cb],network.model.link_p[cb,sn]))
+        attached_b = (links["bus{}".format(i)] != "").values
+        _add_to_balance(network, links["bus{}".format(i)][attached_b],
+                        efficiency.loc[:,links.index[attached_b]].values.T, link_ids[attached_b])
 
+    gens = network.generators
+    _add_to_balance(network, gens.bus, gens.sign.values[:,np.newaxis],
+                    _balance_variable_ids(network, network.model.generator_p, gens.index, snapshots))
 
-    for gen in network.generators.index:
-        bus = network.generators.at[gen,"bus"]
-        sign = network.generators.at[gen,"sign"]
-        for sn in snapshots:
-            network._p_balance[bus,sn].variables.append((sign,network.model.generator_p[gen,sn]))
-
+    loads = network.loads
     load_p_set = get_switchable_as_dense(network, 'Load', 'p_set', snapshots)
-    for load in network.loads.index:
-        bus = network.loads.at[load,"bus"]
-        sign = network.loads.at[load,"sign"]
-        for sn in snapshots:
-            network._p_balance[bus,sn].constant += sign*load_p_set.at[sn,load]
+    network._p_balance.constant += (load_p_set.loc[:,loads.index].multiply(loads.sign)
+                                    .groupby(loads.bus, axis=1).sum()
+                                    .reindex(columns=network.buses.index, fill_value=0.))
 
-    for su in network.storage_units.index:
-        bus = network.storage_units.at[su,"bus"]
-        sign = network.storage_units.at[su,"sign"]
-        for sn in snapshots:
-            network._p_balance[bus,sn].variables.append((sign,network.model.storage_p_dispatch[su,sn]))
-            network._p_balance[bus,sn].variables.append((-sign,network.model.storage_p_store[su,sn]))
+    sus = network.storage_units
+    _add_to_balance(network, sus.bus, sus.sign.values[:,np.newaxis],
+                    _balance_variable_ids(network, network.model.storage_p_dispatch, sus.index, snapshots))
+    _add_to_balance(network, sus.bus, -sus.sign.values[:,np.newaxis],
+                    _balance_variable_ids(network, network.model.storage_p_store, sus.index, snapshots))
 
-    for store in network.stores.index:
-        bus = network.stores.at[store,"bus"]
-        sign = network.stores.at[store,"sign"]
-        for sn in snapshots:
-            network._p_balance[bus,sn].variables.append((sign,network.model.store_p[store,sn]))
+    stores = network.stores
+    _add_to_balance(network, stores.bus, stores.sign.values[:,np.newaxis],
+                    _balance_variable_ids(network, network.model.store_p, stores.index, snapshots))
 
 
 def define_nodal_balance_constraints(network,snapshots):
 
     passive_branches = network.passive_branches()
 
+    passive_branch_ids = _balance_variable_ids(network, network.model.passive_branch_p,
+                                               passive_branches.index, snapshots)
 
-    for branch in passive_branches.index:
-        bus0 = passive_branches.at[branch,"bus0"]
-        bus1 = passive_branches.at[branch,"bus1"]
-        bt = branch[0]
-        bn = branch[1]
-        for sn in snapshots:
-            network._p_balance[bus0,sn].variables.append((-1,network.model.passive_branch_p[bt,bn,sn]))
-            network._p_balance[bus1,sn].variables.append((1,network.model.passive_branch_p[bt,bn,sn]))
+    _add_to_balance(network, passive_branches.bus0, -1., passive_branch_ids)
+    _add_to_balance(network, passive_branches.bus1, 1., passive_branch_ids)
 
-    power_balance = {k: LConstraint(v,"==",LExpression()) for k,v in iteritems(network._p_balance)}
+    B, variables = _balance_matrix(network)
 
-    l_constraint(network.model, "power_balance", power_balance,
-                 list(network.buses.index), snapshots)
+    l_constraint_array(network.model, "power_balance",
+                       [(bus,sn) for bus in network.buses.index for sn in snapshots],
+                       variables, B, "==", -_balance_constant(network))
 
 
 def define_sub_network_balance_constraints(network,snapshots):
 
-    sn_balance = {}
+    sub_networks_i = network.sub_networks.index
+    buses = network.buses
 
-    for sub_network in network.sub_networks.obj:
-        for sn in snapshots:
-            sn_balance[sub_network.name,sn] = LConstraint(LExpression(),"==",LExpression())
-            for bus in sub_network.buses().index:
-                sn_balance[sub_network.name,sn].lhs.variables.extend(network._p_balance[bus,sn].variables)
-                sn_balance[sub_network.name,sn].lhs.constant += network._p_balance[bus,sn].constant
+    S = csr_matrix((np.ones(len(buses.index)),
+                    (sub_networks_i.get_indexer(buses.sub_network), np.arange(len(buses.index)))),
+                   shape=(len(sub_networks_i), len(buses.index)))
+    S = kron(S, identity(len(snapshots)), format="csr")
+
+    B, variables = _balance_matrix(network)
 
-    l_constraint(network.model,"sub_network_balance_constraint", sn_balance,
-                 list(network.sub_networks.index), snapshots)
+    l_constraint_array(network.model, "sub_network_balance_constraint",
+                       [(sub_network,sn) for sub_network in sub_networks_i for sn in snapshots],
+                       variables, S.dot(B), "==", -S.dot(_balance_constant(network)))
 
 
 def define_global_constraints(network,snapshots):
@@ -1013,26 +1190,26 @@ def define_global_constraints(network,snapshots):
                     continue
                 #for generators, use the prime mover carrier
                 gens = network.generators.index[network.generators.carrier == carrier]
-                c.lhs.variables.extend([(attribute
-                                         * (1/network.generators.at[gen,"efficiency"])
-                                         * network.snapshot_weightings[sn],
-                                         network.model.generator_p[gen,sn])
-                                        for gen in gens
-                                        for sn in snapshots])
+                c.lhs += LExpression([(attribute
+                                       * (1/network.generators.at[gen,"efficiency"])
+                                       * network.snapshot_weightings[sn],
+                                       network.model.generator_p[gen,sn])
+                                      for gen in gens
+                                      for sn in snapshots])
 
                 #for storage units, use the prime mover carrier
                 #take difference of energy at end and start of period
                 sus = network.storage_units.index[(network.storage_units.carrier == carrier) & (~network.storage_units.cyclic_state_of_charge)]
-                c.lhs.variables.extend([(-attribute, network.model.state_of_charge[su,snapshots[-1]])
-                                        for su in sus])
+                c.lhs += LExpression([(-attribute, network.model.state_of_charge[su,snapshots[-1]])
+                                      for su in sus])
                 c.lhs.constant += sum(attribute*network.storage_units.at[su,"state_of_charge_initial"]
                                       for su in sus)
 
                 #for stores, inherit the carrier from the bus
                 #take difference of energy at end and start of period
                 stores = network.stores.index[(network.stores.bus.map(network.buses.carrier) == carrier) & (~network.stores.e_cyclic)]
-                c.lhs.variables.extend([(-attribute, network.model.store_e[store,snapshots[-1]])
-                                        for store in stores])
+                c.lhs += LExpression([(-attribute, network.model.store_e[store,snapshots[-1]])
+                                      for store in stores])
                 c.lhs.constant += sum(attribute*network.stores.at[store,"e_initial"]
                                       for store in stores)
 
@@ -1081,55 +1258,55 @@ def define_linear_objective(network,snapshots):
         weight = network.snapshot_weightings[sn]
         for gen in network.generators.index:
             coefficient = gen_mc.at[gen] * weight
-            objective.variables.extend([(coefficient, model.generator_p[gen, sn])])
+            objective.add_term(coefficient, model.generator_p[gen, sn])
 
         for su in network.storage_units.index:
             coefficient = su_mc.at[su] * weight
-            objective.variables.extend([(coefficient, model.storage_p_dispatch[su,sn])])
+            objective.add_term(coefficient, model.storage_p_dispatch[su,sn])
 
         for store in network.stores.index:
             coefficient = st_mc.at[store] * weight
-            objective.variables.extend([(coefficient, model.store_p[store,sn])])
+            objective.add_term(coefficient, model.store_p[store,sn])
 
         for link in network.links.index:
             coefficient = link_mc.at[link] * weight
-            objective.variables.extend([(coefficient, model.link_p[link,sn])])
+            objective.add_term(coefficient, model.link_p[link,sn])
 
 
     #NB: for capital costs we subtract the costs of existing infrastructure p_nom/s_nom
 
-    objective.variables.extend([(extendable_generators.at[gen,"capital_cost"], model.generator_p_nom[gen])
-                                for gen in extendable_generators.index])
+    objective += LExpression([(extendable_generators.at[gen,"capital_cost"], model.generator_p_nom[gen])
+                              for gen in extendable_generators.index])
     objective.constant -= (extendable_generators.capital_cost * extendable_generators.p_nom).zsum()
 
-    objective.variables.extend([(ext_sus.at[su,"capital_cost"], model.storage_p_nom[su])
-                                for su in ext_sus.index])
+    objective += LExpression([(ext_sus.at[su,"capital_cost"], model.storage_p_nom[su])
+                              for su in ext_sus.index])
     objective.constant -= (ext_sus.capital_cost*ext_sus.p_nom).zsum()
 
-    objective.variables.extend([(ext_stores.at[store,"capital_cost"], model.store_e_nom[store])
-                                for store in ext_stores.index])
+    objective += LExpression([(ext_stores.at[store,"capital_cost"], model.store_e_nom[store])
+                              for store in ext_stores.index])
     objective.constant -= (ext_stores.capital_cost*ext_stores.e_nom).zsum()
 
-    objective.variables.extend([(extendable_passive_branches.at[b,"capital_cost"], model.passive_branch_s_nom[b])
-                                for b in extendable_passive_branches.index])
+    objective += LExpression([(extendable_passive_branches.at[b,"capital_cost"], model.passive_branch_s_nom[b])
+                              for b in extendable_passive_branches.index])
     objective.constant -= (extendable_passive_branches.capital_cost * extendable_passive_branches.s_nom).zsum()
 
-    objective.variables.extend([(extendable_links.at[b,"capital_cost"], model.link_p_nom[b])
-                                for b in extendable_links.index])
+    objective += LExpression([(extendable_links.at[b,"capital_cost"], model.link_p_nom[b])
+                              for b in extendable_links.index])
     objective.constant -= (extendable_links.capital_cost * extendable_links.p_nom).zsum()
 
 
     ## Unit commitment costs
 
-    objective.variables.extend([(1, model.generator_start_up_cost[gen,sn]) for gen in suc_gens_i for sn in snapshots])
+    objective += LExpression([(1, model.generator_start_up_cost[gen,sn]) for gen in suc_gens_i for sn in snapshots])
 
-    objective.variables.extend([(1, model.generator_shut_down_cost[gen,sn]) for gen in sdc_gens_i for sn in snapshots])
+    objective += LExpression([(1, model.generator_shut_down_cost[gen,sn]) for gen in sdc_gens_i for sn in snapshots])
 
 
     l_objective(model,objective)
 
 def extract_optimisation_results(network, snapshots, formulation="angles", free_pyomo=True,
-                                 extra_postprocessing=None):
+                                 extra_postprocessing=None, from_lp=False):
 
     if isinstance(snapshots, pd.DatetimeIndex) and _pd_version < '0.18.0':
         # Work around pandas bug #12050 (https://github.com/pydata/pandas/issues/12050)
@@ -1145,57 +1322,78 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
                                          'Link': ["p"+col[3:] for col in network.links.columns if col[:3] == "bus"]
                                                   +['mu_lower', 'mu_upper']})
 
-    #get value of objective function
-    network.objective = network.results["Problem"][0]["Upper bound"]
-
     model = network.model
 
-    duals = pd.Series(list(model.dual.values()), index=pd.Index(list(model.dual.keys())))
-
-    if free_pyomo:
-        model.dual.clear()
-
-    def clear_indexedvar(indexedvar):
-        for v in itervalues(indexedvar._data):
-            v.clear()
+    #without pyomo (or with the "array" builder) the solution is read
+    #from the arrays of network.lp
+    if model is None or from_lp or getattr(network, "_pyomo_grids", None) is None:
+        lp = network.lp
 
-    def get_values(indexedvar, free=free_pyomo):
-        s = pd.Series(indexedvar.get_values())
-        if free:
-            clear_indexedvar(indexedvar)
-        return s
+        if not (model is None or from_lp):
+            read_pyomo_solution(lp, network.results["Problem"][0]["Upper bound"])
 
-    def set_from_series(df, series):
-        df.loc[snapshots] = series.unstack(0).reindex(columns=df.columns)
+        #get value of objective function
+        network.objective = lp.objective_value
 
-    def get_shadows(constraint, multiind=True):
-        if len(constraint) == 0: return pd.Series()
+        get_values = lp.get_value_grid
+        get_shadows = lp.get_dual_grid
 
-        index = list(constraint.keys())
-        if multiind:
-            index = pd.MultiIndex.from_tuples(index)
-        cdata = pd.Series(list(constraint.values()), index=index)
-        return cdata.map(duals)
+    else:
+        #get value of objective function
+        network.objective = network.results["Problem"][0]["Upper bound"]
+
+        grids = network._pyomo_grids
+
+        #the values of all recorded variables and constraints are read
+        #at once and then taken by the id grids, as for network.lp
+        solution = np.array([np.nan if v.value is None else v.value
+                             for v in grids.pyomo_variables], dtype=float)
+        duals = model.dual
+        dual = np.array([duals.get(c, np.nan) for c in grids.pyomo_constraints], dtype=float)
+
+        def clear_indexedvar(indexedvar):
+            for v in itervalues(indexedvar._data):
+                v.clear()
+
+        def get_values(name, free=free_pyomo):
+            values = LinearProblem._grid(grids.variables[name], solution)
+            if free:
+                clear_indexedvar(getattr(model, name))
+            return values
+
+        def get_shadows(name):
+            return LinearProblem._grid(grids.constraints[name], dual)
+
+    #extra_postprocessing gets the duals of the pyomo model, which
+    #include the constraints added by extra_functionality, unless the
+    #model was reused from a previous problem
+    def get_duals():
+        if model is not None and not from_lp:
+            return pd.Series(list(model.dual.values()), index=pd.Index(list(model.dual.keys())))
+        return pd.Series(network.lp.dual)
+
+    def set_from_frame(df, frame):
+        df.loc[snapshots] = frame.reindex(columns=df.columns).values
 
     if len(network.generators):
-        set_from_series(network.generators_t.p, get_values(model.generator_p))
+        set_from_frame(network.generators_t.p, get_values("generator_p"))
 
     if len(network.storage_units):
-        set_from_series(network.storage_units_t.p,
-                        get_values(model.storage_p_dispatch)
-                        - get_values(model.storage_p_store))
+        set_from_frame(network.storage_units_t.p,
+                        get_values("storage_p_dispatch")
+                        - get_values("storage_p_store"))
 
-        set_from_series(network.storage_units_t.state_of_charge,
-                        get_values(model.state_of_charge))
+        set_from_frame(network.storage_units_t.state_of_charge,
+                        get_values("state_of_charge"))
 
         if (network.storage_units_t.inflow.max() > 0).any():
-            set_from_series(network.storage_units_t.spill,
-                            get_values(model.storage_p_spill))
+            set_from_frame(network.storage_units_t.spill,
+                            get_values("storage_p_spill"))
         network.storage_units_t.spill.fillna(0, inplace=True) #p_spill doesn't exist if inflow=0
 
     if len(network.stores):
-        set_from_series(network.stores_t.p, get_values(model.store_p))
-        set_from_series(network.stores_t.e, get_values(model.store_e))
+        set_from_frame(network.stores_t.p, get_values("store_p"))
+        set_from_frame(network.stores_t.e, get_values("store_e"))
 
     if len(network.loads):
         load_p_set = get_switchable_as_dense(network, 'Load', 'p_set', snapshots)
@@ -1213,20 +1411,20 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
 
 
     # passive branches
-    passive_branches = get_values(model.passive_branch_p)
-    flow_lower = get_shadows(model.flow_lower)
-    flow_upper = get_shadows(model.flow_upper)
+    passive_branches = get_values("passive_branch_p")
+    flow_lower = get_shadows("flow_lower")
+    flow_upper = get_shadows("flow_upper")
     for c in network.iterate_components(network.passive_branch_components):
-        set_from_series(c.pnl.p0, passive_branches.loc[c.name])
+        set_from_frame(c.pnl.p0, passive_branches[c.name])
         c.pnl.p1.loc[snapshots] = - c.pnl.p0.loc[snapshots]
 
-        set_from_series(c.pnl.mu_lower, flow_lower[c.name])
-        set_from_series(c.pnl.mu_upper, -flow_upper[c.name])
+        set_from_frame(c.pnl.mu_lower, flow_lower[c.name])
+        set_from_frame(c.pnl.mu_upper, -flow_upper[c.name])
     del flow_lower, flow_upper
 
     # active branches
     if len(network.links):
-        set_from_series(network.links_t.p0, get_values(model.link_p))
+        set_from_frame(network.links_t.p0, get_values("link_p"))
 
         efficiency = get_switchable_as_dense(network, 'Link', 'efficiency', snapshots)
 
@@ -1251,27 +1449,25 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
                                                  .reindex(columns=network.buses_t.p.columns, fill_value=0.))
 
 
-        set_from_series(network.links_t.mu_lower, get_shadows(model.link_p_lower))
-        set_from_series(network.links_t.mu_upper, - get_shadows(model.link_p_upper))
+        set_from_frame(network.links_t.mu_lower, get_shadows("link_p_lower"))
+        set_from_frame(network.links_t.mu_upper, - get_shadows("link_p_upper"))
 
     if len(network.buses):
         if formulation in {'angles', 'kirchhoff'}:
-            set_from_series(network.buses_t.marginal_price,
-                            pd.Series(list(model.power_balance.values()),
-                                      index=pd.MultiIndex.from_tuples(list(model.power_balance.keys())))
-                            .map(duals))
+            set_from_frame(network.buses_t.marginal_price,
+                            get_shadows("power_balance"))
 
             #correct for snapshot weightings
             network.buses_t.marginal_price.loc[snapshots] = network.buses_t.marginal_price.loc[snapshots].divide(network.snapshot_weightings.loc[snapshots],axis=0)
 
         if formulation == "angles":
-            set_from_series(network.buses_t.v_ang,
-                            get_values(model.voltage_angles))
+            set_from_frame(network.buses_t.v_ang,
+                            get_values("voltage_angles"))
         elif formulation in ["ptdf","cycles","kirchhoff"]:
             for sn in network.sub_networks.obj:
                 network.buses_t.v_ang.loc[snapshots,sn.slack_bus] = 0.
                 if len(sn.pvpqs) > 0:
-                    network.buses_t.v_ang.loc[snapshots,sn.pvpqs] = spsolve(sn.B[1:, 1:], network.buses_t.p.loc[snapshots,sn.pvpqs].T).T
+                    network.buses_t.v_ang.loc[snapshots,sn.pvpqs] = factorize_B(sn).solve(np.ascontiguousarray(network.buses_t.p.loc[snapshots,sn.pvpqs].T.values, dtype=float)).T
 
         network.buses_t.v_mag_pu.loc[snapshots,network.buses.carrier=="AC"] = 1.
         network.buses_t.v_mag_pu.loc[snapshots,network.buses.carrier=="DC"] = 1 + network.buses_t.v_ang.loc[snapshots,network.buses.carrier=="DC"]
@@ -1283,20 +1479,20 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
     network.generators.p_nom_opt = network.generators.p_nom
 
     network.generators.loc[network.generators.p_nom_extendable, 'p_nom_opt'] = \
-        get_values(network.model.generator_p_nom)
+        get_values("generator_p_nom")
 
     network.storage_units.p_nom_opt = network.storage_units.p_nom
 
     network.storage_units.loc[network.storage_units.p_nom_extendable, 'p_nom_opt'] = \
-        get_values(network.model.storage_p_nom)
+        get_values("storage_p_nom")
 
     network.stores.e_nom_opt = network.stores.e_nom
 
     network.stores.loc[network.stores.e_nom_extendable, 'e_nom_opt'] = \
-        get_values(network.model.store_e_nom)
+        get_values("store_e_nom")
 
 
-    s_nom_extendable_passive_branches = get_values(model.passive_branch_s_nom)
+    s_nom_extendable_passive_branches = get_values("passive_branch_s_nom")
     for c in network.iterate_components(network.passive_branch_components):
         c.df['s_nom_opt'] = c.df.s_nom
         if c.df.s_nom_extendable.any():
@@ -1305,10 +1501,10 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
     network.links.p_nom_opt = network.links.p_nom
 
     network.links.loc[network.links.p_nom_extendable, "p_nom_opt"] = \
-        get_values(network.model.link_p_nom)
+        get_values("link_p_nom")
 
     try:
-        network.global_constraints.loc[:,"mu"] = - get_shadows(model.global_constraints, multiind=False)
+        network.global_constraints.loc[:,"mu"] = - get_shadows("global_constraints")
     except (AttributeError, KeyError) as e:
         logger.warning("Could not read out global constraint shadow prices")
 
@@ -1320,14 +1516,18 @@ def extract_optimisation_results(network, snapshots, formulation="angles", free_
 
         if len(fixed_committable_gens_i) > 0:
             network.generators_t.status.loc[snapshots,fixed_committable_gens_i] = \
-                get_values(model.generator_status).unstack(0)
+                get_values("generator_status").reindex(columns=fixed_committable_gens_i).values
 
     if extra_postprocessing is not None:
-        extra_postprocessing(network, snapshots, duals)
+        extra_postprocessing(network, snapshots, get_duals())
+
+    if free_pyomo and model is not None:
+        model.dual.clear()
 
 
 def network_lopf_build_model(network, snapshots=None, skip_pre=False,
-                             formulation="angles", ptdf_tolerance=0.):
+                             formulation="angles", ptdf_tolerance=0., builder=None,
+                             pyomo=True):
     """
     Build pyomo model for linear optimal power flow for a group of snapshots.
 
@@ -1344,50 +1544,92 @@ def network_lopf_build_model(network, snapshots=None, skip_pre=False,
         one of ["angles","cycles","kirchhoff","ptdf"]
     ptdf_tolerance : float
         Value below which PTDF entries are ignored
+    builder : None|string, default None
+        How to build the model; must be one of ["pyomo","array"].
+        "pyomo" builds the pyomo components element by element,
+        "array" builds the same linear problem with vectorised numpy
+        and scipy.sparse operations in network.lp (see pypsa.linopf)
+        and then translates it to pyomo in one go. Defaults to
+        "pyomo", or to "array" if pyomo is False.
+    pyomo : bool, default True
+        If False, only build the linear problem network.lp with the
+        "array" builder and set network.model to None; the problem can
+        then be solved with network_lopf_solve_linear_problem.
 
     Returns
     -------
     network.model
     """
 
+    if builder is None:
+        builder = "pyomo" if pyomo else "array"
+
+    if builder not in ["pyomo", "array"]:
+        raise ValueError("builder must be one of 'pyomo' or 'array', not {}".format(builder))
+
+    if not pyomo and builder != "array":
+        raise ValueError("Building the model without pyomo requires builder='array'")
+
+    profile = active_profile(network)
+
     if not skip_pre:
-        network.determine_network_topology()
-        calculate_dependent_values(network)
-        for sub_network in network.sub_networks.obj:
-            find_slack_bus(sub_network)
+        with stage(profile, "preliminary_steps"):
+            network.determine_network_topology()
+            calculate_dependent_values(network)
+            for sub_network in network.sub_networks.obj:
+                find_slack_bus(sub_network)
         logger.info("Performed preliminary steps")
 
 
     snapshots = _as_snapshots(network, snapshots)
 
+    if builder == "array":
+        logger.info("Building array model using `%s` formulation", formulation)
+        network_lopf_build_linear_problem(network, snapshots, formulation, ptdf_tolerance)
+
+        if not pyomo:
+            network.model = None
+            return network.model
+
+        with stage(profile, "to_pyomo"):
+            network.model = to_pyomo(network.lp, ConcreteModel("Linear Optimal Power Flow"))
+        network._pyomo_grids = None
+
+        #force solver to also give us the dual prices
+        network.model.dual = Suffix(direction=Suffix.IMPORT)
+
+        return network.model
+
     logger.info("Building pyomo model using `%s` formulation", formulation)
     network.model = ConcreteModel("Linear Optimal Power Flow")
 
 
-    define_generator_variables_constraints(network,snapshots)
+    profiled(profile, define_generator_variables_constraints, network, snapshots)
 
-    define_storage_variables_constraints(network,snapshots)
+    profiled(profile, define_storage_variables_constraints, network, snapshots)
 
-    define_store_variables_constraints(network,snapshots)
+    profiled(profile, define_store_variables_constraints, network, snapshots)
 
-    define_branch_extension_variables(network,snapshots)
+    profiled(profile, define_branch_extension_variables, network, snapshots)
 
-    define_link_flows(network,snapshots)
+    profiled(profile, define_link_flows, network, snapshots)
 
-    define_nodal_balances(network,snapshots)
+    profiled(profile, define_nodal_balances, network, snapshots)
 
-    define_passive_branch_flows(network,snapshots,formulation,ptdf_tolerance)
+    profiled(profile, define_passive_branch_flows, network, snapshots, formulation, ptdf_tolerance)
 
-    define_passive_branch_constraints(network,snapshots)
+    profiled(profile, define_passive_branch_constraints, network, snapshots)
 
     if formulation in ["angles", "kirchhoff"]:
-        define_nodal_balance_constraints(network,snapshots)
+        profiled(profile, define_nodal_balance_constraints, network, snapshots)
     elif formulation in ["ptdf", "cycles"]:
-        define_sub_network_balance_constraints(network,snapshots)
+        profiled(profile, define_sub_network_balance_constraints, network, snapshots)
+
+    profiled(profile, define_global_constraints, network, snapshots)
 
-    define_global_constraints(network,snapshots)
+    profiled(profile, define_linear_objective, network, snapshots)
 
-    define_linear_objective(network, snapshots)
+    _record_pyomo_grids(network, snapshots, formulation)
 
     #tidy up auxilliary expressions
     del network._p_balance
@@ -1419,6 +1661,10 @@ def network_lopf_prepare_solver(network, solver_name="glpk", solver_io=None):
 
     patch_optsolver_record_memusage_before_solving(network.opt, network)
 
+    profile = active_profile(network)
+    if profile is not None:
+        patch_optsolver_profile(network.opt, profile)
+
     if isinstance(network.opt, PersistentSolver):
         network.opt.set_instance(network.model)
 
@@ -1486,26 +1732,323 @@ def network_lopf_solve(network, snapshots=None, formulation="angles", solver_opt
     status = network.results["Solver"][0]["Status"].key
     termination_condition = network.results["Solver"][0]["Termination condition"].key
 
+    _extract_if_successful(network, snapshots, formulation, status, termination_condition,
+                           free_pyomo='pyomo' in free_memory,
+                           extra_postprocessing=extra_postprocessing)
+
+    return status, termination_condition
+
+def _extract_if_successful(network, snapshots, formulation, status, termination_condition,
+                           free_pyomo=True, extra_postprocessing=None, from_lp=False):
+
+    profile = active_profile(network)
+
     if status == "ok" and termination_condition == "optimal":
         logger.info("Optimization successful")
-        extract_optimisation_results(network, snapshots, formulation,
-                                     free_pyomo='pyomo' in free_memory,
-                                     extra_postprocessing=extra_postprocessing)
+        profiled(profile, extract_optimisation_results, network, snapshots, formulation,
+                 free_pyomo=free_pyomo, extra_postprocessing=extra_postprocessing,
+                 from_lp=from_lp)
     elif status == "warning" and termination_condition == "other":
         logger.warning("WARNING! Optimization might be sub-optimal. Writing output anyway")
-        extract_optimisation_results(network, snapshots, formulation,
-                                     free_pyomo='pyomo' in free_memory,
-                                     extra_postprocessing=extra_postprocessing)
+        profiled(profile, extract_optimisation_results, network, snapshots, formulation,
+                 free_pyomo=free_pyomo, extra_postprocessing=extra_postprocessing,
+                 from_lp=from_lp)
     else:
         logger.error("Optimisation failed with status %s and terminal condition %s"
               % (status, termination_condition))
 
+def network_lopf_solve_linear_problem(network, snapshots=None, formulation="angles",
+                                      solver_name="glpk", solver_io=None, solver_options={},
+                                      solver_logfile=None, keep_files=False,
+                                      extra_postprocessing=None):
+    """
+    Solve the linear problem network.lp without pyomo and extract results.
+
+    The problem is written directly to an LP or MPS file, which is
+    solved by calling the solver binary, or for "scipy-highs" passed
+    in memory to scipy.optimize.linprog (see pypsa.lpfile).
+
+    Parameters
+    ----------
+    snapshots : list or index slice
+        A list of snapshots to optimise, must be a subset of
+        network.snapshots, defaults to network.snapshots
+    formulation : string
+        Formulation of the linear power flow equations to use; must be one of
+        ["angles","cycles","kirchhoff","ptdf"]; must match formulation used for
+        building the model.
+    solver_name : string
+        One of "glpk", "cbc", "highs" or "scipy-highs"
+    solver_io : None|string
+        Problem file format, "lp" (default) or "mps"
+    solver_options : dictionary
+        A dictionary with additional options that get passed to the solver.
+    solver_logfile : None|string
+        If not None, the solver output is written to this file.
+    keep_files : bool, default False
+        Keep the problem and solution files - useful for debugging
+    extra_postprocessing : callable function
+        This function must take three arguments
+        `extra_postprocessing(network,snapshots,duals)` and is called after
+        the model has solved and the results are extracted; duals is a
+        pandas.Series of the dual values indexed by the constraint ids
+        of network.lp.
+
+    Returns
+    -------
+    status, termination_condition
+    """
+
+    snapshots = _as_snapshots(network, snapshots)
+
+    profile = active_profile(network)
+
+    if solver_name == "scipy-highs":
+        with stage(profile, "solve"):
+            status, termination_condition = run_scipy_highs(network.lp, solver_options)
+    else:
+        status, termination_condition = run_solver(network.lp, solver_name,
+                                                   io=solver_io if solver_io is not None else "lp",
+                                                   solver_options=solver_options,
+                                                   solver_logfile=solver_logfile,
+                                                   keep_files=keep_files,
+                                                   profile=profile)
+
+    _extract_if_successful(network, snapshots, formulation, status, termination_condition,
+                           extra_postprocessing=extra_postprocessing)
+
     return status, termination_condition
 
+def snapshot_coupling(network):
+    """
+    List the reasons why the snapshots of the linear optimal power
+    flow are coupled, i.e. why it cannot be solved for each snapshot
+    independently.
+
+    The snapshots are coupled by storage units, stores, committable
+    generators, ramp limits, global constraints and extendable
+    capacities.
+
+    Parameters
+    ----------
+    network : pypsa.Network
+
+    Returns
+    -------
+    reasons : list of strings, empty if the snapshots are independent
+    """
+
+    gens = network.generators
+
+    reasons = []
+    if not network.storage_units.empty:
+        reasons.append("storage units")
+    if not network.stores.empty:
+        reasons.append("stores")
+    if gens.committable.any():
+        reasons.append("committable generators")
+    if gens.ramp_limit_up.notnull().any() or gens.ramp_limit_down.notnull().any():
+        reasons.append("ramp limits")
+    if not network.global_constraints.empty:
+        reasons.append("global constraints")
+    if (gens.p_nom_extendable.any() or network.lines.s_nom_extendable.any() or
+        network.transformers.s_nom_extendable.any() or network.links.p_nom_extendable.any()):
+        reasons.append("extendable capacities")
+
+    return reasons
+
+_worker_network = None
+
+def _network_payload(network):
+    """Return the components, time series and snapshots of network as
+    picklable data, from which _network_from_payload rebuilds it in a
+    worker process; the network itself holds weak references and
+    cannot be pickled (cf. Network.copy)."""
+
+    override_components, override_component_attrs = network._retrieve_overridden_components()
+
+    static = []
+    series = {}
+    for c in network.iterate_components(["Bus", "Carrier"] +
+                                        sorted(network.all_components - {"Bus", "Carrier", "SubNetwork"})):
+        df = c.df
+        #the standard types are added again by the new network
+        if c.name in network.standard_type_components:
+            df = df.drop(network.components[c.name]["standard_types"].index)
+        static.append((c.name, df))
+        series[c.name] = dict(c.pnl)
+
+    return dict(override_components=override_components,
+                override_component_attrs=override_component_attrs,
+                static=static, series=series, snapshots=network.snapshots,
+                snapshot_weightings=network.snapshot_weightings, name=network.name)
+
+def _network_from_payload(payload):
+    """Rebuild the network of _network_payload and perform the
+    preliminary steps of the optimisation."""
+
+    from .components import Network
+    from .io import import_components_from_dataframe
+
+    network = Network(override_components=payload["override_components"],
+                      override_component_attrs=payload["override_component_attrs"])
+
+    for component, df in payload["static"]:
+        import_components_from_dataframe(network, df, component)
+
+    network.set_snapshots(payload["snapshots"])
+    network.snapshot_weightings = payload["snapshot_weightings"]
+    for component, pnl in iteritems(payload["series"]):
+        for attr, df in iteritems(pnl):
+            network.pnl(component)[attr] = df
+
+    network.name = payload["name"]
+
+    network.determine_network_topology()
+    calculate_dependent_values(network)
+    for sub_network in network.sub_networks.obj:
+        find_slack_bus(sub_network)
+
+    return network
+
+def _init_lopf_worker(payload):
+    global _worker_network
+    _worker_network = _network_from_payload(payload)
+
+def _lopf_chunk(snapshots, kwargs, network=None):
+    if network is None:
+        network = _worker_network
+
+    status, termination_condition = network_lopf(network, snapshots, skip_pre=True, **kwargs)
+
+    if (status, termination_condition) not in [("ok", "optimal"), ("warning", "other")]:
+        return status, termination_condition, None, {}, {}
+
+    series = {}
+    static = {}
+    for c in network.iterate_components():
+        outputs = c.attrs.index[c.attrs.status.str.startswith("Output")]
+        for attr in outputs[c.attrs.loc[outputs, "varying"].astype(bool)]:
+            df = c.pnl[attr]
+            if not df.empty:
+                series[(c.name, attr)] = df.loc[snapshots]
+        static[c.name] = c.df[outputs[c.attrs.loc[outputs, "static"].astype(bool)]
+                              .intersection(c.df.columns)]
+
+    return status, termination_condition, network.objective, series, static
+
+def network_lopf_decomposed(network, snapshots=None, n_jobs=1, skip_pre=False, **kwargs):
+    """
+    Linear optimal power flow for independent snapshots, solved in
+    parallel chunks.
+
+    If the snapshots are not coupled (see snapshot_coupling), the
+    snapshots are split into `n_jobs` chunks, which are optimised with
+    network_lopf in a pool of `n_jobs` processes. The components and
+    time series of the network are handed to each process once when
+    it is started, rebuilt there into a network and then only read.
+    The results of the chunks are merged into the time-varying
+    outputs of the network and network.objective is the sum of the
+    objectives of the chunks. If the arguments cannot be sent to the
+    processes (e.g. a lambda as extra_functionality under the "spawn"
+    start method) or a process dies, the chunks are solved one after
+    the other in this process.
+
+    Parameters
+    ----------
+    snapshots : list or index slice
+        A list of snapshots to optimise, must be a subset of
+        network.snapshots, defaults to network.snapshots
+    n_jobs : int
+        Number of chunks and processes; for n_jobs=1 the chunk is
+        solved in this process
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+    **kwargs
+        Passed to network_lopf for each chunk, e.g. solver_name,
+        formulation; extra_functionality and extra_postprocessing are
+        called in the worker processes, so changes they make to the
+        network are not returned.
+
+    Returns
+    -------
+    status, termination_condition
+    """
+
+    reasons = snapshot_coupling(network)
+    if reasons:
+        logger.warning("Solving the snapshots independently although they are coupled by %s",
+                       ", ".join(reasons))
+
+    profile = active_profile(network)
+
+    if not skip_pre:
+        with stage(profile, "preliminary_steps"):
+            network.determine_network_topology()
+            calculate_dependent_values(network)
+            for sub_network in network.sub_networks.obj:
+                find_slack_bus(sub_network)
+        logger.info("Performed preliminary steps")
+
+    snapshots = _as_snapshots(network, snapshots)
+
+    chunks = [snapshots[i] for i in np.array_split(np.arange(len(snapshots)),
+                                                   min(n_jobs, len(snapshots)))]
+
+    results = None
+    if n_jobs > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            from concurrent.futures.process import BrokenProcessPool
+            pool = ProcessPoolExecutor(max_workers=len(chunks), initializer=_init_lopf_worker,
+                                       initargs=(_network_payload(network),))
+        except (ImportError, TypeError):
+            logger.warning("Process pools with initializers are not available, "
+                           "solving the chunks one after the other")
+        else:
+            logger.info("Solving %d chunks of snapshots in parallel", len(chunks))
+            try:
+                with pool, stage(profile, "solve_chunks"):
+                    results = list(pool.map(_lopf_chunk, chunks, [kwargs]*len(chunks)))
+            except (PicklingError, TypeError, AttributeError, BrokenProcessPool) as e:
+                logger.warning("Solving the chunks in parallel failed (%s), "
+                               "solving them one after the other", e)
+
+    if results is None:
+        results = [_lopf_chunk(chunk, kwargs, network=network) for chunk in chunks]
+
+    for chunk, (status, termination_condition, _, _, _) in zip(chunks, results):
+        if (status, termination_condition) not in [("ok", "optimal"), ("warning", "other")]:
+            logger.error("The chunk of snapshots starting at %s could not be solved", chunk[0])
+            return status, termination_condition
+
+    network.model = None
+
+    allocated = {}
+    for (component, attr) in chain(*(r[3] for r in results)):
+        allocated.setdefault(component, set()).add(attr)
+    allocate_series_dataframes(network, {c: list(attrs) for c, attrs in iteritems(allocated)})
+
+    for chunk, (_, _, _, series, _) in zip(chunks, results):
+        for (component, attr), df in iteritems(series):
+            network.pnl(component)[attr].loc[chunk, df.columns] = df
+
+    for component, df in iteritems(results[0][4]):
+        network.df(component).loc[df.index, df.columns] = df
+
+    network.objective = sum(r[2] for r in results)
+
+    status = ("warning", "other") if any(r[:2] == ("warning", "other") for r in results) \
+             else ("ok", "optimal")
+
+    return status
+
 def network_lopf(network, snapshots=None, solver_name="glpk", solver_io=None,
                  skip_pre=False, extra_functionality=None, solver_logfile=None, solver_options={},
                  keep_files=False, formulation="angles", ptdf_tolerance=0.,
-                 free_memory={},extra_postprocessing=None):
+                 free_memory={},extra_postprocessing=None, builder=None, pyomo=True,
+                 n_jobs=1, decompose=None, profile_file=None, profile_format="json"):
     """
     Linear optimal power flow for a group of snapshots.
 
@@ -1516,7 +2059,9 @@ def network_lopf(network, snapshots=None, solver_name="glpk", solver_io=None,
         network.snapshots, defaults to network.snapshots
     solver_name : string
         Must be a solver name that pyomo recognises and that is
-        installed, e.g. "glpk", "gurobi"
+        installed, e.g. "glpk", "gurobi"; "scipy-highs" solves the
+        problem in-process with scipy.optimize.linprog(method="highs")
+        and implies pyomo=False
     solver_io : string, default None
         Solver Input-Output option, e.g. "python" to use "gurobipy" for
         solver_name="gurobi"
@@ -1551,19 +2096,92 @@ def network_lopf(network, snapshots=None, solver_name="glpk", solver_io=None,
         `extra_postprocessing(network,snapshots,duals)` and is called after
         the model has solved and the results are extracted. It allows the user to
         extract further information about the solution, such as additional shadow prices.
+    builder : None|string, default None
+        How to build the model; must be one of ["pyomo","array"]. The
+        "array" builder constructs the same linear problem from
+        vectorised operations, which is much faster for large
+        networks. Defaults to "pyomo", or to "array" if pyomo is False;
+        builder="pyomo" with pyomo=False raises a ValueError.
+    pyomo : bool, default True
+        If False, the problem is built with the "array" builder and
+        written directly to an LP or MPS file (chosen by `solver_io`),
+        which is passed to the solver binary of "glpk", "cbc" or
+        "highs" without going through pyomo. `extra_functionality` can
+        then modify network.lp instead of network.model.
+    n_jobs : int, default 1
+        Number of processes used to solve chunks of the snapshots in
+        parallel if the snapshots are independent, see
+        network_lopf_decomposed.
+    decompose : None|bool, default None
+        Whether to solve chunks of the snapshots independently. By
+        default this is done if n_jobs > 1 and the snapshots are not
+        coupled by storage, unit commitment, ramp limits, global
+        constraints or extendable capacities; True forces it, False
+        disables it.
+    profile_file : None|string
+        Wall time, CPU time and memory usage of each stage of the
+        optimisation (building each part of the model, writing the
+        problem file, running the solver, extracting the results) are
+        recorded in network.profile (see pypsa.profiling.Profile); if
+        not None, the profile is also dumped to this file.
+    profile_format : string, default "json"
+        Format of `profile_file`, either "json" or "chrome" for the
+        Chrome trace event format.
 
     Returns
     -------
     None
     """
 
+    with profiling(network, "lopf", profile_file, profile_format):
+        return _network_lopf(network, snapshots, solver_name=solver_name, solver_io=solver_io,
+                             skip_pre=skip_pre, extra_functionality=extra_functionality,
+                             solver_logfile=solver_logfile, solver_options=solver_options,
+                             keep_files=keep_files, formulation=formulation,
+                             ptdf_tolerance=ptdf_tolerance, free_memory=free_memory,
+                             extra_postprocessing=extra_postprocessing, builder=builder,
+                             pyomo=pyomo, n_jobs=n_jobs, decompose=decompose)
+
+def _network_lopf(network, snapshots, solver_name, solver_io, skip_pre, extra_functionality,
+                  solver_logfile, solver_options, keep_files, formulation, ptdf_tolerance,
+                  free_memory, extra_postprocessing, builder, pyomo, n_jobs, decompose):
+
+    if decompose is None:
+        decompose = n_jobs > 1 and not snapshot_coupling(network)
+        if n_jobs > 1 and not decompose:
+            logger.info("Solving the snapshots together since they are coupled by %s",
+                        ", ".join(snapshot_coupling(network)))
+
+    if decompose:
+        return network_lopf_decomposed(network, snapshots, n_jobs=n_jobs, skip_pre=skip_pre,
+                                       solver_name=solver_name, solver_io=solver_io,
+                                       extra_functionality=extra_functionality,
+                                       solver_logfile=solver_logfile,
+                                       solver_options=solver_options, keep_files=keep_files,
+                                       formulation=formulation, ptdf_tolerance=ptdf_tolerance,
+                                       free_memory=free_memory,
+                                       extra_postprocessing=extra_postprocessing,
+                                       builder=builder, pyomo=pyomo)
+
     snapshots = _as_snapshots(network, snapshots)
 
+    if solver_name == "scipy-highs":
+        pyomo = False
+
     network_lopf_build_model(network, snapshots, skip_pre=skip_pre,
-                             formulation=formulation, ptdf_tolerance=ptdf_tolerance)
+                             formulation=formulation, ptdf_tolerance=ptdf_tolerance,
+                             builder=builder, pyomo=pyomo)
 
     if extra_functionality is not None:
-        extra_functionality(network,snapshots)
+        profiled(active_profile(network), extra_functionality, network, snapshots)
+
+    if not pyomo:
+        return network_lopf_solve_linear_problem(network, snapshots, formulation=formulation,
+                                                 solver_name=solver_name, solver_io=solver_io,
+                                                 solver_options=solver_options,
+                                                 solver_logfile=solver_logfile,
+                                                 keep_files=keep_files,
+                                                 extra_postprocessing=extra_postprocessing)
 
     network_lopf_prepare_solver(network, solver_name=solver_name,
                                 solver_io=solver_io)
@@ -1572,3 +2190,222 @@ def network_lopf(network, snapshots=None, solver_name="glpk", solver_io=None,
                               solver_logfile=solver_logfile, solver_options=solver_options,
                               keep_files=keep_files, free_memory=free_memory,
                               extra_postprocessing=extra_postprocessing)
+
+
+def _snapshot_objective(lp, snapshots):
+    """Return the part of the objective value of the solved linear
+    problem lp which stems from the variables of the given snapshots,
+    i.e. from the rows of the families of variables indexed by
+    snapshots."""
+
+    total = 0.
+    for ids in lp.variables.values():
+        if isinstance(ids, pd.DataFrame):
+            i = ids.loc[ids.index.isin(snapshots)].values.astype(int).ravel()
+            i = i[i >= 0]
+            total += lp.c[i].dot(lp.solution[i])
+    return total
+
+def network_lopf_rolling(network, snapshots=None, horizon=24, overlap=0,
+                         solver_name="glpk", solver_io=None, skip_pre=False,
+                         extra_functionality=None, solver_logfile=None, solver_options={},
+                         keep_files=False, formulation="angles", ptdf_tolerance=0.,
+                         extra_postprocessing=None, pyomo=True):
+    """
+    Linear optimal power flow over consecutive windows of snapshots
+    (rolling horizon).
+
+    The snapshots are optimised in windows of `horizon` snapshots,
+    each window starting `horizon - overlap` snapshots after the
+    previous one. The results in the overlap are overwritten by the
+    next window. At the start of each window the state of charge of
+    storage units (state_of_charge_initial), the energy of stores
+    (e_initial) and the status of committable generators
+    (initial_status) are taken from the last snapshot of the previous
+    window which is kept; the static values are restored afterwards.
+    Cyclic storage units and stores are cyclic within each window.
+
+    The linear problem network.lp is built with the "array" builder
+    for each window. Only its translation to pyomo is reused: if two
+    consecutive windows have the same structure (which is the case for
+    windows of equal length unless e.g. the pattern of storage inflows
+    changes), the pyomo model of the earlier window is kept and only
+    the bounds, coefficients and right-hand sides which changed are
+    updated. A persistent solver keeps its instance and is only
+    passed these changes. The indices of network.model then still
+    carry the snapshots of the window in which it was built; the
+    results and the duals passed to extra_postprocessing are read from
+    network.lp, whose indices are those of the current window. With
+    pyomo=False nothing is reused, each window is written to a new
+    problem file.
+
+    Capacities cannot be optimised, since each window would choose
+    its own; a ValueError is raised if any component is extendable.
+
+    Parameters
+    ----------
+    snapshots : list or index slice
+        A list of snapshots to optimise, must be a subset of
+        network.snapshots, defaults to network.snapshots
+    horizon : int
+        Number of snapshots in each window
+    overlap : int
+        Number of snapshots at the end of each window which are
+        optimised again in the next window; must be smaller than
+        horizon
+    solver_name : string
+        Must be a solver name that pyomo recognises and that is
+        installed, e.g. "glpk", "gurobi"; or "scipy-highs"
+    solver_io : string, default None
+        Solver Input-Output option, see network_lopf
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+    extra_functionality : callable function
+        This function must take two arguments
+        `extra_functionality(network,snapshots)` and is called for each
+        window after the linear problem network.lp is built. It allows
+        the user to add constraints to network.lp.
+    solver_logfile : None|string
+        If not None, sets the logfile option of the solver.
+    solver_options : dictionary
+        A dictionary with additional options that get passed to the solver.
+    keep_files : bool, default False
+        Keep the files that are written for the solver
+    formulation : string
+        Formulation of the linear power flow equations to use; must be
+        one of ["angles","cycles","kirchhoff","ptdf"]
+    ptdf_tolerance : float
+        Value below which PTDF entries are ignored
+    extra_postprocessing : callable function
+        This function must take three arguments
+        `extra_postprocessing(network,snapshots,duals)` and is called
+        for each window after its results are extracted.
+    pyomo : bool, default True
+        If False, solve each window without pyomo, see network_lopf.
+
+    Returns
+    -------
+    statuses : list of (status, termination_condition) for each window
+
+    network.objective is set to the cost of the dispatch which is
+    kept, i.e. of each window without the overlap which is optimised
+    again in the next window, and network.window_objectives to the
+    list of the objective values of the windows.
+    """
+
+    if not 0 <= overlap < horizon:
+        raise ValueError("overlap must be at least 0 and smaller than horizon")
+
+    extendable = [c for c, attr in [("Generator", "p_nom"), ("StorageUnit", "p_nom"), ("Store", "e_nom"),
+                                    ("Line", "s_nom"), ("Transformer", "s_nom"), ("Link", "p_nom")]
+                  if network.df(c)[attr + "_extendable"].any()]
+    if extendable:
+        raise ValueError("The rolling horizon optimisation cannot optimise capacities, but some "
+                         "components of type {} are extendable".format(", ".join(extendable)))
+
+    if solver_name == "scipy-highs":
+        pyomo = False
+
+    if not skip_pre:
+        network.determine_network_topology()
+        calculate_dependent_values(network)
+        for sub_network in network.sub_networks.obj:
+            find_slack_bus(sub_network)
+        logger.info("Performed preliminary steps")
+
+    snapshots = _as_snapshots(network, snapshots)
+
+    gens = network.generators
+    sus = network.storage_units
+    stores = network.stores
+    committable_gens_i = gens.index[gens.committable & ~gens.p_nom_extendable]
+
+    initial = (sus.state_of_charge_initial.copy(), stores.e_initial.copy(),
+               gens.initial_status.copy())
+
+    step = horizon - overlap
+    statuses = []
+    skeleton = None
+    persistent = False
+    objective = 0.
+    window_objectives = []
+
+    try:
+        for start in range(0, len(snapshots), step):
+            window = snapshots[start:start+horizon]
+
+            if start > 0:
+                previous = snapshots[start-1]
+                sus.loc[:, "state_of_charge_initial"] = network.storage_units_t.state_of_charge.loc[previous, sus.index]
+                stores.loc[:, "e_initial"] = network.stores_t.e.loc[previous, stores.index]
+                if len(committable_gens_i):
+                    gens.loc[committable_gens_i, "initial_status"] = \
+                        network.generators_t.status.loc[previous, committable_gens_i].round().astype(int)
+
+            logger.info("Building window of %d snapshots starting at %s", len(window), window[0])
+            network_lopf_build_linear_problem(network, window, formulation, ptdf_tolerance)
+
+            if extra_functionality is not None:
+                extra_functionality(network, window)
+
+            if not pyomo:
+                network.model = None
+                status, termination_condition = \
+                    network_lopf_solve_linear_problem(network, window, formulation=formulation,
+                                                      solver_name=solver_name, solver_io=solver_io,
+                                                      solver_options=solver_options,
+                                                      solver_logfile=solver_logfile,
+                                                      keep_files=keep_files,
+                                                      extra_postprocessing=extra_postprocessing)
+            else:
+                if skeleton is not None and has_same_structure(network.lp, skeleton):
+                    logger.info("Updating the pyomo model of the previous window")
+                    #a persistent solver keeps its instance and only
+                    #gets the changes
+                    network.model = update_pyomo(network.lp, skeleton,
+                                                 opt=network.opt if persistent else None)
+                else:
+                    network.model = to_pyomo(network.lp, ConcreteModel("Linear Optimal Power Flow"))
+                    network.model.dual = Suffix(direction=Suffix.IMPORT)
+                    network_lopf_prepare_solver(network, solver_name=solver_name,
+                                                solver_io=solver_io)
+                    persistent = isinstance(network.opt, PersistentSolver)
+                    if persistent:
+                        network.opt.set_instance(network.model)
+                skeleton = network.lp
+
+                args = [] if persistent else [network.model]
+
+                network.results = network.opt.solve(*args, suffixes=["dual"], keepfiles=keep_files,
+                                                    logfile=solver_logfile, options=solver_options)
+
+                status = network.results["Solver"][0]["Status"].key
+                termination_condition = network.results["Solver"][0]["Termination condition"].key
+
+                read_pyomo_solution(network.lp, network.results["Problem"][0]["Upper bound"])
+
+                _extract_if_successful(network, window, formulation, status, termination_condition,
+                                       extra_postprocessing=extra_postprocessing, from_lp=True)
+
+            statuses.append((status, termination_condition))
+
+            if (status, termination_condition) not in [("ok", "optimal"), ("warning", "other")]:
+                logger.error("Stopping the rolling horizon optimisation, since the window starting at %s could not be solved", window[0])
+                break
+
+            window_objectives.append(network.lp.objective_value)
+
+            if start + horizon >= len(snapshots):
+                objective += _snapshot_objective(network.lp, window)
+                break
+
+            objective += _snapshot_objective(network.lp, window[:step])
+    finally:
+        (sus.loc[:, "state_of_charge_initial"], stores.loc[:, "e_initial"],
+         gens.loc[:, "initial_status"]) = initial
+
+    network.objective = objective
+    network.window_objectives = window_objectives
+
+    return statuses
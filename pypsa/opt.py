@@ -43,9 +43,13 @@ from weakref import ref as weakref_ref
 
 import pyomo
 from contextlib import contextmanager
-from six import iteritems
+from six import iteritems, string_types
+from six.moves import zip
+from array import array
 from six.moves import cPickle as pickle
+import numpy as np
 import pandas as pd
+import scipy.sparse
 import gc, os, tempfile
 
 __author__ = "Tom Brown (FIAS), Jonas Hoersch (FIAS)"
@@ -59,6 +63,11 @@ class LExpression(object):
 
     constant + coeff1*var1 + coeff2*var2 + ....
 
+    The coefficients are stored in the array `coeffs` and the
+    variables in the parallel list `vars`. Use `+=` or add_term to
+    accumulate terms in place; `variables` gives a list-like view of
+    the terms as tuples.
+
     Parameters
     ----------
     variables : list of tuples of coefficients and variables
@@ -67,18 +76,56 @@ class LExpression(object):
 
     """
 
+    __slots__ = ("coeffs", "vars", "constant")
+
     def __init__(self,variables=None,constant=0.):
 
-        if variables is None:
-            self.variables = []
-        else:
-            self.variables = variables
+        self.coeffs = array('d')
+        self.vars = []
+
+        if variables is not None:
+            for coeff,var in variables:
+                self.coeffs.append(coeff)
+                self.vars.append(var)
 
         self.constant = constant
 
+    @property
+    def variables(self):
+        return _LExpressionTerms(self)
+
+    @variables.setter
+    def variables(self,variables):
+        #materialise first, variables may be a view of this expression
+        variables = list(variables)
+        self.coeffs = array('d')
+        self.vars = []
+        self.variables.extend(variables)
+
+    def add_term(self,coeff,var):
+        """Add coeff*var to the expression in place."""
+        self.coeffs.append(coeff)
+        self.vars.append(var)
+
+    def add_terms(self,coeffs,variables):
+        """Add the terms of the parallel sequences coeffs and variables
+        to the expression in place."""
+        self.coeffs.extend(coeffs)
+        self.vars.extend(variables)
+
+    def copy(self):
+        c = LExpression.__new__(LExpression)
+        c.coeffs = array('d', self.coeffs)
+        c.vars = self.vars[:]
+        c.constant = self.constant
+        return c
+
     def __repr__(self):
         return "{} + {}".format(self.variables, self.constant)
 
+    def __len__(self):
+        return len(self.vars)
+
 
     def __mul__(self,constant):
         try:
@@ -86,23 +133,31 @@ class LExpression(object):
         except:
             logger.error("Can only multiply an LExpression with a float!")
             return None
-        return LExpression([(constant*item[0],item[1]) for item in self.variables],
-                           constant*self.constant)
+        c = LExpression.__new__(LExpression)
+        c.coeffs = array('d', [constant*coeff for coeff in self.coeffs])
+        c.vars = self.vars[:]
+        c.constant = constant*self.constant
+        return c
 
     def __rmul__(self,constant):
         return self.__mul__(constant)
 
-    def __add__(self,other):
+    def __iadd__(self,other):
         if type(other) is LExpression:
-            return LExpression(self.variables + other.variables,self.constant+other.constant)
+            self.coeffs.extend(other.coeffs)
+            self.vars.extend(other.vars)
+            self.constant += other.constant
         else:
             try:
                 constant = float(other)
             except:
                 logger.error("Can only add an LExpression to another LExpression or a constant!")
                 return None
-            return LExpression(self.variables[:],self.constant+constant)
+            self.constant += constant
+        return self
 
+    def __add__(self,other):
+        return self.copy().__iadd__(other)
 
     def __radd__(self,other):
         return self.__add__(other)
@@ -113,6 +168,42 @@ class LExpression(object):
     def __neg__(self):
         return -1*self
 
+class _LExpressionTerms(object):
+    """List-like view of the terms of an LExpression as tuples of
+    coefficients and variables."""
+
+    __slots__ = ("expression",)
+
+    def __init__(self,expression):
+        self.expression = expression
+
+    def __len__(self):
+        return len(self.expression.vars)
+
+    def __iter__(self):
+        return zip(self.expression.coeffs, self.expression.vars)
+
+    def __getitem__(self,i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        return (self.expression.coeffs[i], self.expression.vars[i])
+
+    def __add__(self,other):
+        return list(self) + list(other)
+
+    def __eq__(self,other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self,item):
+        self.expression.add_term(item[0],item[1])
+
+    def extend(self,items):
+        for coeff,var in items:
+            self.expression.add_term(coeff,var)
+
 class LConstraint(object):
     """Constraint of optimisation variables.
 
@@ -128,6 +219,8 @@ class LConstraint(object):
 
     """
 
+    __slots__ = ("lhs", "sense", "rhs")
+
     def __init__(self,lhs=None,sense="==",rhs=None):
 
         if lhs is None:
@@ -148,19 +241,19 @@ class LConstraint(object):
 try:
     from pyomo.core.base import expr_coopr3
 
-    def _build_sum_expression(variables, constant=0.):
+    def _build_sum_expression(coeffs, variables, constant=0.):
         expr = expr_coopr3._SumExpression()
-        expr._args = [item[1] for item in variables]
-        expr._coef = [item[0] for item in variables]
+        expr._args = list(variables)
+        expr._coef = list(coeffs)
         expr._const = constant
         return expr
 except ImportError:
     from pyomo.core.expr import expr_pyomo5
 
-    def _build_sum_expression(variables, constant=0.):
+    def _build_sum_expression(coeffs, variables, constant=0.):
         expr = expr_pyomo5.LinearExpression()
-        expr.linear_vars = [item[1] for item in variables]
-        expr.linear_coefs = [item[0] for item in variables]
+        expr.linear_vars = list(variables)
+        expr.linear_coefs = list(coeffs)
         expr.constant = constant
         return expr
 
@@ -211,34 +304,108 @@ def l_constraint(model,name,constraints,*args):
     for i in v._index:
         c = constraints[i]
         if type(c) is LConstraint:
-            variables = c.lhs.variables + [(-item[0],item[1]) for item in c.rhs.variables]
+            coeffs = c.lhs.coeffs.tolist() + [-coeff for coeff in c.rhs.coeffs]
+            variables = c.lhs.vars + c.rhs.vars
             sense = c.sense
             constant = c.rhs.constant - c.lhs.constant
         else:
-            variables = c[0]
+            coeffs = [item[0] for item in c[0]]
+            variables = [item[1] for item in c[0]]
             sense = c[1]
             constant = c[2]
 
-        v._data[i] = pyomo.core.base.constraint._GeneralConstraintData(None,v)
-        v._data[i]._body = _build_sum_expression(variables)
-
-        if sense == "==":
-            v._data[i]._equality = True
-            v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant)
-            v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant)
-        elif sense == "<=":
-            v._data[i]._equality = False
-            v._data[i]._lower = None
-            v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant)
-        elif sense == ">=":
-            v._data[i]._equality = False
-            v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant)
-            v._data[i]._upper = None
-        elif sense == "><":
-            v._data[i]._equality = False
-            v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant[0])
-            v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant[1])
-        else: raise KeyError('`sense` must be one of "==","<=",">=","><"; got: {}'.format(sense))
+        _set_constraint_data(v, i, coeffs, variables, sense, constant)
+
+def l_constraint_array(model,name,index,var_ids,coeffs,sense,rhs):
+    """A bulk variant of l_constraint, which builds the linear
+    constraints from arrays without intermediate LConstraint objects.
+
+    Row k of the constraints
+
+    sum_j coeffs[k,j]*var_ids[k,j] sense[k] rhs[k]
+
+    gets the key index[k] in model.name, where terms with a zero
+    coefficient or a variable None are skipped. If coeffs is a
+    scipy.sparse matrix instead, its rows are the constraints and
+    var_ids is a one-dimensional array of the variables of its
+    columns.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+    name : string
+        Name of constraints to be constructed
+    index : list
+        Keys of the constraints
+    var_ids : numpy.ndarray of pyomo variables
+        Of shape (len(index), k), or (number of columns,) for a sparse
+        coeffs
+    coeffs : numpy.ndarray|scipy.sparse matrix
+        Coefficients broadcastable to the shape of var_ids, or a sparse
+        matrix with a row per constraint
+    sense : string|array of strings
+        One of "==","<=",">=","><" for all or for each constraint
+    rhs : float|numpy.ndarray
+        Constant term for all or for each constraint; for "><" an
+        array of shape (len(index), 2) with the lower and upper bounds
+
+    """
+
+    setattr(model,name,Constraint(index,noruleinit=True))
+    v = getattr(model,name)
+
+    n = len(index)
+    if n == 0:
+        return
+
+    if isinstance(sense, string_types):
+        sense = [sense]*n
+    rhs = np.asarray(rhs, dtype=float)
+    rhs = [float(rhs)]*n if rhs.ndim == 0 else rhs.tolist()
+
+    if scipy.sparse.issparse(coeffs):
+        coeffs = scipy.sparse.csr_matrix(coeffs)
+        var_ids = np.asarray(var_ids, dtype=object)
+        indptr, indices, data = coeffs.indptr, coeffs.indices, coeffs.data
+        for k,i in enumerate(index):
+            s, e = indptr[k], indptr[k+1]
+            _set_constraint_data(v, i, data[s:e].tolist(), var_ids[indices[s:e]].tolist(),
+                                 sense[k], rhs[k])
+    else:
+        var_ids = np.asarray(var_ids, dtype=object).reshape(n, -1)
+        coeffs = np.broadcast_to(np.asarray(coeffs, dtype=float), var_ids.shape)
+        mask = (coeffs != 0) & np.array([[x is not None for x in row] for row in var_ids],
+                                        dtype=bool).reshape(var_ids.shape)
+        for k,i in enumerate(index):
+            m = mask[k]
+            _set_constraint_data(v, i, coeffs[k][m].tolist(), var_ids[k][m].tolist(),
+                                 sense[k], rhs[k])
+
+def _set_constraint_data(v, i, coeffs, variables, sense, constant):
+    """Fill in the data for index i of the indexed constraint v with the
+    linear constraint `coeffs*variables sense constant`, where coeffs
+    and variables are parallel lists."""
+
+    v._data[i] = pyomo.core.base.constraint._GeneralConstraintData(None,v)
+    v._data[i]._body = _build_sum_expression(coeffs, variables)
+
+    if sense == "==":
+        v._data[i]._equality = True
+        v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant)
+        v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant)
+    elif sense == "<=":
+        v._data[i]._equality = False
+        v._data[i]._lower = None
+        v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant)
+    elif sense == ">=":
+        v._data[i]._equality = False
+        v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant)
+        v._data[i]._upper = None
+    elif sense == "><":
+        v._data[i]._equality = False
+        v._data[i]._lower = pyomo.core.base.numvalue.NumericConstant(constant[0])
+        v._data[i]._upper = pyomo.core.base.numvalue.NumericConstant(constant[1])
+    else: raise KeyError('`sense` must be one of "==","<=",">=","><"; got: {}'.format(sense))
 
 def l_objective(model,objective=None):
     """
@@ -271,7 +438,8 @@ def l_objective(model,objective=None):
 
     #initialise with a dummy
     model.objective = Objective(expr = 0.)
-    model.objective._expr = _build_sum_expression(objective.variables, constant=objective.constant)
+    model.objective._expr = _build_sum_expression(objective.coeffs, objective.vars,
+                                                  constant=objective.constant)
 
 def free_pyomo_initializers(obj):
     obj.construct()
@@ -30,7 +30,8 @@ logger = logging.getLogger(__name__)
 from scipy.sparse import issparse, csr_matrix, csc_matrix, hstack as shstack, vstack as svstack, dok_matrix
 
 from numpy import r_, ones, zeros, newaxis
-from scipy.sparse.linalg import spsolve
+from scipy.sparse.linalg import spsolve, splu
+from scipy.sparse.csgraph import reverse_cuthill_mckee
 from numpy.linalg import norm
 
 import numpy as np
@@ -41,6 +42,7 @@ import networkx as nx
 import collections, six
 from operator import itemgetter
 from itertools import chain
+from functools import partial
 import time
 
 from .descriptors import get_switchable_as_dense, allocate_series_dataframes, Dict, zsum, degree
@@ -81,14 +83,31 @@ def _allocate_pf_outputs(network, linear=False):
 
 
 
-def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, **kwargs):
+def _map_threads(func, n_threads, *iterables):
+    """Return [func(*args) for args in zip(*iterables)], evaluated in a
+    pool of n_threads threads if n_threads > 1."""
+
+    if n_threads > 1:
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            logger.warning("Thread pools are not available, solving the sub-networks one after the other")
+        else:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                return list(pool.map(func, *iterables))
+
+    return [func(*args) for args in zip(*iterables)]
+
+def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, n_threads=1, **kwargs):
 
     if linear:
-        sub_network_pf_fun = sub_network_lpf
-        sub_network_prepare_fun = calculate_B_H
+        sub_network_setup_fun = _sub_network_lpf_setup
+        sub_network_data_fun = _B_H_data
+        sub_network_prepare_fun = _calculate_B_H
     else:
-        sub_network_pf_fun = sub_network_pf
-        sub_network_prepare_fun = calculate_Y
+        sub_network_setup_fun = _sub_network_pf_setup
+        sub_network_data_fun = _Y_data
+        sub_network_prepare_fun = _calculate_Y
 
     if not skip_pre:
         network.determine_network_topology()
@@ -111,22 +130,42 @@ def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, **kw
     itdf = pd.DataFrame(index=snapshots, columns=network.sub_networks.index, dtype=int)
     difdf = pd.DataFrame(index=snapshots, columns=network.sub_networks.index)
     cnvdf = pd.DataFrame(index=snapshots, columns=network.sub_networks.index, dtype=bool)
-    for sub_network in network.sub_networks.obj:
+
+    #the network data is read and written in this thread, only the
+    #matrices are built from arrays and the flows solved concurrently
+    sub_networks = list(network.sub_networks.obj)
+    solves = []; stores = []; data = []
+    for sub_network in sub_networks:
         if not skip_pre:
             find_bus_controls(sub_network)
+        solve, store = sub_network_setup_fun(sub_network, snapshots, **kwargs)
+        solves.append(solve); stores.append(store)
+        if not skip_pre and len(sub_network.branches_i()) > 0:
+            data.append(sub_network_data_fun(sub_network))
+        else:
+            data.append(None)
 
-            branches_i = sub_network.branches_i()
-            if len(branches_i) > 0:
-                sub_network_prepare_fun(sub_network, skip_pre=True)
+    #the threads only look up and set their own entries of the cache
+    _matrix_cache(network)
+
+    def prepare_and_solve(sub_network, solve, data):
+        if data is not None:
+            sub_network_prepare_fun(sub_network, data)
+        return solve()
+
+    results = _map_threads(prepare_and_solve, n_threads, sub_networks, solves, data)
+
+    for sub_network, store, result in zip(sub_networks, stores, results):
         if not linear:
-            itdf[sub_network.name], difdf[sub_network.name], cnvdf[sub_network.name] = sub_network_pf_fun(sub_network, snapshots=snapshots, skip_pre=True, **kwargs)
+            itdf[sub_network.name], difdf[sub_network.name], cnvdf[sub_network.name] = store(result)
         else:
-            sub_network_pf_fun(sub_network, snapshots=snapshots, skip_pre=True, **kwargs)
+            store(result)
 
     if not linear:
         return Dict({ 'n_iter': itdf, 'error': difdf, 'converged': cnvdf })
 
-def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False):
+def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False,
+               n_jobs=1, algorithm="newton", fdlf_variant="XB", jacobian_reuse=1, n_threads=1):
     """
     Full non-linear power flow for generic network.
 
@@ -139,8 +178,30 @@ def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=Fal
         Skip the preliminary steps of computing topology, calculating dependent values and finding bus controls.
     x_tol: float
         Tolerance for Newton-Raphson power flow.
-    use_seed : bool, default False
-        Use a seed for the initial guess for the Newton-Raphson algorithm.
+    use_seed : bool or "previous", default False
+        Use a seed for the initial guess for the Newton-Raphson
+        algorithm: True uses the voltages stored in network.buses_t,
+        "previous" starts each snapshot from the solution of the
+        previous snapshot (within a chunk of n_jobs, falling back to
+        the flat start if it does not converge from there).
+    n_jobs : int, default 1
+        Number of processes among which the snapshots of each
+        sub-network are split for the Newton-Raphson iterations.
+    algorithm : string, default "newton"
+        "newton" for Newton-Raphson or "fdlf" for the fast-decoupled
+        load flow, which is faster for networks with a high X/R ratio;
+        snapshots for which it does not converge are solved again with
+        Newton-Raphson.
+    fdlf_variant : string, default "XB"
+        Variant of the fast-decoupled load flow, "XB" or "BX".
+    jacobian_reuse : int, default 1
+        Number of Newton-Raphson iterations for which a factorized
+        Jacobian is reused ("dishonest" Newton-Raphson); 1 means a
+        new Jacobian in every iteration.
+    n_threads : int, default 1
+        Number of threads in which the admittance matrices of the
+        sub-networks are calculated and their power flows solved
+        concurrently.
 
     Returns
     -------
@@ -149,14 +210,24 @@ def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=Fal
     iteration error for each snapshot (rows) and sub_network (columns)
     """
 
-    return _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, x_tol=x_tol, use_seed=use_seed)
+    return _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, x_tol=x_tol,
+                                       use_seed=use_seed, n_jobs=n_jobs, algorithm=algorithm,
+                                       fdlf_variant=fdlf_variant, jacobian_reuse=jacobian_reuse,
+                                       n_threads=n_threads)
 
 
-def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100):
+def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100, factorize=None,
+                          jacobian_reuse=1):
     """Solve f(x) = 0 with initial guess for x and dfdx(x). dfdx(x) should
     return a sparse Jacobian.  Terminate if error on norm of f(x) is <
     x_tol or there were more than lim_iter iterations.
 
+    If factorize is given, it is called with the Jacobian and must
+    return an object with a solve method (like
+    scipy.sparse.linalg.SuperLU), which is then reused for
+    jacobian_reuse iterations ("dishonest" Newton-Raphson); otherwise
+    each step is solved with spsolve.
+
     """
 
     converged = False
@@ -168,9 +239,14 @@ def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100):
 
     while diff > x_tol and n_iter < lim_iter:
 
-        n_iter +=1
+        if factorize is None:
+            guess = guess - spsolve(dfdx(guess),F)
+        else:
+            if n_iter % jacobian_reuse == 0:
+                lu = factorize(dfdx(guess))
+            guess = guess - lu.solve(F)
 
-        guess = guess - spsolve(dfdx(guess),F)
+        n_iter +=1
 
         F = f(guess)
         diff = norm(F,np.Inf)
@@ -185,212 +261,526 @@ def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100):
     return guess, n_iter, diff, converged
 
 
+class _FactorizedSolve(object):
+    """Solve with the LU factors lu of a matrix whose columns were
+    permuted by q and, if p is given, whose rows were permuted by p,
+    i.e. of A[p][:,q]."""
+
+    __slots__ = ("lu", "q", "p")
+
+    def __init__(self, lu, q, p=None):
+        self.lu = lu
+        self.q = q
+        self.p = p
 
-def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False):
+    def solve(self, b):
+        x = np.empty_like(b)
+        x[self.q] = self.lu.solve(b if self.p is None else b[self.p])
+        return x
+
+def _jacobian_structure(Y, n_pvs):
     """
-    Non-linear power flow for connected sub-network.
+    Analyse the sparsity of the power flow Jacobian of a sub-network
+    with admittance matrix Y once.
 
-    Parameters
-    ----------
-    snapshots : list-like|single snapshot
-        A subset or an elements of network.snapshots on which to run
-        the power flow, defaults to network.snapshots
-    skip_pre: bool, default False
-        Skip the preliminary steps of computing topology, calculating dependent values and finding bus controls.
-    x_tol: float
-        Tolerance for Newton-Raphson power flow.
-    use_seed : bool, default False
-        Use a seed for the initial guess for the Newton-Raphson algorithm.
+    The fill-reducing column ordering is determined (with COLAMD in
+    SuperLU) from the Jacobian at a flat start and the Jacobian is
+    stored with its columns in this order, so that later Jacobians
+    only refill the data array and are refactorized numerically
+    without a new ordering.
 
     Returns
     -------
-    Tuple of three pandas.Series indicating number of iterations,
-    remaining error, and convergence status for each snapshot
+    jacobian : function
+        jacobian(V) returns the column-permuted Jacobian at the complex
+        bus voltages V as a csc_matrix (the same object each time)
+    factorize : function
+        factorize(J) returns an object whose solve method solves with
+        the original Jacobian
     """
 
-    snapshots = _as_snapshots(sub_network.network, snapshots)
-    logger.info("Performing non-linear load-flow on {} sub-network {} for snapshots {}".format(sub_network.network.sub_networks.at[sub_network.name,"carrier"], sub_network, snapshots))
+    n_buses = Y.shape[0]
+    n_pvpqs = n_buses - 1
+
+    #sparsity pattern of Y together with the diagonal
+    Y_coo = Y.tocoo()
+    keys, inverse = np.unique(r_[Y_coo.row.astype(np.int64)*n_buses + Y_coo.col,
+                                 np.arange(n_buses, dtype=np.int64)*(n_buses + 1)],
+                              return_inverse=True)
+    rows, cols = keys // n_buses, keys % n_buses
+    weights = r_[Y_coo.data, np.zeros(n_buses)]
+    y = np.bincount(inverse, weights.real, len(keys)) + 1j*np.bincount(inverse, weights.imag, len(keys))
+    diagonal = rows == cols
+
+    #Jacobian rows are P at PV and PQ buses and Q at PQ buses, columns
+    #are angles at PV and PQ buses and magnitudes at PQ buses; the
+    #entries of the four blocks are taken from d S/d angle (real and
+    #imaginary part) and d S/d magnitude at the pattern positions
+    th = (rows >= 1) & (cols >= 1)
+    tm = (rows >= 1) & (cols >= 1 + n_pvs)
+    qh = (rows >= 1 + n_pvs) & (cols >= 1)
+    qm = (rows >= 1 + n_pvs) & (cols >= 1 + n_pvs)
+    blocks = [np.flatnonzero(m) for m in (th, tm, qh, qm)]
+
+    J_rows = r_[rows[th] - 1, rows[tm] - 1,
+                n_pvpqs + rows[qh] - 1 - n_pvs, n_pvpqs + rows[qm] - 1 - n_pvs]
+    J_cols = r_[cols[th] - 1, n_pvpqs + cols[tm] - 1 - n_pvs,
+                cols[qh] - 1, n_pvpqs + cols[qm] - 1 - n_pvs]
+    n = n_pvpqs + n_buses - 1 - n_pvs
+
+    def values(V):
+        I = Y*V
+        V_norm = V/abs(V)
+        dS_dVa = 1j*V[rows]*np.conj(diagonal*I[rows] - y*V[cols])
+        dS_dVm = diagonal*V_norm[rows]*np.conj(I[rows]) + V[rows]*np.conj(y*V_norm[cols])
+        return r_[dS_dVa.real[blocks[0]], dS_dVm.real[blocks[1]],
+                  dS_dVa.imag[blocks[2]], dS_dVm.imag[blocks[3]]]
+
+    #fill-reducing column ordering from the Jacobian at a flat start
+    J = csc_matrix((values(np.ones(n_buses, dtype=complex)), (J_rows, J_cols)), (n, n))
+    try:
+        q = np.argsort(splu(J).perm_c)
+    except RuntimeError:
+        q = np.arange(n)
+
+    #order the entries like the data array of the column-permuted csc matrix
+    position = np.empty(n, dtype=int)
+    position[q] = np.arange(n)
+    order = np.lexsort((J_rows, position[J_cols]))
+    J = csc_matrix((np.zeros(len(order)), J_rows[order],
+                    np.r_[0, np.cumsum(np.bincount(position[J_cols], minlength=n))]), (n, n))
+
+    def jacobian(V):
+        J.data[:] = values(V)[order]
+        return J
 
-    # _sub_network_prepare_pf(sub_network, snapshots, skip_pre, calculate_Y)
-    network = sub_network.network
+    def factorize(J):
+        return _FactorizedSolve(splu(J, permc_spec="NATURAL"), q)
 
-    if not skip_pre:
-        calculate_dependent_values(network)
-        find_bus_controls(sub_network)
-        _allocate_pf_outputs(network, linear=False)
+    return jacobian, factorize
 
 
-    # get indices for the components on this subnetwork
-    branches_i = sub_network.branches_i()
-    buses_o = sub_network.buses_o
+def _seed_from_previous(v_mag_pu, v_ang, i, n_pvs):
+    """Replace the initial guess of the unknown voltages of snapshot i
+    by the solution of snapshot i-1 and return the replaced rows."""
 
-    if not skip_pre and len(branches_i) > 0:
-        calculate_Y(sub_network, skip_pre=True)
+    initial = v_mag_pu[i].copy(), v_ang[i].copy()
+    v_ang[i,1:] = v_ang[i-1,1:]
+    v_mag_pu[i,1+n_pvs:] = v_mag_pu[i-1,1+n_pvs:]
+    return initial
 
-    for n in ("q", "p"):
-        # allow all one ports to dispatch as set
-        for c in sub_network.iterate_components(network.controllable_one_port_components):
-            c_n_set = get_switchable_as_dense(network, c.name, n + '_set', snapshots, c.ind)
-            c.pnl[n].loc[snapshots, c.ind] = c_n_set
 
-        # set the power injection at each node from controllable components
-        network.buses_t[n].loc[snapshots, buses_o] = \
-            sum([((c.pnl[n].loc[snapshots, c.ind] * c.df.loc[c.ind, 'sign'])
-                  .groupby(c.df.loc[c.ind, 'bus'], axis=1).sum()
-                  .reindex(columns=buses_o, fill_value=0.))
-                 for c in sub_network.iterate_components(network.controllable_one_port_components)])
+def _newton_raphson_snapshots(Y, n_pvs, v_mag_pu, v_ang, ss, x_tol=1e-6, jacobian_reuse=1,
+                              seed_previous=False):
+    """
+    Solve the power flow equations of a sub-network with admittance
+    matrix Y for several snapshots with Newton-Raphson.
 
-        if n == "p":
-            network.buses_t[n].loc[snapshots, buses_o] += sum(
-                [(- c.pnl[n+str(i)].loc[snapshots].groupby(c.df["bus"+str(i)], axis=1).sum()
-                  .reindex(columns=buses_o, fill_value=0))
-                 for c in network.iterate_components(network.controllable_branch_components)
-                 for i in [int(col[3:]) for col in c.df.columns if col[:3] == "bus"]])
+    All arrays are ordered like sub_network.buses_o, i.e. slack bus
+    first, then the `n_pvs` PV buses, then the PQ buses. The rows of
+    v_mag_pu and v_ang (snapshots x buses) hold the initial guess and
+    the known voltages and are updated in place; ss holds the complex
+    power injections.
 
-    def f(guess):
-        network.buses_t.v_ang.loc[now,sub_network.pvpqs] = guess[:len(sub_network.pvpqs)]
+    The sparsity of the Jacobian is analysed once for all snapshots
+    (see _jacobian_structure); the factorized Jacobian is reused for
+    jacobian_reuse iterations.
 
-        network.buses_t.v_mag_pu.loc[now,sub_network.pqs] = guess[len(sub_network.pvpqs):]
+    If seed_previous is True, each snapshot starts from the solution
+    of the previous snapshot if that converged; if the iterations do
+    not converge from there they are repeated from the initial guess.
 
-        v_mag_pu = network.buses_t.v_mag_pu.loc[now,buses_o]
-        v_ang = network.buses_t.v_ang.loc[now,buses_o]
-        V = v_mag_pu*np.exp(1j*v_ang)
+    Only arrays are passed, so that this function can be run in worker
+    processes.
+
+    Returns
+    -------
+    v_mag_pu, v_ang, n_iter, diff, converged
+        The last three are arrays with one entry per snapshot
+    """
+
+    n_pvpqs = Y.shape[0] - 1
+
+    #the voltages of the snapshot i under consideration are kept in
+    #the rows v_mag_pu[i] and v_ang[i]
+    def voltages(guess):
+        v_ang[i,1:] = guess[:n_pvpqs]
+        v_mag_pu[i,1+n_pvs:] = guess[n_pvpqs:]
+        return v_mag_pu[i]*np.exp(1j*v_ang[i])
+
+    def f(guess):
+        V = voltages(guess)
 
-        mismatch = V*np.conj(sub_network.Y*V) - s
+        mismatch = V*np.conj(Y*V) - s
 
-        F = r_[mismatch.real[1:],mismatch.imag[1+len(sub_network.pvs):]]
+        F = r_[mismatch.real[1:],mismatch.imag[1+n_pvs:]]
 
         return F
 
 
+    jacobian, factorize = _jacobian_structure(Y, n_pvs)
+
     def dfdx(guess):
+        return jacobian(voltages(guess))
 
-        network.buses_t.v_ang.loc[now,sub_network.pvpqs] = guess[:len(sub_network.pvpqs)]
 
-        network.buses_t.v_mag_pu.loc[now,sub_network.pqs] = guess[len(sub_network.pvpqs):]
+    n_snapshots = len(ss)
+    iters = np.zeros(n_snapshots, dtype=int)
+    diffs = np.empty(n_snapshots)
+    convs = np.zeros(n_snapshots, dtype=bool)
+    for i in range(n_snapshots):
+        s = ss[i]
 
-        v_mag_pu = network.buses_t.v_mag_pu.loc[now,buses_o]
-        v_ang = network.buses_t.v_ang.loc[now,buses_o]
+        seeded = seed_previous and i > 0 and convs[i-1]
+        if seeded:
+            initial = _seed_from_previous(v_mag_pu, v_ang, i, n_pvs)
 
-        V = v_mag_pu*np.exp(1j*v_ang)
+        guess = r_[v_ang[i,1:],v_mag_pu[i,1+n_pvs:]]
 
-        index = r_[:len(buses_o)]
+        #Now try and solve
+        start = time.time()
+        root, iters[i], diffs[i], convs[i] = newton_raphson_sparse(f,guess,dfdx,x_tol=x_tol,
+                                                                   factorize=factorize,
+                                                                   jacobian_reuse=jacobian_reuse)
+
+        if seeded and not convs[i]:
+            logger.info("Newton-Raphson did not converge from the solution of the previous snapshot, "
+                        "starting again from the initial guess")
+            v_mag_pu[i], v_ang[i] = initial
+            guess = r_[v_ang[i,1:],v_mag_pu[i,1+n_pvs:]]
+            n_iter = iters[i]
+            root, iters[i], diffs[i], convs[i] = newton_raphson_sparse(f,guess,dfdx,x_tol=x_tol,
+                                                                       factorize=factorize,
+                                                                       jacobian_reuse=jacobian_reuse)
+            iters[i] += n_iter
+
+        logger.info("Newton-Raphson solved in %d iterations with error of %f in %f seconds", iters[i],diffs[i],time.time()-start)
+        voltages(root)
+
+    return v_mag_pu, v_ang, iters, diffs, convs
+
+
+def _solve_snapshots(solver, matrices, n_pvs, v_mag_pu, v_ang, ss, x_tol, n_jobs, **kwargs):
+    """Split the snapshots into n_jobs chunks and solve each with
+    solver(*(matrices + (n_pvs, v_mag_pu, v_ang, ss, x_tol)), **kwargs),
+    in a process pool if n_jobs > 1."""
+
+    solver = partial(solver, **kwargs)
+
+    n_jobs = max(1, min(n_jobs, len(ss)))
+    chunks = np.array_split(np.arange(len(ss)), n_jobs)
+    args = [tuple(matrices) + (n_pvs, v_mag_pu[c], v_ang[c], ss[c], x_tol) for c in chunks]
+
+    results = None
+    if n_jobs > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            logger.warning("Process pools are not available, solving the snapshots one after the other")
+        else:
+            logger.info("Solving %d chunks of snapshots in parallel", n_jobs)
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(pool.map(solver, *zip(*args)))
 
-        #make sparse diagonal matrices
-        V_diag = csr_matrix((V,(index,index)))
-        V_norm_diag = csr_matrix((V/abs(V),(index,index)))
-        I_diag = csr_matrix((sub_network.Y*V,(index,index)))
+    if results is None:
+        results = [solver(*a) for a in args]
 
-        dS_dVa = 1j*V_diag*np.conj(I_diag - sub_network.Y*V_diag)
+    return [np.concatenate(r) for r in zip(*results)]
 
-        dS_dVm = V_norm_diag*np.conj(I_diag) + V_diag * np.conj(sub_network.Y*V_norm_diag)
+def _fast_decoupled_snapshots(Y, B_p, B_pp, n_pvs, v_mag_pu, v_ang, ss, x_tol=1e-6, lim_iter=100,
+                              seed_previous=False):
+    """
+    Solve the power flow equations of a sub-network with admittance
+    matrix Y for several snapshots with the fast-decoupled load flow,
+    see calculate_B_fdlf for B_p and B_pp.
+
+    The arguments (including seed_previous) and return values are the
+    same as for _newton_raphson_snapshots; B_p and B_pp are factorized once for
+    all iterations and snapshots. The error is the maximum mismatch
+    of the power flow equations as for Newton-Raphson.
+    """
 
-        J00 = dS_dVa[1:,1:].real
-        J01 = dS_dVm[1:,1+len(sub_network.pvs):].real
-        J10 = dS_dVa[1+len(sub_network.pvs):,1:].imag
-        J11 = dS_dVm[1+len(sub_network.pvs):,1+len(sub_network.pvs):].imag
+    B_p_lu = splu(csc_matrix(B_p))
+    B_pp_lu = splu(csc_matrix(B_pp)) if B_pp.shape[0] > 0 else None
 
-        J = svstack([
-            shstack([J00, J01]),
-            shstack([J10, J11])
-        ], format="csr")
+    def mismatch(i):
+        V = v_mag_pu[i]*np.exp(1j*v_ang[i])
+        return V*np.conj(Y*V) - ss[i]
 
-        return J
+    def error(mis):
+        return norm(r_[mis.real[1:],mis.imag[1+n_pvs:]],np.Inf)
+
+    n_snapshots = len(ss)
+    iters = np.zeros(n_snapshots, dtype=int)
+    diffs = np.empty(n_snapshots)
+    convs = np.zeros(n_snapshots, dtype=bool)
+    def solve(i):
+        mis = mismatch(i)
+        diff = error(mis)
+        n_iter = 0
+        while diff > x_tol and n_iter < lim_iter:
+            n_iter += 1
+
+            #P-theta half-iteration
+            v_ang[i,1:] -= B_p_lu.solve(mis.real[1:]/v_mag_pu[i,1:])
+            mis = mismatch(i)
+
+            #Q-V half-iteration
+            if B_pp_lu is not None:
+                v_mag_pu[i,1+n_pvs:] -= B_pp_lu.solve(mis.imag[1+n_pvs:]/v_mag_pu[i,1+n_pvs:])
+                mis = mismatch(i)
+
+            diff = error(mis)
+
+        return n_iter, diff
+
+    for i in range(n_snapshots):
+        start = time.time()
+
+        seeded = seed_previous and i > 0 and convs[i-1]
+        if seeded:
+            initial = _seed_from_previous(v_mag_pu, v_ang, i, n_pvs)
+
+        n_iter, diff = solve(i)
+
+        if seeded and not diff <= x_tol:
+            v_mag_pu[i], v_ang[i] = initial
+            n_iter_seeded = n_iter
+            n_iter, diff = solve(i)
+            n_iter += n_iter_seeded
+
+        iters[i] = n_iter
+        diffs[i] = diff
+        convs[i] = diff <= x_tol
+        logger.info("Fast-decoupled load flow finished after %d iterations with error of %f in %f seconds", n_iter,diff,time.time()-start)
+
+    return v_mag_pu, v_ang, iters, diffs, convs
+
+def _sub_network_pf_setup(sub_network, snapshots, x_tol=1e-6, use_seed=False, n_jobs=1,
+                          algorithm="newton", fdlf_variant="XB", jacobian_reuse=1):
+    """
+    Set the power injections of sub_network for the non-linear power
+    flow and return the functions solve() and store(result).
 
+    solve only works on arrays and the matrices of the sub-network
+    (which must have been calculated), so that several sub-networks
+    can be solved in threads; store writes its result to the network
+    and returns the number of iterations, the errors and the
+    convergence status as pandas.Series.
+
+    See sub_network_pf for the arguments.
+    """
+
+    if algorithm not in ["newton", "fdlf"]:
+        raise ValueError("algorithm must be one of 'newton' or 'fdlf', not {}".format(algorithm))
+    if algorithm == "fdlf" and fdlf_variant not in ["XB", "BX"]:
+        raise ValueError("fdlf_variant must be one of 'XB' or 'BX', not {}".format(fdlf_variant))
+    if use_seed not in [False, True, "previous"]:
+        raise ValueError("use_seed must be one of False, True or 'previous', not {}".format(use_seed))
+
+    seed_previous = use_seed == "previous"
+
+    logger.info("Performing non-linear load-flow on {} sub-network {} for snapshots {}".format(sub_network.network.sub_networks.at[sub_network.name,"carrier"], sub_network, snapshots))
+
+    network = sub_network.network
+    branches_i = sub_network.branches_i()
+    buses_o = sub_network.buses_o
+
+    for n in ("q", "p"):
+        # allow all one ports to dispatch as set
+        for c in sub_network.iterate_components(network.controllable_one_port_components):
+            c_n_set = get_switchable_as_dense(network, c.name, n + '_set', snapshots, c.ind)
+            c.pnl[n].loc[snapshots, c.ind] = c_n_set
+
+        # set the power injection at each node from controllable components
+        network.buses_t[n].loc[snapshots, buses_o] = \
+            sum([((c.pnl[n].loc[snapshots, c.ind] * c.df.loc[c.ind, 'sign'])
+                  .groupby(c.df.loc[c.ind, 'bus'], axis=1).sum()
+                  .reindex(columns=buses_o, fill_value=0.))
+                 for c in sub_network.iterate_components(network.controllable_one_port_components)])
+
+        if n == "p":
+            network.buses_t[n].loc[snapshots, buses_o] += sum(
+                [(- c.pnl[n+str(i)].loc[snapshots].groupby(c.df["bus"+str(i)], axis=1).sum()
+                  .reindex(columns=buses_o, fill_value=0))
+                 for c in network.iterate_components(network.controllable_branch_components)
+                 for i in [int(col[3:]) for col in c.df.columns if col[:3] == "bus"]])
+
+    n_pvs = len(sub_network.pvs)
+
+    #Make a guess for what we don't know: V_ang for PV and PQs and v_mag_pu for PQ buses
+    if use_seed and not seed_previous:
+        v_mag_pu_guess = network.buses_t.v_mag_pu.loc[snapshots,buses_o].values.astype(float)
+        v_ang_guess = network.buses_t.v_ang.loc[snapshots,buses_o].values.astype(float)
+    else:
+        v_mag_pu_guess = np.ones((len(snapshots), len(buses_o)))
+        v_ang_guess = np.zeros((len(snapshots), len(buses_o)))
 
     #Set what we know: slack V and v_mag_pu for PV buses
     v_mag_pu_set = get_switchable_as_dense(network, 'Bus', 'v_mag_pu_set', snapshots)
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.pvs] = v_mag_pu_set.loc[:,sub_network.pvs]
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.slack_bus] = v_mag_pu_set.loc[:,sub_network.slack_bus]
-    network.buses_t.v_ang.loc[snapshots,sub_network.slack_bus] = 0.
-
-    if not use_seed:
-        network.buses_t.v_mag_pu.loc[snapshots,sub_network.pqs] = 1.
-        network.buses_t.v_ang.loc[snapshots,sub_network.pvpqs] = 0.
-
-    ss = np.empty((len(snapshots), len(buses_o)), dtype=np.complex)
-    roots = np.empty((len(snapshots), len(sub_network.pvpqs) + len(sub_network.pqs)))
-    iters = pd.Series(0, index=snapshots)
-    diffs = pd.Series(index=snapshots)
-    convs = pd.Series(False, index=snapshots)
-    for i, now in enumerate(snapshots):
-        p = network.buses_t.p.loc[now,buses_o]
-        q = network.buses_t.q.loc[now,buses_o]
-        ss[i] = s = p + 1j*q
-
-        #Make a guess for what we don't know: V_ang for PV and PQs and v_mag_pu for PQ buses
-        guess = r_[network.buses_t.v_ang.loc[now,sub_network.pvpqs],network.buses_t.v_mag_pu.loc[now,sub_network.pqs]]
+    v_mag_pu_guess[:,:1+n_pvs] = v_mag_pu_set.loc[snapshots,buses_o[:1+n_pvs]].values
+    v_ang_guess[:,0] = 0.
+
+    ss = (network.buses_t.p.loc[snapshots,buses_o].values
+          + 1j*network.buses_t.q.loc[snapshots,buses_o].values)
+
+    #B' and B'' are built in solve from the data read here
+    if algorithm == "fdlf":
+        fdlf_data = _B_fdlf_data(sub_network)
+
+    def solve():
+        #the solvers work on copies of the guesses (see _solve_snapshots)
+        if algorithm == "newton":
+            return _solve_snapshots(_newton_raphson_snapshots, (sub_network.Y,),
+                                    n_pvs, v_mag_pu_guess, v_ang_guess, ss, x_tol, n_jobs,
+                                    jacobian_reuse=jacobian_reuse, seed_previous=seed_previous)
+
+        _calculate_B_fdlf(sub_network, fdlf_variant, fdlf_data)
+        v_mag_pu, v_ang, iters, diffs, convs = \
+            _solve_snapshots(_fast_decoupled_snapshots, (sub_network.Y, sub_network.B_p, sub_network.B_pp),
+                             n_pvs, v_mag_pu_guess, v_ang_guess, ss, x_tol, n_jobs, seed_previous=seed_previous)
+
+        if not convs.all():
+            failed = ~convs
+            logger.info("The fast-decoupled load flow did not converge for %d snapshots, "
+                        "falling back to Newton-Raphson", failed.sum())
+            v_mag_pu[failed], v_ang[failed], iters[failed], diffs[failed], convs[failed] = \
+                _solve_snapshots(_newton_raphson_snapshots, (sub_network.Y,), n_pvs,
+                                 v_mag_pu_guess[failed], v_ang_guess[failed], ss[failed], x_tol, n_jobs,
+                                 jacobian_reuse=jacobian_reuse, seed_previous=seed_previous)
+
+        return v_mag_pu, v_ang, iters, diffs, convs
+
+    def store(result):
+        v_mag_pu, v_ang, iters, diffs, convs = result
+
+        iters = pd.Series(iters, index=snapshots)
+        diffs = pd.Series(diffs, index=snapshots)
+        convs = pd.Series(convs, index=snapshots)
+
+        #now set everything
+        network.buses_t.v_ang.loc[snapshots,buses_o] = v_ang
+        network.buses_t.v_mag_pu.loc[snapshots,buses_o] = v_mag_pu
 
-        #Now try and solve
-        start = time.time()
-        roots[i], n_iter, diff, converged = newton_raphson_sparse(f,guess,dfdx,x_tol=x_tol)
-        logger.info("Newton-Raphson solved in %d iterations with error of %f in %f seconds", n_iter,diff,time.time()-start)
-        iters[now] = n_iter
-        diffs[now] = diff
-        convs[now] = converged
+        V = v_mag_pu*np.exp(1j*v_ang)
+
+        #add voltages to branches
+        buses_indexer = buses_o.get_indexer
+        branch_bus0 = []; branch_bus1 = []
+        for c in sub_network.iterate_components(network.passive_branch_components):
+            branch_bus0 += list(c.df.loc[c.ind, 'bus0'])
+            branch_bus1 += list(c.df.loc[c.ind, 'bus1'])
+
+        #branch flows and bus injections for all snapshots at once (the
+        #sparse matrices act on the voltages as columns)
+        s0 = V[:,buses_indexer(branch_bus0)]*np.conj(sub_network.Y0*V.T).T
+        s1 = V[:,buses_indexer(branch_bus1)]*np.conj(sub_network.Y1*V.T).T
+        s_calc = V*np.conj(sub_network.Y*V.T).T
+
+        #write them to the output frames by position, or by label if
+        #a snapshot or branch is missing from a frame (-1 would
+        #silently write to the last row or column)
+        branch_components = branches_i.get_level_values(0)
+        for c in sub_network.iterate_components(network.passive_branch_components):
+            j = np.flatnonzero(branch_components == c.name)
+            names = branches_i[j].get_level_values(1)
+            for attr, values in [("p0", s0.real), ("q0", s0.imag), ("p1", s1.real), ("q1", s1.imag)]:
+                df = c.pnl[attr]
+                rows = df.index.get_indexer(snapshots)
+                columns = df.columns.get_indexer(names)
+                if (rows == -1).any() or (columns == -1).any():
+                    df.loc[snapshots, names] = values[:,j]
+                else:
+                    df.iloc[rows, columns] = values[:,j]
+
+        slack_index = buses_o.get_loc(sub_network.slack_bus)
+        network.buses_t.p.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].real
+        network.buses_t.q.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].imag
+        network.buses_t.q.loc[snapshots,sub_network.pvs] = s_calc[:,buses_indexer(sub_network.pvs)].imag
+
+        #set shunt impedance powers
+        shunt_impedances_i = sub_network.shunt_impedances_i()
+        if len(shunt_impedances_i):
+            #add voltages
+            shunt_impedances_v_mag_pu = v_mag_pu[:,buses_indexer(network.shunt_impedances.loc[shunt_impedances_i, 'bus'])]
+            network.shunt_impedances_t.p.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'g_pu'].values
+            network.shunt_impedances_t.q.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'b_pu'].values
+
+        #let slack generator take up the slack
+        network.generators_t.p.loc[snapshots,sub_network.slack_generator] += network.buses_t.p.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].real
+        network.generators_t.q.loc[snapshots,sub_network.slack_generator] += network.buses_t.q.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].imag
+
+        #set the Q of the PV generators
+        network.generators_t.q.loc[snapshots,network.buses.loc[sub_network.pvs, "generator"]] += np.asarray(network.buses_t.q.loc[snapshots,sub_network.pvs] - ss[:,buses_indexer(sub_network.pvs)].imag)
+
+        return iters, diffs, convs
+
+    return solve, store
+
+def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False,
+                   n_jobs=1, algorithm="newton", fdlf_variant="XB", jacobian_reuse=1):
+    """
+    Non-linear power flow for connected sub-network.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating dependent values and finding bus controls.
+    x_tol: float
+        Tolerance for Newton-Raphson power flow.
+    use_seed : bool or "previous", default False
+        Use a seed for the initial guess for the Newton-Raphson
+        algorithm: True uses the voltages stored in network.buses_t,
+        "previous" starts each snapshot from the solution of the
+        previous snapshot and falls back to the flat start if it does
+        not converge from there.
+    n_jobs : int, default 1
+        Number of processes among which the snapshots are split; only
+        the admittance matrix and the arrays of voltages and power
+        injections are sent to the processes.
+    algorithm : string, default "newton"
+        "newton" for Newton-Raphson or "fdlf" for the fast-decoupled
+        load flow, which factorizes B' and B'' once and falls back to
+        Newton-Raphson for the snapshots which do not converge.
+    fdlf_variant : string, default "XB"
+        Variant of the fast-decoupled load flow, "XB" or "BX" (see
+        calculate_B_fdlf).
+    jacobian_reuse : int, default 1
+        Number of Newton-Raphson iterations for which a factorized
+        Jacobian is reused ("dishonest" Newton-Raphson); 1 means a
+        new Jacobian in every iteration.
 
+    Returns
+    -------
+    Tuple of three pandas.Series indicating number of iterations,
+    remaining error, and convergence status for each snapshot
+    """
 
-    #now set everything
-    network.buses_t.v_ang.loc[snapshots,sub_network.pvpqs] = roots[:,:len(sub_network.pvpqs)]
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.pqs] = roots[:,len(sub_network.pvpqs):]
+    snapshots = _as_snapshots(sub_network.network, snapshots)
 
-    v_mag_pu = network.buses_t.v_mag_pu.loc[snapshots,buses_o].values
-    v_ang = network.buses_t.v_ang.loc[snapshots,buses_o].values
+    # _sub_network_prepare_pf(sub_network, snapshots, skip_pre, calculate_Y)
+    network = sub_network.network
 
-    V = v_mag_pu*np.exp(1j*v_ang)
+    if not skip_pre:
+        calculate_dependent_values(network)
+        find_bus_controls(sub_network)
+        _allocate_pf_outputs(network, linear=False)
 
-    #add voltages to branches
-    buses_indexer = buses_o.get_indexer
-    branch_bus0 = []; branch_bus1 = []
-    for c in sub_network.iterate_components(network.passive_branch_components):
-        branch_bus0 += list(c.df.loc[c.ind, 'bus0'])
-        branch_bus1 += list(c.df.loc[c.ind, 'bus1'])
-    v0 = V[:,buses_indexer(branch_bus0)]
-    v1 = V[:,buses_indexer(branch_bus1)]
-
-    i0 = np.empty((len(snapshots), sub_network.Y0.shape[0]), dtype=np.complex)
-    i1 = np.empty((len(snapshots), sub_network.Y1.shape[0]), dtype=np.complex)
-    for i, now in enumerate(snapshots):
-        i0[i] = sub_network.Y0*V[i]
-        i1[i] = sub_network.Y1*V[i]
-
-    s0 = pd.DataFrame(v0*np.conj(i0), columns=branches_i, index=snapshots)
-    s1 = pd.DataFrame(v1*np.conj(i1), columns=branches_i, index=snapshots)
-    for c in sub_network.iterate_components(network.passive_branch_components):
-        s0t = s0.loc[:,c.name]
-        s1t = s1.loc[:,c.name]
-        c.pnl.p0.loc[snapshots,s0t.columns] = s0t.values.real
-        c.pnl.q0.loc[snapshots,s0t.columns] = s0t.values.imag
-        c.pnl.p1.loc[snapshots,s1t.columns] = s1t.values.real
-        c.pnl.q1.loc[snapshots,s1t.columns] = s1t.values.imag
-
-    s_calc = np.empty((len(snapshots), len(buses_o)), dtype=np.complex)
-    for i in np.arange(len(snapshots)):
-        s_calc[i] = V[i]*np.conj(sub_network.Y*V[i])
-    slack_index = buses_o.get_loc(sub_network.slack_bus)
-    network.buses_t.p.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].real
-    network.buses_t.q.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].imag
-    network.buses_t.q.loc[snapshots,sub_network.pvs] = s_calc[:,buses_indexer(sub_network.pvs)].imag
-
-    #set shunt impedance powers
-    shunt_impedances_i = sub_network.shunt_impedances_i()
-    if len(shunt_impedances_i):
-        #add voltages
-        shunt_impedances_v_mag_pu = v_mag_pu[:,buses_indexer(network.shunt_impedances.loc[shunt_impedances_i, 'bus'])]
-        network.shunt_impedances_t.p.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'g_pu'].values
-        network.shunt_impedances_t.q.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'b_pu'].values
 
-    #let slack generator take up the slack
-    network.generators_t.p.loc[snapshots,sub_network.slack_generator] += network.buses_t.p.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].real
-    network.generators_t.q.loc[snapshots,sub_network.slack_generator] += network.buses_t.q.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].imag
+    if not skip_pre and len(sub_network.branches_i()) > 0:
+        calculate_Y(sub_network, skip_pre=True)
 
-    #set the Q of the PV generators
-    network.generators_t.q.loc[snapshots,network.buses.loc[sub_network.pvs, "generator"]] += np.asarray(network.buses_t.q.loc[snapshots,sub_network.pvs] - ss[:,buses_indexer(sub_network.pvs)].imag)
+    solve, store = _sub_network_pf_setup(sub_network, snapshots, x_tol=x_tol, use_seed=use_seed,
+                                         n_jobs=n_jobs, algorithm=algorithm,
+                                         fdlf_variant=fdlf_variant, jacobian_reuse=jacobian_reuse)
 
-    return iters, diffs, convs
+    return store(solve())
 
 
-def network_lpf(network, snapshots=None, skip_pre=False):
+def network_lpf(network, snapshots=None, skip_pre=False, n_threads=1):
     """
     Linear power flow for generic network.
 
@@ -402,13 +792,17 @@ def network_lpf(network, snapshots=None, skip_pre=False):
     skip_pre: bool, default False
         Skip the preliminary steps of computing topology, calculating
         dependent values and finding bus controls.
+    n_threads : int, default 1
+        Number of threads in which the susceptance matrices of the
+        sub-networks are calculated and factorized and their flows
+        solved concurrently.
 
     Returns
     -------
     None
     """
 
-    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=True)
+    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=True, n_threads=n_threads)
 
 
 def apply_line_types(network):
@@ -611,8 +1005,117 @@ def find_bus_controls(sub_network):
     sub_network.buses_o = sub_network.pvpqs.insert(0, sub_network.slack_bus)
 
 
+class _MatrixCache(dict):
+    """Dictionary of cached matrices and factorizations, which starts
+    empty in copies and pickles of the network, since the SuperLU
+    factorizations cannot be copied."""
+
+    def __deepcopy__(self, memo):
+        return _MatrixCache()
+
+    def __reduce__(self):
+        return (_MatrixCache, ())
+
+def _matrix_cache(network):
+    """Return the dictionary in which the matrices and factorizations
+    of the sub-networks of network are cached (see
+    _cached_branch_matrices, factorize_B and calculate_PTDF)."""
+
+    cache = getattr(network, "_matrix_cache", None)
+    if cache is None:
+        cache = network._matrix_cache = _MatrixCache()
+    return cache
+
+def _branch_data(sub_network, attrs):
+    """
+    Return the names of the passive branches of sub_network, the
+    positions of their buses bus0 and bus1 in sub_network.buses_o and
+    their attributes attrs as columns of an array, ordered like
+    sub_network.branches_i(). Attributes which a branch component does
+    not have are NaN.
+    """
+
+    network = sub_network.network
+    buses_o = sub_network.buses_o
+
+    names = []
+    bus0 = []
+    bus1 = []
+    values = [np.empty((0, len(attrs)))]
+    for c in sub_network.iterate_components(network.passive_branch_components):
+        names.append((c.name, tuple(c.ind)))
+        bus0.append(buses_o.get_indexer(c.df.loc[c.ind, "bus0"]))
+        bus1.append(buses_o.get_indexer(c.df.loc[c.ind, "bus1"]))
+        values.append(np.column_stack([c.df.loc[c.ind, attr].values.astype(float) if attr in c.df.columns
+                                       else np.full(len(c.ind), np.nan) for attr in attrs]))
+
+    bus0 = np.concatenate(bus0) if bus0 else np.empty(0, dtype=int)
+    bus1 = np.concatenate(bus1) if bus1 else np.empty(0, dtype=int)
+
+    return tuple(names), bus0, bus1, np.vstack(values)
+
+#number of low-rank patches after which cached matrices are rebuilt,
+#so that rounding errors do not accumulate
+_max_matrix_patches = 10
+
+def _cached_branch_matrices(sub_network, kind, branch_data, build, patch, extra=None):
+    """
+    Return the matrices build(bus0, bus1, values) of sub_network for the
+    branch_data (names, bus0, bus1, values) returned by _branch_data
+    from the matrix cache of the network.
+
+    The entry of the cache is keyed by kind and the name of the
+    sub-network and fingerprinted by the bus ordering, the branches and
+    their buses and extra (e.g. the shunts), which must all be
+    unchanged to use it. If the attributes of at most half of the
+    branches have changed, the cached matrices are updated with the
+    low-rank patch(matrices, bus0, bus1, values, old_values, changed)
+    instead of being rebuilt, but at most _max_matrix_patches times in
+    a row.
+    """
+
+    names, bus0, bus1, values = branch_data
+    topology = (tuple(sub_network.buses_o), names, bus0.tobytes(), bus1.tobytes(), extra)
+
+    cache = _matrix_cache(sub_network.network)
+    key = (kind, sub_network.name)
+    entry = cache.get(key)
+
+    patches = 0
+    if entry is not None and entry["topology"] == topology:
+        old_values = entry["values"]
+        changed = np.flatnonzero(((old_values != values)
+                                  & ~(np.isnan(old_values) & np.isnan(values))).any(axis=1))
+        if len(changed) == 0:
+            return entry["matrices"]
+        elif 2*len(changed) <= len(values) and entry["patches"] < _max_matrix_patches:
+            logger.debug("Patching %s of sub-network %s for %d changed branches",
+                         kind, sub_network.name, len(changed))
+            matrices = patch(entry["matrices"], bus0, bus1, values, old_values, changed)
+            patches = entry["patches"] + 1
+        else:
+            matrices = build(bus0, bus1, values)
+    else:
+        matrices = build(bus0, bus1, values)
+
+    cache[key] = dict(topology=topology, values=values, matrices=matrices, patches=patches)
+    return matrices
+
+def _incidence(bus0, bus1, branches, n_buses):
+    """Columns branches of the incidence matrix (see incidence_matrix)."""
+    n = len(branches)
+    return csr_matrix((r_[ones(n), -ones(n)], (r_[bus0[branches], bus1[branches]], r_[:n, :n])),
+                      (n_buses, n))
+
 def calculate_B_H(sub_network,skip_pre=False):
-    """Calculate B and H matrices for AC or DC sub-networks."""
+    """
+    Calculate B and H matrices for AC or DC sub-networks.
+
+    The matrices are cached at the level of the network and reused as
+    long as the topology and the impedances of the sub-network are
+    unchanged; if only a few impedances change, B is updated by a
+    low-rank correction.
+    """
 
     network = sub_network.network
 
@@ -620,43 +1123,168 @@ def calculate_B_H(sub_network,skip_pre=False):
         calculate_dependent_values(network)
         find_bus_controls(sub_network)
 
-    if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
+    _calculate_B_H(sub_network, _B_H_data(sub_network))
+
+def _B_H_data(sub_network):
+    """Read the branch data for calculate_B_H from the network."""
+
+    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] == "DC":
         attribute="r_pu_eff"
     else:
         attribute="x_pu_eff"
 
+    return attribute, _branch_data(sub_network, [attribute, "phase_shift"])
+
+def _calculate_B_H(sub_network, data):
+    """Calculate the matrices of calculate_B_H from the data returned by
+    _B_H_data without reading the network."""
+
+    attribute, branch_data = data
+
+    n_buses = len(sub_network.buses_o)
+
     #following leans heavily on pypower.makeBdc
 
-    #susceptances
-    b = 1./np.concatenate([(c.df.loc[c.ind, attribute]).values \
-                           for c in sub_network.iterate_components(network.passive_branch_components)])
+    def susceptances(values):
+        b = 1./values[:,0]
+        if np.isnan(b).any():
+            logger.warning("Warning! Some series impedances are zero - this will cause a singularity in LPF!")
+        return b
+
+    def shifts(matrices, b, values):
+        matrices["p_branch_shift"] = -b*np.nan_to_num(values[:,1])*np.pi/180.
+        matrices["p_bus_shift"] = matrices["K"] * matrices["p_branch_shift"]
+        return matrices
+
+    def build(bus0, bus1, values):
+        b = susceptances(values)
+        b_diag = csr_matrix((b, (r_[:len(b)], r_[:len(b)])), (len(b), len(b)))
+
+        #incidence matrix
+        K = _incidence(bus0, bus1, np.arange(len(b)), n_buses)
+
+        H = b_diag*K.T
+
+        #weighted Laplacian
+        B = K * H
+
+        return shifts(dict(K=K, H=H, B=B), b, values)
+
+    def patch(matrices, bus0, bus1, values, old_values, changed):
+        b = susceptances(values)
+        b_diag = csr_matrix((b, (r_[:len(b)], r_[:len(b)])), (len(b), len(b)))
+
+        K = matrices["K"]
+        H = b_diag*K.T
+
+        #B changes by K_c diag(b_c - b_c_old) K_c.T for the changed branches c
+        K_c = _incidence(bus0, bus1, changed, n_buses)
+        db = b[changed] - 1./old_values[changed,0]
+        B = matrices["B"] + K_c * csr_matrix((db, (r_[:len(db)], r_[:len(db)]))) * K_c.T
+        B.eliminate_zeros()
+
+        return shifts(dict(K=K, H=H, B=B), b, values)
+
+    matrices = _cached_branch_matrices(sub_network, ("B_H", attribute), branch_data, build, patch)
+
+    sub_network.K = matrices["K"]
+    sub_network.H = matrices["H"]
+    sub_network.B = matrices["B"]
+    sub_network.p_branch_shift = matrices["p_branch_shift"]
+    sub_network.p_bus_shift = matrices["p_bus_shift"]
+
+def _B_key(sub_network, *matrices):
+    """Fingerprint of the bus ordering and the sparse matrices."""
+    key = (tuple(sub_network.buses_o),)
+    for M in matrices:
+        M = csr_matrix(M)
+        key += (M.shape, M.indptr.tobytes(), M.indices.tobytes(), M.data.tobytes())
+    return key
 
+#in the symmetric orderings a diagonal entry is only used as pivot if
+#it is at least this fraction of the largest entry in its column, so
+#that indefinite B (e.g. from negative series reactances) stay stable
+_diag_pivot_thresh = 0.01
 
-    if np.isnan(b).any():
-        logger.warning("Warning! Some series impedances are zero - this will cause a singularity in LPF!")
-    b_diag = csr_matrix((b, (r_[:len(b)], r_[:len(b)])))
+def _factorize_symmetric(A, ordering="mmd"):
+    """
+    Return the sparse LU factorization of the matrix A with a symmetric
+    sparsity pattern (like B) under a fill-reducing ordering.
+
+    "mmd" uses the multiple minimum degree ordering of A + A.T
+    (MMD_AT_PLUS_A) in SuperLU and prefers diagonal pivots, "rcm"
+    permutes rows and columns by the reverse Cuthill-McKee ordering
+    before factorizing (the returned object undoes the permutation in
+    its solve method), "colamd" is the default column ordering of
+    splu. If a symmetric ordering fails, A is factorized with "colamd".
+    """
+
+    A = csc_matrix(A)
 
-    #incidence matrix
-    sub_network.K = sub_network.incidence_matrix(busorder=sub_network.buses_o)
+    if ordering not in ("mmd", "rcm", "colamd"):
+        raise ValueError("ordering must be one of 'mmd', 'rcm' or 'colamd', not {}".format(ordering))
 
-    sub_network.H = b_diag*sub_network.K.T
+    try:
+        if ordering == "mmd":
+            return splu(A, permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=_diag_pivot_thresh,
+                        options=dict(SymmetricMode=True))
+        elif ordering == "rcm":
+            p = reverse_cuthill_mckee(csr_matrix(A), symmetric_mode=True)
+            lu = splu(csc_matrix(A[p][:, p]), permc_spec="NATURAL",
+                      diag_pivot_thresh=_diag_pivot_thresh, options=dict(SymmetricMode=True))
+            return _FactorizedSolve(lu, p, p)
+    except RuntimeError as e:
+        logger.warning("Factorization with the %s ordering failed (%s), using colamd", ordering, e)
+
+    return splu(A)
+
+def factorize_B(sub_network, ordering="mmd"):
+    """
+    Return the sparse LU factorization of the susceptance matrix B of
+    sub_network with the slack bus removed, i.e. of B[1:,1:].
 
-    #weighted Laplacian
-    sub_network.B = sub_network.K * sub_network.H
+    The rows and columns are reordered internally to reduce the
+    fill-in of the factors, but the solve method of the returned
+    object takes and returns vectors ordered like
+    sub_network.buses_o[1:].
 
+    The factorization is cached at the level of the network and only
+    recomputed if the bus ordering or the entries of B, i.e. the
+    topology or the impedances, have changed since the last call.
 
-    sub_network.p_branch_shift = -b*np.concatenate([(c.df.loc[c.ind, "phase_shift"]).values*np.pi/180. if c.name == "Transformer"
-                                                    else np.zeros((len(c.ind),))
-                                                    for c in sub_network.iterate_components(network.passive_branch_components)])
+    Parameters
+    ----------
+    sub_network : pypsa.SubNetwork
+        B must have been calculated with calculate_B_H
+    ordering : string, default "mmd"
+        Fill-reducing ordering, "mmd" (multiple minimum degree on the
+        symmetric pattern), "rcm" (reverse Cuthill-McKee) or "colamd"
+        (column ordering for unsymmetric matrices); "mmd" and "rcm"
+        fall back to "colamd" if the factorization fails
 
-    sub_network.p_bus_shift = sub_network.K * sub_network.p_branch_shift
+    Returns
+    -------
+    scipy.sparse.linalg.SuperLU or an object with the same solve method
+    """
+
+    key = _B_key(sub_network, sub_network.B) + (ordering,)
+
+    cache = _matrix_cache(sub_network.network)
+    entry = cache.get(("B_factor", sub_network.name))
+    if entry is None or entry["key"] != key:
+        logger.debug("Factorizing B of sub-network %s", sub_network.name)
+        entry = dict(key=key, lu=_factorize_symmetric(csr_matrix(sub_network.B)[1:, 1:], ordering))
+        cache[("B_factor", sub_network.name)] = entry
+
+    return entry["lu"]
 
 def calculate_PTDF(sub_network,skip_pre=False):
     """
     Calculate the Power Transfer Distribution Factor (PTDF) for
     sub_network.
 
-    Sets sub_network.PTDF as a (dense) numpy array.
+    Sets sub_network.PTDF as a (dense) numpy array. It is cached at
+    the level of the network together with B and H.
 
     Parameters
     ----------
@@ -670,20 +1298,19 @@ def calculate_PTDF(sub_network,skip_pre=False):
     if not skip_pre:
         calculate_B_H(sub_network)
 
-    #calculate inverse of B with slack removed
+    key = _B_key(sub_network, sub_network.B, sub_network.H)
 
-    n_pvpq = len(sub_network.pvpqs)
-    index = np.r_[:n_pvpq]
+    cache = _matrix_cache(sub_network.network)
+    entry = cache.get(("PTDF", sub_network.name))
+    if entry is not None and entry["key"] == key:
+        sub_network.PTDF = entry["PTDF"]
+        return
 
-    I = csc_matrix((np.ones(n_pvpq), (index, index)))
+    #calculate inverse of B with slack removed
 
-    B_inverse = spsolve(sub_network.B[1:, 1:],I)
+    n_pvpq = len(sub_network.pvpqs)
 
-    #exception for two-node networks, where B_inverse is a 1d array
-    if issparse(B_inverse):
-        B_inverse = B_inverse.toarray()
-    elif B_inverse.shape == (1,):
-        B_inverse = B_inverse.reshape((1,1))
+    B_inverse = factorize_B(sub_network).solve(np.eye(n_pvpq))
 
     #add back in zeroes for slack
     B_inverse = np.hstack((np.zeros((n_pvpq,1)),B_inverse))
@@ -691,62 +1318,67 @@ def calculate_PTDF(sub_network,skip_pre=False):
 
     sub_network.PTDF = sub_network.H*B_inverse
 
+    cache[("PTDF", sub_network.name)] = dict(key=key, PTDF=sub_network.PTDF)
 
-def calculate_Y(sub_network,skip_pre=False):
-    """Calculate bus admittance matrices for AC sub-networks."""
 
-    if not skip_pre:
-        calculate_dependent_values(sub_network.network)
+_admittance_attrs = ["r_pu", "x_pu", "g_pu", "b_pu", "tap_ratio", "tap_side", "phase_shift"]
 
-    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] != "AC":
-        logger.warning("Non-AC networks not supported for Y!")
-        return
-
-    branches = sub_network.branches()
-    buses_o = sub_network.buses_o
-
-    network = sub_network.network
+def _branch_admittances(values, resistance=True, shunts=True, taps=True, phase_shift=True):
+    """Return the admittance elements Y00, Y01, Y10 and Y11 of the
+    branches with the attributes _admittance_attrs as the columns of
+    values (see _admittance_matrices)."""
 
     #following leans heavily on pypower.makeYbus
     #Copyright Richard Lincoln, Ray Zimmerman, BSD-style licence
 
-    num_branches = len(branches)
-    num_buses = len(buses_o)
+    r_pu, x_pu, g_pu, b_pu, tap_ratio, tap_side, shift = values.T
 
-    y_se = 1/(branches["r_pu"] + 1.j*branches["x_pu"])
+    y_se = 1/(r_pu*resistance + 1.j*x_pu)
 
-    y_sh = branches["g_pu"]+ 1.j*branches["b_pu"]
+    y_sh = (g_pu + 1.j*b_pu)*shunts
 
-    tau = branches["tap_ratio"].fillna(1.)
+    tau = np.where(np.isnan(tap_ratio), 1., tap_ratio)
 
     #catch some transformers falsely set with tau = 0 by pypower
     tau[tau==0] = 1.
 
+    if not taps:
+        tau[:] = 1.
+
     #define the HV tap ratios
-    tau_hv = pd.Series(1.,branches.index)
-    tau_hv[branches.tap_side==0] = tau[branches.tap_side==0]
+    tau_hv = np.where(tap_side == 0, tau, 1.)
 
     #define the LV tap ratios
-    tau_lv = pd.Series(1.,branches.index)
-    tau_lv[branches.tap_side==1] = tau[branches.tap_side==1]
-
+    tau_lv = np.where(tap_side == 1, tau, 1.)
 
-    phase_shift = np.exp(1.j*branches["phase_shift"].fillna(0.)*np.pi/180.)
+    shift = np.exp(1.j*np.nan_to_num(shift)*np.pi/180.*phase_shift)
 
     #build the admittance matrix elements for each branch
     Y11 = (y_se + 0.5*y_sh)/tau_lv**2
-    Y10 = -y_se/tau_lv/tau_hv/phase_shift
-    Y01 = -y_se/tau_lv/tau_hv/np.conj(phase_shift)
+    Y10 = -y_se/tau_lv/tau_hv/shift
+    Y01 = -y_se/tau_lv/tau_hv/np.conj(shift)
     Y00 = (y_se + 0.5*y_sh)/tau_hv**2
 
-    #bus shunt impedances
+    return Y00, Y01, Y10, Y11
+
+def _bus_shunt_admittances(sub_network, shunts=True):
+    """Admittances of the shunt impedances at the buses of sub_network."""
+
+    network = sub_network.network
+    buses_o = sub_network.buses_o
+
     b_sh = network.shunt_impedances.b_pu.groupby(network.shunt_impedances.bus).sum().reindex(buses_o, fill_value = 0.)
     g_sh = network.shunt_impedances.g_pu.groupby(network.shunt_impedances.bus).sum().reindex(buses_o, fill_value = 0.)
-    Y_sh = g_sh + 1.j*b_sh
+    return ((g_sh + 1.j*b_sh)*shunts).values
+
+def _build_admittance_matrices(bus0, bus1, elements, Y_sh):
+    """Return Y0, Y1 and Y from the branch elements (Y00, Y01, Y10,
+    Y11) and the bus shunt admittances Y_sh."""
 
-    #get bus indices
-    bus0 = buses_o.get_indexer(branches.bus0)
-    bus1 = buses_o.get_indexer(branches.bus1)
+    Y00, Y01, Y10, Y11 = elements
+
+    num_branches = len(bus0)
+    num_buses = len(Y_sh)
 
     #connection matrices
     C0 = csr_matrix((ones(num_branches), (np.arange(num_branches), bus0)), (num_branches, num_buses))
@@ -755,13 +1387,132 @@ def calculate_Y(sub_network,skip_pre=False):
     #build Y{0,1} such that Y{0,1} * V is the vector complex branch currents
 
     i = r_[np.arange(num_branches), np.arange(num_branches)]
-    sub_network.Y0 = csr_matrix((r_[Y00,Y01],(i,r_[bus0,bus1])), (num_branches,num_buses))
-    sub_network.Y1 = csr_matrix((r_[Y10,Y11],(i,r_[bus0,bus1])), (num_branches,num_buses))
+    Y0 = csr_matrix((r_[Y00,Y01],(i,r_[bus0,bus1])), (num_branches,num_buses))
+    Y1 = csr_matrix((r_[Y10,Y11],(i,r_[bus0,bus1])), (num_branches,num_buses))
 
     #now build bus admittance matrix
-    sub_network.Y = C0.T * sub_network.Y0 + C1.T * sub_network.Y1 + \
+    Y = C0.T * Y0 + C1.T * Y1 + \
        csr_matrix((Y_sh, (np.arange(num_buses), np.arange(num_buses))))
 
+    return Y0, Y1, Y
+
+def _admittance_matrices(data, resistance=True, shunts=True, taps=True,
+                         phase_shift=True):
+    """Return the branch admittance matrices Y0, Y1 and the bus
+    admittance matrix Y from the branch data and bus shunt admittances
+    data of a sub-network (see _B_fdlf_data), optionally neglecting
+    series resistances, shunts, tap ratios or phase shifts (as needed
+    for the fast-decoupled load flow)."""
+
+    (names, bus0, bus1, values), Y_sh = data
+
+    elements = _branch_admittances(values, resistance, shunts, taps, phase_shift)
+
+    return _build_admittance_matrices(bus0, bus1, elements, Y_sh*shunts)
+
+def calculate_Y(sub_network,skip_pre=False):
+    """
+    Calculate bus admittance matrices for AC sub-networks.
+
+    The matrices are cached at the level of the network and reused as
+    long as the topology, the branch parameters and the shunts of the
+    sub-network are unchanged; if only the parameters of a few
+    branches change, Y is updated by a low-rank correction.
+    """
+
+    if not skip_pre:
+        calculate_dependent_values(sub_network.network)
+
+    _calculate_Y(sub_network, _Y_data(sub_network))
+
+def _Y_data(sub_network):
+    """Read the branch data and the shunt admittances for calculate_Y
+    from the network; None for non-AC sub-networks."""
+
+    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] != "AC":
+        logger.warning("Non-AC networks not supported for Y!")
+        return None
+
+    return _branch_data(sub_network, _admittance_attrs), _bus_shunt_admittances(sub_network)
+
+def _calculate_Y(sub_network, data):
+    """Calculate the matrices of calculate_Y from the data returned by
+    _Y_data without reading the network."""
+
+    if data is None:
+        return
+
+    branch_data, Y_sh = data
+    num_buses = len(Y_sh)
+
+    def build(bus0, bus1, values):
+        Y0, Y1, Y = _build_admittance_matrices(bus0, bus1, _branch_admittances(values), Y_sh)
+        return dict(Y0=Y0, Y1=Y1, Y=Y)
+
+    def patch(matrices, bus0, bus1, values, old_values, changed):
+        elements = _branch_admittances(values)
+        Y0, Y1, _ = _build_admittance_matrices(bus0, bus1, elements, Y_sh)
+
+        #Y changes by C0_c.T dY0_c + C1_c.T dY1_c for the changed branches c
+        old_elements = _branch_admittances(old_values[changed])
+        dY00, dY01, dY10, dY11 = [e[changed] - o for e, o in zip(elements, old_elements)]
+        b0 = bus0[changed]
+        b1 = bus1[changed]
+        dY = csr_matrix((r_[dY00, dY01, dY10, dY11], (r_[b0, b0, b1, b1], r_[b0, b1, b0, b1])),
+                        (num_buses, num_buses))
+
+        Y = matrices["Y"] + dY
+        Y.eliminate_zeros()
+
+        return dict(Y0=Y0, Y1=Y1, Y=Y)
+
+    matrices = _cached_branch_matrices(sub_network, "Y", branch_data, build, patch,
+                                       extra=Y_sh.tobytes())
+
+    sub_network.Y0 = matrices["Y0"]
+    sub_network.Y1 = matrices["Y1"]
+    sub_network.Y = matrices["Y"]
+
+def calculate_B_fdlf(sub_network, variant="XB"):
+    """
+    Calculate the matrices B' and B'' of the fast-decoupled load flow
+    for an AC sub-network, following pypower.makeB.
+
+    Sets sub_network.B_p (rows and columns of the PV and PQ buses) and
+    sub_network.B_pp (rows and columns of the PQ buses).
+
+    Parameters
+    ----------
+    sub_network : pypsa.SubNetwork
+    variant : string, default "XB"
+        "XB" neglects the series resistances in B', "BX" neglects them
+        in B''. Shunts and tap ratios are always neglected in B' and
+        phase shifts in B''.
+    """
+
+    _calculate_B_fdlf(sub_network, variant, _B_fdlf_data(sub_network))
+
+def _B_fdlf_data(sub_network):
+    """Read the branch data and the shunt admittances for
+    calculate_B_fdlf from the network."""
+
+    return _branch_data(sub_network, _admittance_attrs), _bus_shunt_admittances(sub_network)
+
+def _calculate_B_fdlf(sub_network, variant, data):
+    """Calculate the matrices of calculate_B_fdlf from the data returned
+    by _B_fdlf_data without reading the network."""
+
+    if variant not in ["XB", "BX"]:
+        raise ValueError("variant must be one of 'XB' or 'BX', not {}".format(variant))
+
+    B_p = -_admittance_matrices(data, resistance=(variant == "BX"),
+                                shunts=False, taps=False)[2].imag
+    B_pp = -_admittance_matrices(data, resistance=(variant == "XB"),
+                                 phase_shift=False)[2].imag
+
+    n_pvs = len(sub_network.pvs)
+    sub_network.B_p = csc_matrix(B_p[1:, 1:])
+    sub_network.B_pp = csc_matrix(B_pp[1+n_pvs:, 1+n_pvs:])
 
 
 def aggregate_multi_graph(sub_network):
@@ -896,37 +1647,22 @@ def find_cycles(sub_network, weight='x_pu'):
                 sub_network.C[b_i,c] = sign
                 c+=1
 
-def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
+def _sub_network_lpf_setup(sub_network, snapshots):
     """
-    Linear power flow for connected sub-network.
+    Set the power injections of sub_network for the linear power flow
+    and return the functions solve() and store(result).
 
-    Parameters
-    ----------
-    snapshots : list-like|single snapshot
-        A subset or an elements of network.snapshots on which to run
-        the power flow, defaults to network.snapshots
-    skip_pre: bool, default False
-        Skip the preliminary steps of computing topology, calculating
-        dependent values and finding bus controls.
-
-    Returns
-    -------
-    None
+    solve factorizes B (see factorize_B) and finds the voltage angles
+    as an array, so that several sub-networks can be solved in
+    threads; B and H must have been calculated before. store writes
+    the result of solve to the network.
     """
 
-    snapshots = _as_snapshots(sub_network.network, snapshots)
     logger.info("Performing linear load-flow on %s sub-network %s for snapshot(s) %s",
                 sub_network.network.sub_networks.at[sub_network.name,"carrier"], sub_network, snapshots)
 
     network = sub_network.network
 
-
-    if not skip_pre:
-        calculate_dependent_values(network)
-        find_bus_controls(sub_network)
-        _allocate_pf_outputs(network, linear=True)
-
-
     # get indices for the components on this subnetwork
     buses_o = sub_network.buses_o
     branches_i = sub_network.branches_i()
@@ -953,40 +1689,108 @@ def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
              for c in network.iterate_components(network.controllable_branch_components)
              for i in [int(col[3:]) for col in c.df.columns if col[:3] == "bus"]])
 
-    if not skip_pre and len(branches_i) > 0:
+    p = network.buses_t['p'].loc[snapshots, buses_o].values
+
+    def solve():
+        v_diff = np.zeros((len(snapshots), len(buses_o)))
+        if len(branches_i) > 0:
+            p_shifted = p - sub_network.p_bus_shift
+            v_diff[:,1:] = factorize_B(sub_network).solve(np.ascontiguousarray(p_shifted[:,1:].T)).T
+        return v_diff
+
+    def store(v_diff):
+        if len(branches_i) > 0:
+            flows = pd.DataFrame(v_diff * sub_network.H.T,
+                                 columns=branches_i, index=snapshots) + sub_network.p_branch_shift
+
+            for c in sub_network.iterate_components(network.passive_branch_components):
+                f = flows.loc[:, c.name]
+                c.pnl.p0.loc[snapshots, f.columns] = f
+                c.pnl.p1.loc[snapshots, f.columns] = -f
+
+        if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
+            network.buses_t.v_mag_pu.loc[snapshots, buses_o] = 1 + v_diff
+            network.buses_t.v_ang.loc[snapshots, buses_o] = 0.
+        else:
+            network.buses_t.v_ang.loc[snapshots, buses_o] = v_diff
+            network.buses_t.v_mag_pu.loc[snapshots, buses_o] = 1.
+
+        # set slack bus power to pick up remained
+        slack_adjustment = (- network.buses_t.p.loc[snapshots, buses_o[1:]].sum(axis=1).fillna(0.)
+                            - network.buses_t.p.loc[snapshots, buses_o[0]])
+        network.buses_t.p.loc[snapshots, buses_o[0]] += slack_adjustment
+
+        # let slack generator take up the slack
+        if sub_network.slack_generator is not None:
+            network.generators_t.p.loc[snapshots, sub_network.slack_generator] += slack_adjustment
+
+    return solve, store
+
+def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
+    """
+    Linear power flow for connected sub-network.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+
+    Returns
+    -------
+    None
+    """
+
+    snapshots = _as_snapshots(sub_network.network, snapshots)
+
+    network = sub_network.network
+
+
+    if not skip_pre:
+        calculate_dependent_values(network)
+        find_bus_controls(sub_network)
+        _allocate_pf_outputs(network, linear=True)
+
+
+    if not skip_pre and len(sub_network.branches_i()) > 0:
         calculate_B_H(sub_network, skip_pre=True)
 
-    v_diff = np.zeros((len(snapshots), len(buses_o)))
-    if len(branches_i) > 0:
-        p = network.buses_t['p'].loc[snapshots, buses_o].values - sub_network.p_bus_shift
-        v_diff[:,1:] = spsolve(sub_network.B[1:, 1:], p[:,1:].T).T
-        flows = pd.DataFrame(v_diff * sub_network.H.T,
-                             columns=branches_i, index=snapshots) + sub_network.p_branch_shift
+    solve, store = _sub_network_lpf_setup(sub_network, snapshots)
 
-        for c in sub_network.iterate_components(network.passive_branch_components):
-            f = flows.loc[:, c.name]
-            c.pnl.p0.loc[snapshots, f.columns] = f
-            c.pnl.p1.loc[snapshots, f.columns] = -f
+    store(solve())
 
-    if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
-        network.buses_t.v_mag_pu.loc[snapshots, buses_o] = 1 + v_diff
-        network.buses_t.v_ang.loc[snapshots, buses_o] = 0.
-    else:
-        network.buses_t.v_ang.loc[snapshots, buses_o] = v_diff
-        network.buses_t.v_mag_pu.loc[snapshots, buses_o] = 1.
 
-    # set slack bus power to pick up remained
-    slack_adjustment = (- network.buses_t.p.loc[snapshots, buses_o[1:]].sum(axis=1).fillna(0.)
-                        - network.buses_t.p.loc[snapshots, buses_o[0]])
-    network.buses_t.p.loc[snapshots, buses_o[0]] += slack_adjustment
 
-    # let slack generator take up the slack
-    if sub_network.slack_generator is not None:
-        network.generators_t.p.loc[snapshots, sub_network.slack_generator] += slack_adjustment
+def network_batch_lpf(network, snapshots=None, skip_pre=False, n_threads=1):
+    """
+    Batched linear power flow for several snapshots.
 
+    For each sub-network the reduced susceptance matrix is factorized
+    once (see factorize_B) and the voltage angles of all snapshots are
+    found in a single solve with one right-hand side per snapshot. The
+    factorization is cached in network._matrix_cache, so that further
+    calls on the same topology and impedances, e.g. for single
+    snapshots with network.lpf, reuse it.
 
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to network.snapshots
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+    n_threads : int, default 1
+        Number of threads in which the susceptance matrices of the
+        sub-networks are calculated and factorized and their flows
+        solved concurrently.
 
-def network_batch_lpf(network,snapshots=None):
-    """Batched linear power flow with numpy.dot for several snapshots."""
+    Returns
+    -------
+    None
+    """
 
-    raise NotImplementedError("Batch linear power flow not supported yet.")
+    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=True, n_threads=n_threads)
@@ -0,0 +1,256 @@
+## Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Record wall time, CPU time and memory usage of the stages of an
+optimisation, e.g. of each ``define_*`` function, of writing the
+problem file, of the solver run and of extracting the results.
+
+After ``network.lopf`` or ``network.sclopf`` the profile is available
+as ``network.profile``; it can be dumped as JSON or in the Chrome
+trace event format, which can be opened with chrome://tracing or
+https://ui.perfetto.dev.
+
+"""
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+
+__author__ = "Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS)"
+__copyright__ = "Copyright 2019 Tom Brown (KIT, FIAS), Jonas Hoersch (KIT, FIAS), GNU GPL 3"
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _cpu_time():
+    """User and system CPU time of the process and its finished
+    children (e.g. a solver binary) in seconds."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+def _peak_rss():
+    """Peak resident set size of the process in bytes, or None."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else 1024 * maxrss
+
+def _rss():
+    """Current resident set size of the process in bytes.
+
+    Read from /proc on Linux, else from psutil if it is installed,
+    else the peak resident set size is used instead."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return _peak_rss()
+
+
+class Profile(object):
+    """
+    Wall time, CPU time and memory usage of the stages of a run.
+
+    Each stage is recorded as a dictionary with the keys ``name``,
+    ``start`` (wall time in seconds since the start of the profile),
+    ``wall``, ``cpu`` (in seconds), ``rss`` (resident set size after
+    the stage), ``rss_delta`` (change of the resident set size during
+    the stage), ``peak_rss`` (peak resident set size of the process
+    after the stage, all in bytes) and ``depth`` (nesting level).
+
+    Parameters
+    ----------
+    name : string
+        Name of the run, e.g. "lopf"
+
+    Examples
+    --------
+    >>> network.lopf()
+    >>> network.profile.to_dataframe()
+    >>> network.profile.to_chrome_trace("lopf.trace.json")
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.active = False
+        self._depth = 0
+        self._wall0 = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording the stage `name`."""
+
+        record = dict(name=name, start=time.time() - self._wall0, depth=self._depth)
+        self.stages.append(record)
+        self._depth += 1
+
+        rss = _rss()
+        cpu = _cpu_time()
+        wall = time.time()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.time() - wall
+            record["cpu"] = _cpu_time() - cpu
+            record["rss"] = _rss()
+            record["rss_delta"] = (None if rss is None or record["rss"] is None
+                                   else record["rss"] - rss)
+            record["peak_rss"] = _peak_rss()
+            self._depth -= 1
+
+    @property
+    def wall(self):
+        """Total wall time of the top-level stages in seconds."""
+        return sum(s.get("wall", 0.) for s in self.stages if s["depth"] == 0)
+
+    def to_dataframe(self):
+        """Return the stages as a pandas.DataFrame."""
+        return pd.DataFrame(self.stages,
+                            columns=["name", "depth", "start", "wall", "cpu",
+                                     "rss", "rss_delta", "peak_rss"])
+
+    def to_dict(self):
+        return dict(name=self.name, wall=self.wall, stages=self.stages)
+
+    def to_json(self, filename=None):
+        """Dump the profile as JSON to `filename` or return it as a
+        string if `filename` is None."""
+        if filename is None:
+            return json.dumps(self.to_dict(), indent=1)
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def to_chrome_trace(self, filename=None):
+        """Dump the profile in the Chrome trace event format to
+        `filename` or return it as a string if `filename` is None.
+
+        Each stage is a complete event; the resident set size is added
+        as a counter."""
+
+        pid = os.getpid()
+        events = []
+        for s in self.stages:
+            events.append(dict(name=s["name"], cat=self.name, ph="X", pid=pid, tid=0,
+                               ts=1e6 * s["start"], dur=1e6 * s.get("wall", 0.),
+                               args={k: s.get(k) for k in ["cpu", "rss_delta", "peak_rss"]}))
+            if s.get("rss") is not None:
+                events.append(dict(name="rss", ph="C", pid=pid, tid=0,
+                                   ts=1e6 * (s["start"] + s.get("wall", 0.)),
+                                   args=dict(rss=s["rss"])))
+        trace = dict(traceEvents=events, displayTimeUnit="ms")
+
+        if filename is None:
+            return json.dumps(trace)
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+    def dump(self, filename, format="json"):
+        """Dump the profile to `filename` in `format`, which must be one
+        of ["json", "chrome"]."""
+        if format == "json":
+            self.to_json(filename)
+        elif format == "chrome":
+            self.to_chrome_trace(filename)
+        else:
+            raise ValueError("format must be one of 'json' or 'chrome', not {}".format(format))
+
+    def __repr__(self):
+        return "Profile {} with {} stages in {:.3f} s".format(self.name, len(self.stages), self.wall)
+
+
+@contextmanager
+def stage(profile, name):
+    """Record the stage `name` in `profile`, if it is not None."""
+    if profile is None:
+        yield None
+    else:
+        with profile.stage(name) as record:
+            yield record
+
+def active_profile(network):
+    """Return the profile of `network` if it is being recorded, else None."""
+    profile = getattr(network, "profile", None)
+    return profile if profile is not None and profile.active else None
+
+def profiled(profile, func, *args, **kwargs):
+    """Call func(*args, **kwargs) as a stage named after func."""
+    with stage(profile, func.__name__):
+        return func(*args, **kwargs)
+
+@contextmanager
+def profiling(network, name, profile_file=None, profile_format="json"):
+    """
+    Attach a new Profile to ``network.profile`` and record the block
+    as its top-level stage `name`.
+
+    If a profile of the network is already active (e.g. for a lopf
+    within a sclopf) the block is recorded as a stage of it instead.
+    If `profile_file` is given, the profile is dumped to it in
+    `profile_format` afterwards (see Profile.dump).
+    """
+
+    profile = active_profile(network)
+    if profile is not None:
+        with profile.stage(name):
+            yield profile
+        return
+
+    network.profile = profile = Profile(name)
+    profile.active = True
+    try:
+        with profile.stage(name):
+            yield profile
+    finally:
+        profile.active = False
+
+    if profile_file is not None:
+        profile.dump(profile_file, profile_format)
+        logger.info("Wrote profile of %s to %s", name, profile_file)
+
+def patch_optsolver_profile(opt, profile):
+    """Record writing the problem file, the solver run and reading the
+    solution of the pyomo solver `opt` as stages of `profile`."""
+
+    def wrap(orig, name):
+        def wrapper(*args, **kwargs):
+            with stage(profile, name):
+                return orig(*args, **kwargs)
+        return wrapper
+
+    for method, name in [("_presolve", "write_problem"),
+                         ("_apply_solver", "solve"),
+                         ("_postsolve", "read_solution")]:
+        orig = getattr(opt, method, None)
+        if orig is not None:
+            setattr(opt, method, wrap(orig, name))
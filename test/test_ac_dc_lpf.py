@@ -3,6 +3,7 @@ from __future__ import absolute_import
 
 import pypsa
 
+import copy
 import datetime
 import pandas as pd
 
@@ -44,5 +45,155 @@ def test_lpf():
     np.testing.assert_array_almost_equal(network.links_t.p0[network.links.index],network_r.links_t.p0[network.links.index])
 
 
+def test_batch_lpf():
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name, "results-lpf")
+
+    network_r = pypsa.Network(results_folder_name)
+
+    pypsa.pf.network_batch_lpf(network)
+
+    np.testing.assert_array_almost_equal(network.generators_t.p[network.generators.index],network_r.generators_t.p[network.generators.index])
+    np.testing.assert_array_almost_equal(network.lines_t.p0[network.lines.index],network_r.lines_t.p0[network.lines.index])
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang[network.buses.index],network_r.buses_t.v_ang[network.buses.index])
+
+    factors = {sn.name : pypsa.pf.factorize_B(sn) for sn in network.sub_networks.obj if len(sn.branches_i()) > 0}
+    assert len(factors) > 0
+
+    #further power flows on the same grid reuse the factorization
+    for snapshot in network.snapshots[:2]:
+        network.lpf(snapshot)
+
+    for sn in network.sub_networks.obj:
+        if sn.name in factors:
+            assert pypsa.pf.factorize_B(sn) is factors[sn.name]
+
+    #changing an impedance invalidates it
+    network.lines.loc[network.lines.index[0], "x"] *= 2
+    network.lpf(network.snapshots[0])
+
+    sn = network.sub_networks.at[network.lines.sub_network.iat[0], "obj"]
+    assert pypsa.pf.factorize_B(sn) is not factors[sn.name]
+
+
+def test_lpf_n_threads():
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name, "results-lpf")
+
+    network_r = pypsa.Network(results_folder_name)
+
+    #the AC and DC sub-networks are solved in separate threads
+    network.lpf(n_threads=3)
+
+    assert len(network.sub_networks) > 1
+
+    np.testing.assert_array_almost_equal(network.generators_t.p[network.generators.index],network_r.generators_t.p[network.generators.index])
+    np.testing.assert_array_almost_equal(network.lines_t.p0[network.lines.index],network_r.lines_t.p0[network.lines.index])
+    np.testing.assert_array_almost_equal(network.links_t.p0[network.links.index],network_r.links_t.p0[network.links.index])
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang[network.buses.index],network_r.buses_t.v_ang[network.buses.index])
+
+
+def test_matrix_cache():
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    network.lpf(network.snapshots[0])
+
+    matrices = {sn.name : (sn.B, sn.H) for sn in network.sub_networks.obj if len(sn.branches_i()) > 0}
+
+    #an unchanged grid reuses the matrices
+    network.lpf(network.snapshots[0])
+
+    for sn in network.sub_networks.obj:
+        if sn.name in matrices:
+            assert sn.B is matrices[sn.name][0]
+            assert sn.H is matrices[sn.name][1]
+
+    #changing the reactance of one line patches B, which is the same
+    #as building it from scratch
+    line = network.lines.index[0]
+    network.lines.loc[line, "x"] *= 2
+    network.lpf(network.snapshots[0])
+
+    sn = network.sub_networks.at[network.lines.at[line, "sub_network"], "obj"]
+    B, H = sn.B, sn.H
+    assert B is not matrices[sn.name][0]
+
+    network._matrix_cache.clear()
+    pypsa.pf.calculate_B_H(sn)
+
+    np.testing.assert_array_almost_equal(B.toarray(), sn.B.toarray())
+    np.testing.assert_array_almost_equal(H.toarray(), sn.H.toarray())
+
+    p0 = network.lines_t.p0.loc[network.snapshots[0]].copy()
+    network.lpf(network.snapshots[0])
+    np.testing.assert_array_almost_equal(network.lines_t.p0.loc[network.snapshots[0]], p0)
+
+    #after _max_matrix_patches patches in a row B is rebuilt, and
+    #the patched B has no explicit zeros
+    key = (("B_H", "x_pu_eff"), sn.name)
+    for i in range(pypsa.pf._max_matrix_patches + 1):
+        network.lines.loc[line, "x"] *= 1.1
+        network.lpf(network.snapshots[0])
+        sn = network.sub_networks.at[network.lines.at[line, "sub_network"], "obj"]
+        assert sn.B.nnz == np.count_nonzero(sn.B.toarray())
+        assert network._matrix_cache[key]["patches"] == (i + 1) % (pypsa.pf._max_matrix_patches + 1)
+
+    #the cached factorizations cannot be copied, so copies start with
+    #an empty cache
+    pypsa.pf.network_batch_lpf(network)
+    network_copy = copy.deepcopy(network)
+    assert len(network._matrix_cache) > 0 and len(network_copy._matrix_cache) == 0
+
+    network_copy.lpf(network.snapshots[0])
+    np.testing.assert_array_almost_equal(network_copy.lines_t.p0.loc[network.snapshots[0]],
+                                         network.lines_t.p0.loc[network.snapshots[0]])
+
+
+def test_factorize_B_orderings():
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/scigrid-de/scigrid-with-load-gen-trafos")
+
+    network = pypsa.Network(csv_folder_name)
+
+    network.lpf(network.snapshots[0])
+
+    sub_network = max(network.sub_networks.obj, key=lambda sn: len(sn.buses_i()))
+
+    B = sub_network.B[1:,1:].toarray()
+    b = np.random.RandomState(0).randn(B.shape[0], 3)
+
+    #the permutations are internal, the solution is ordered like buses_o
+    for ordering in ["mmd", "rcm", "colamd"]:
+        lu = pypsa.pf.factorize_B(sub_network, ordering=ordering)
+        np.testing.assert_array_almost_equal(B.dot(lu.solve(b)), b)
+
+    #the symmetric minimum degree ordering is the default and has
+    #less fill-in than the column ordering
+    def fill_in(lu):
+        return lu.L.nnz + lu.U.nnz
+
+    colamd = fill_in(pypsa.pf.factorize_B(sub_network, ordering="colamd"))
+    assert fill_in(pypsa.pf.factorize_B(sub_network)) < colamd
+
+    #a matrix with tiny diagonal entries, like B with negative
+    #reactances, needs off-diagonal pivots
+    A = np.array([[1e-12, 1., 0.], [1., 1e-12, 1.], [0., 1., 2.]])
+    b = np.array([1., 2., 3.])
+    for ordering in ["mmd", "rcm"]:
+        lu = pypsa.pf._factorize_symmetric(A, ordering)
+        np.testing.assert_array_almost_equal(A.dot(lu.solve(b)), b, decimal=10)
+
+
 if __name__ == "__main__":
     test_lpf()
+    test_batch_lpf()
+    test_lpf_n_threads()
+    test_matrix_cache()
+    test_factorize_B_orderings()
@@ -0,0 +1,239 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import numpy as np
+
+import os
+
+
+
+def get_network():
+
+    network = pypsa.Network()
+
+    network.set_snapshots(range(6))
+
+    n_buses = 6
+
+    for i in range(n_buses):
+        network.add("Bus", "Bus {}".format(i), v_nom=20.)
+
+    for i in range(n_buses):
+        network.add("Line", "Line {}".format(i), bus0="Bus {}".format(i),
+                    bus1="Bus {}".format((i+1)%n_buses), x=0.1, r=0.01)
+
+    network.add("Generator", "Slack", bus="Bus 0", control="Slack")
+    network.add("Generator", "PV", bus="Bus 3", control="PV",
+                p_set=np.linspace(20., 70., len(network.snapshots)))
+
+    for i in [1, 2, 4, 5]:
+        network.add("Load", "Load {}".format(i), bus="Bus {}".format(i),
+                    p_set=10. + 5.*i*np.arange(len(network.snapshots)),
+                    q_set=2. + np.arange(len(network.snapshots)))
+
+    return network
+
+
+def test_pf_n_jobs():
+
+    network = get_network()
+
+    info = network.pf()
+
+    assert info.converged.all().all()
+
+    v_mag_pu = network.buses_t.v_mag_pu.copy()
+    v_ang = network.buses_t.v_ang.copy()
+    p0 = network.lines_t.p0.copy()
+    q = network.generators_t.q.copy()
+
+    network = get_network()
+
+    info_parallel = network.pf(n_jobs=2)
+
+    np.testing.assert_array_equal(info_parallel.n_iter, info.n_iter)
+
+    np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+    np.testing.assert_array_almost_equal(network.lines_t.p0, p0)
+    np.testing.assert_array_almost_equal(network.generators_t.q, q)
+
+
+
+def test_pf_fdlf():
+
+    for variant in ["XB", "BX"]:
+        network = get_network()
+
+        network.pf()
+
+        v_mag_pu = network.buses_t.v_mag_pu.copy()
+        v_ang = network.buses_t.v_ang.copy()
+        q0 = network.lines_t.q0.copy()
+
+        network = get_network()
+
+        info = network.pf(algorithm="fdlf", fdlf_variant=variant)
+
+        assert info.converged.all().all()
+
+        np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+        np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+        np.testing.assert_array_almost_equal(network.lines_t.q0, q0, decimal=4)
+
+    #with a low X/R ratio the fast-decoupled load flow does not
+    #converge and Newton-Raphson takes over
+    network = get_network()
+    network.lines.r = 0.3
+    snapshots = network.snapshots[:2]
+
+    info_newton = network.pf(snapshots)
+    info = network.pf(snapshots, algorithm="fdlf")
+
+    assert info.converged.all().all()
+    np.testing.assert_array_equal(info.n_iter, info_newton.n_iter)
+
+
+
+def test_pf_jacobian_reuse():
+
+    network = get_network()
+
+    info = network.pf()
+
+    v_mag_pu = network.buses_t.v_mag_pu.copy()
+    v_ang = network.buses_t.v_ang.copy()
+
+    network = get_network()
+
+    #dishonest Newton-Raphson needs more iterations but finds the same solution
+    info_reuse = network.pf(jacobian_reuse=3)
+
+    assert info_reuse.converged.all().all()
+    assert (info_reuse.n_iter >= info.n_iter).all().all()
+
+    np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+
+
+
+def test_pf_seed_previous():
+
+    network = get_network()
+
+    info = network.pf()
+
+    v_mag_pu = network.buses_t.v_mag_pu.copy()
+    v_ang = network.buses_t.v_ang.copy()
+
+    for algorithm in ["newton", "fdlf"]:
+        network = get_network()
+
+        info_previous = network.pf(use_seed="previous", algorithm=algorithm)
+
+        assert info_previous.converged.all().all()
+
+        np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+        np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+
+    #with slowly changing loads the snapshots after the first one
+    #need fewer iterations from the solution of their predecessor
+    network = get_network()
+    network.loads_t.p_set.loc[:,:] = 30. + 0.5*np.arange(len(network.snapshots))[:,np.newaxis]
+
+    info = network.pf()
+    info_previous = network.pf(use_seed="previous")
+
+    assert (info_previous.n_iter.iloc[0] == info.n_iter.iloc[0]).all()
+    assert (info_previous.n_iter.iloc[1:] < info.n_iter.iloc[1:]).all().all()
+
+
+
+def test_pf_n_threads():
+
+    def get_islands():
+        #removing two lines splits the ring into two sub-networks
+        network = get_network()
+        network.remove("Line", "Line 0")
+        network.remove("Line", "Line 3")
+        return network
+
+    network = get_islands()
+
+    info = network.pf()
+
+    assert len(network.sub_networks) == 2
+    assert info.converged.all().all()
+
+    v_mag_pu = network.buses_t.v_mag_pu.copy()
+    v_ang = network.buses_t.v_ang.copy()
+    q0 = network.lines_t.q0.copy()
+    p = network.generators_t.p.copy()
+
+    network = get_islands()
+
+    info_threads = network.pf(n_threads=2)
+
+    np.testing.assert_array_equal(info_threads.n_iter, info.n_iter)
+
+    np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+    np.testing.assert_array_almost_equal(network.lines_t.q0, q0)
+    np.testing.assert_array_almost_equal(network.generators_t.p, p)
+
+    #the fast-decoupled matrices are built in the threads as well
+    network = get_islands()
+
+    info_fdlf = network.pf(algorithm="fdlf", n_threads=2)
+
+    assert info_fdlf.converged.all().all()
+
+    np.testing.assert_array_almost_equal(network.buses_t.v_mag_pu, v_mag_pu)
+    np.testing.assert_array_almost_equal(network.buses_t.v_ang, v_ang)
+
+
+
+def test_pf_matrix_cache():
+
+    network = get_network()
+
+    network.pf()
+
+    Y = network.sub_networks.obj.iat[0].Y
+
+    #an unchanged grid reuses the admittance matrix (the sub-networks
+    #themselves are rebuilt by each call)
+    network.pf()
+
+    assert network.sub_networks.obj.iat[0].Y is Y
+
+    #changing one line patches Y, which is the same as building it
+    #from scratch
+    network.lines.loc["Line 2", "r"] = 0.05
+    network.lines.loc["Line 4", "b"] = 1e-4
+
+    info = network.pf()
+
+    assert info.converged.all().all()
+
+    sub_network = network.sub_networks.obj.iat[0]
+    Y0, Y1, Y = sub_network.Y0, sub_network.Y1, sub_network.Y
+
+    network._matrix_cache.clear()
+    pypsa.pf.calculate_Y(sub_network)
+
+    np.testing.assert_array_almost_equal(Y.toarray(), sub_network.Y.toarray())
+    np.testing.assert_array_almost_equal(Y0.toarray(), sub_network.Y0.toarray())
+    np.testing.assert_array_almost_equal(Y1.toarray(), sub_network.Y1.toarray())
+
+
+
+if __name__ == "__main__":
+    test_pf_n_jobs()
+    test_pf_fdlf()
+    test_pf_jacobian_reuse()
+    test_pf_seed_previous()
+    test_pf_n_threads()
+    test_pf_matrix_cache()
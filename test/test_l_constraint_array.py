@@ -0,0 +1,53 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+from pypsa.opt import l_constraint, l_constraint_array
+
+from pyomo.environ import ConcreteModel, Var
+
+import numpy as np
+
+import scipy.sparse
+
+
+
+def test_l_constraint_array():
+
+    model = ConcreteModel()
+
+    model.x = Var(range(3))
+
+    x = np.array([model.x[i] for i in range(3)], dtype=object)
+
+    coeffs = np.array([[1., -2., 0.],
+                       [0., 3., 4.]])
+
+    l_constraint(model, "dict", {0 : [[(1., x[0]), (-2., x[1])], "<=", 5.],
+                                 1 : [[(3., x[1]), (4., x[2])], ">=", -1.]},
+                 [0, 1])
+
+    l_constraint_array(model, "dense", [0, 1], np.vstack((x, x)), coeffs,
+                       np.array(["<=", ">="]), [5., -1.])
+
+    l_constraint_array(model, "sparse", [0, 1], x, scipy.sparse.csr_matrix(coeffs),
+                       ["<=", ">="], np.array([5., -1.]))
+
+    for name in ["dense", "sparse"]:
+        for i in [0, 1]:
+            a = model.dict[i]
+            b = getattr(model, name)[i]
+            assert str(a.body) == str(b.body)
+            assert a.lower == b.lower
+            assert a.upper == b.upper
+
+    #variables set to None are skipped
+    l_constraint_array(model, "fixed", [(0, "a")], np.array([[x[0], None]], dtype=object),
+                       1., "==", 2.)
+
+    assert str(model.fixed[0, "a"].body) == str(model.x[0])
+    assert model.fixed[0, "a"].equality
+
+
+
+if __name__ == "__main__":
+    test_l_constraint_array()
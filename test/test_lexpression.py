@@ -0,0 +1,64 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+from pypsa.opt import LExpression, LConstraint, l_constraint
+
+from pyomo.environ import ConcreteModel, Var
+
+
+
+def test_lexpression():
+
+    model = ConcreteModel()
+
+    model.x = Var(range(3))
+
+    x = model.x
+
+    e = LExpression([(1., x[0])], 2.)
+
+    f = e
+
+    e += LExpression([(3., x[1])], 1.)
+
+    #accumulation is in place
+    assert f is e
+    assert list(e.coeffs) == [1., 3.]
+    assert e.vars == [x[0], x[1]]
+    assert e.constant == 3.
+
+    e.add_term(-1., x[2])
+    e.variables.append((4., x[0]))
+
+    assert len(e) == 4
+    assert e.variables[3] == (4., x[0])
+
+    #arithmetic returns new expressions
+    g = 2*e + 1.
+
+    assert list(g.coeffs) == [2., 6., -2., 8.]
+    assert g.constant == 7.
+    assert len(e) == 4
+
+    h = -e
+
+    assert list(h.coeffs) == [-1., -3., 1., -4.]
+
+    #assigning the terms of an expression to itself keeps them
+    e.variables = e.variables
+
+    assert len(e) == 4
+    assert e.variables[3] == (4., x[0])
+
+    assert not hasattr(e, "__dict__")
+    assert not hasattr(LConstraint(), "__dict__")
+
+    l_constraint(model, "c", {0 : LConstraint(e, "<=", LExpression([(1., x[1])], 5.))}, [0])
+
+    assert model.c[0].upper() == 2.
+    assert str(model.c[0].body) == "x[0] + 3.0*x[1] - x[2] + 4.0*x[0] - x[1]"
+
+
+
+if __name__ == "__main__":
+    test_lexpression()
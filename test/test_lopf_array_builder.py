@@ -0,0 +1,189 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import pandas as pd
+
+import numpy as np
+
+import os
+
+
+
+def test_ac_dc_lopf():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lopf")
+
+    network_r = pypsa.Network(results_folder_name)
+
+    solver_name = "cbc"
+
+    snapshots = network.snapshots
+
+    for formulation in ["angles", "cycles", "kirchhoff", "ptdf"]:
+        network.lopf(snapshots=snapshots,solver_name=solver_name,formulation=formulation,builder="pyomo")
+
+        objective = network.objective
+        marginal_price = network.buses_t.marginal_price.copy()
+        mu = network.global_constraints.mu.copy()
+
+        network.lopf(snapshots=snapshots,solver_name=solver_name,formulation=formulation,builder="array")
+
+        np.testing.assert_almost_equal(network.objective,objective,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price,marginal_price,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.global_constraints.mu,mu,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.generators_t.p.loc[:,network.generators.index],network_r.generators_t.p.loc[:,network.generators.index],decimal=4)
+
+        np.testing.assert_array_almost_equal(network.lines_t.p0.loc[:,network.lines.index],network_r.lines_t.p0.loc[:,network.lines.index],decimal=4)
+
+        np.testing.assert_array_almost_equal(network.links_t.p0.loc[:,network.links.index],network_r.links_t.p0.loc[:,network.links.index],decimal=4)
+
+        #the solution grids are shaped like the output frames
+        p = network.lp.get_value_grid("generator_p")
+        assert p.index.equals(snapshots)
+        np.testing.assert_array_almost_equal(p.loc[:,network.generators.index],network.generators_t.p.loc[:,network.generators.index])
+
+
+def test_unit_commitment():
+
+    nu = pypsa.Network()
+
+    nu.set_snapshots(range(6))
+
+    nu.add("Bus","bus")
+
+    nu.add("Generator","coal",bus="bus",
+           committable=True,
+           p_min_pu=0.3,
+           marginal_cost=20,
+           min_down_time=2,
+           start_up_cost=100,
+           shut_down_cost=30,
+           ramp_limit_up=0.5,
+           ramp_limit_down=0.6,
+           ramp_limit_start_up=0.4,
+           p_nom=10000)
+
+    nu.add("Generator","gas",bus="bus",
+           committable=True,
+           marginal_cost=70,
+           p_min_pu=0.1,
+           initial_status=0,
+           min_up_time=3,
+           p_nom=1000)
+
+    nu.add("Generator","wind",bus="bus",
+           p_nom_extendable=True,
+           p_nom_max=3000,
+           capital_cost=10,
+           p_max_pu=[0.1,0.5,0.9,0.3,0.2,0.7],
+           ramp_limit_up=0.3)
+
+    nu.add("StorageUnit","hydro",bus="bus",
+           p_nom=300,
+           max_hours=2,
+           inflow=[0,100,0,200,0,0],
+           state_of_charge_set=[np.nan,np.nan,200,np.nan,np.nan,np.nan])
+
+    nu.add("Store","store",bus="bus",
+           e_nom_extendable=True,
+           capital_cost=2,
+           standing_loss=0.02,
+           e_initial=50)
+
+    nu.add("Load","load",bus="bus",p_set=[4000,800,5000,3000,6000,2000])
+
+    solver_name = "cbc"
+
+    nu.lopf(nu.snapshots,solver_name=solver_name,builder="pyomo")
+
+    objective = nu.objective
+    status = nu.generators_t.status.copy()
+
+    nu.lopf(nu.snapshots,solver_name=solver_name,builder="array")
+
+    np.testing.assert_almost_equal(nu.objective,objective,decimal=4)
+
+    np.testing.assert_array_almost_equal(nu.generators_t.status,status)
+
+
+def test_multi_output_links():
+
+    override_component_attrs = pypsa.descriptors.Dict({k : v.copy() for k,v in pypsa.components.component_attrs.items()})
+    override_component_attrs["Link"].loc["bus2"] = ["string",np.nan,np.nan,"2nd bus","Input (optional)"]
+    override_component_attrs["Link"].loc["efficiency2"] = ["static or series","per unit",1.,"2nd bus efficiency","Input (optional)"]
+    override_component_attrs["Link"].loc["p2"] = ["series","MW",0.,"2nd bus output","Output"]
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name, override_component_attrs=override_component_attrs)
+
+    network.add("Bus","heat",carrier="heat")
+    network.add("Load","heat load",bus="heat",p_set=np.linspace(10,80,len(network.snapshots)))
+    network.add("Generator","boiler",bus="heat",p_nom=1000,marginal_cost=300)
+
+    network.add("Link","CHP",bus0="Manchester",bus1="London",bus2="heat",
+                efficiency=0.4,efficiency2=0.5,p_nom=1000,marginal_cost=1)
+
+    solver_name = "cbc"
+
+    for formulation in ["angles", "cycles", "kirchhoff", "ptdf"]:
+        network.lopf(solver_name=solver_name,formulation=formulation,builder="array")
+
+        objective = network.objective
+        marginal_price = network.buses_t.marginal_price.copy()
+
+        network.lopf(solver_name=solver_name,formulation=formulation,builder="pyomo")
+
+        np.testing.assert_almost_equal(network.objective,objective,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price,marginal_price,decimal=4)
+
+        #the heat load is supplied by the boiler and the CHP
+        np.testing.assert_array_almost_equal(network.generators_t.p.loc[:,"boiler"]
+                                             + 0.5*network.links_t.p0.loc[:,"CHP"],
+                                             network.loads_t.p.loc[:,"heat load"],decimal=4)
+
+
+def test_extra_postprocessing_duals():
+
+    from pyomo.environ import Constraint
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    snapshot = network.snapshots[0]
+    gen = network.generators.index[0]
+
+    def extra_functionality(network, snapshots):
+        network.model.extra_limit = Constraint(expr=network.model.generator_p[gen,snapshot] <= 1e6)
+
+    #the duals passed to extra_postprocessing are those of the pyomo
+    #model for either builder, including added constraints
+    for builder in ["pyomo", "array"]:
+        found = []
+
+        def extra_postprocessing(network, snapshots, duals):
+            found.append(network.model.power_balance[network.buses.index[0],snapshot] in duals.index)
+            found.append(network.model.extra_limit in duals.index)
+
+        network.lopf(solver_name="cbc",builder=builder,extra_functionality=extra_functionality,
+                     extra_postprocessing=extra_postprocessing)
+
+        assert found == [True, True]
+
+
+if __name__ == "__main__":
+    test_ac_dc_lopf()
+    test_unit_commitment()
+    test_multi_output_links()
+    test_extra_postprocessing_duals()
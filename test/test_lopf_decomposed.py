@@ -0,0 +1,111 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import pandas as pd
+
+import numpy as np
+
+import os
+
+
+
+def test_lopf_decomposed():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    assert pypsa.opf.snapshot_coupling(network) == ["global constraints", "extendable capacities"]
+
+    network.global_constraints.drop(network.global_constraints.index, inplace=True)
+    network.generators.p_nom_extendable = False
+    network.lines.s_nom_extendable = False
+    network.links.p_nom_extendable = False
+
+    assert pypsa.opf.snapshot_coupling(network) == []
+
+    solver_name = "cbc"
+
+    network.lopf(solver_name=solver_name)
+
+    objective = network.objective
+    marginal_price = network.buses_t.marginal_price.copy()
+
+    #the chunks solved one after the other give the reference for the flows
+    chunks = np.array_split(network.snapshots, 3)
+    for chunk in chunks:
+        network.lopf(chunk, solver_name=solver_name)
+
+    generators_p = network.generators_t.p.copy()
+    links_p0 = network.links_t.p0.copy()
+
+    network.buses_t.marginal_price.iloc[:] = 0.
+    network.generators_t.p.iloc[:] = 0.
+
+    status = network.lopf(solver_name=solver_name, n_jobs=3)
+
+    assert status == ("ok", "optimal")
+
+    np.testing.assert_almost_equal(network.objective/objective, 1., decimal=8)
+
+    np.testing.assert_array_almost_equal(network.buses_t.marginal_price, marginal_price, decimal=4)
+
+    np.testing.assert_array_almost_equal(network.generators_t.p, generators_p, decimal=4)
+
+    np.testing.assert_array_almost_equal(network.links_t.p0, links_p0, decimal=4)
+
+
+
+def test_lopf_decomposed_spawn():
+
+    import multiprocessing
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    network.global_constraints.drop(network.global_constraints.index, inplace=True)
+    network.generators.p_nom_extendable = False
+    network.lines.s_nom_extendable = False
+    network.links.p_nom_extendable = False
+
+    solver_name = "cbc"
+
+    network.lopf(solver_name=solver_name)
+
+    objective = network.objective
+    marginal_price = network.buses_t.marginal_price.copy()
+
+    #with the "spawn" start method (the default on macOS and Windows)
+    #everything sent to the processes is pickled
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        network.buses_t.marginal_price.iloc[:] = 0.
+
+        status = network.lopf(solver_name=solver_name, n_jobs=2)
+
+        assert status == ("ok", "optimal")
+        np.testing.assert_almost_equal(network.objective/objective, 1., decimal=8)
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price, marginal_price, decimal=4)
+
+        #a lambda cannot be pickled, so the chunks are solved one
+        #after the other
+        network.buses_t.marginal_price.iloc[:] = 0.
+
+        status = network.lopf(solver_name=solver_name, n_jobs=2,
+                              extra_functionality=lambda network, snapshots: None)
+
+        assert status == ("ok", "optimal")
+        np.testing.assert_almost_equal(network.objective/objective, 1., decimal=8)
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price, marginal_price, decimal=4)
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+
+if __name__ == "__main__":
+    test_lopf_decomposed()
+    test_lopf_decomposed_spawn()
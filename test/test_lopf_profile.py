@@ -0,0 +1,55 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import json
+
+import os
+
+import tempfile
+
+
+
+def test_lopf_profile():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    solver_name = "cbc"
+
+    for pyomo in [True, False]:
+        network.lopf(solver_name=solver_name, pyomo=pyomo)
+
+        profile = network.profile
+        stages = profile.to_dataframe().set_index("name")
+
+        for name in ["lopf", "define_generator_variables_constraints", "define_nodal_balances",
+                     "define_linear_objective", "write_problem", "solve", "read_solution",
+                     "extract_optimisation_results"]:
+            assert name in stages.index, name
+
+        assert not profile.active
+        assert (stages.wall >= 0).all() and (stages.cpu >= 0).all()
+        assert stages.at["lopf", "depth"] == 0
+        assert (stages.drop("lopf").depth > 0).all()
+        assert profile.wall == stages.at["lopf", "wall"]
+
+    fd, fn = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        network.lopf(solver_name=solver_name, profile_file=fn, profile_format="chrome")
+
+        with open(fn) as f:
+            trace = json.load(f)
+
+        names = [e["name"] for e in trace["traceEvents"] if e["ph"] == "X"]
+        assert names == [s["name"] for s in network.profile.stages]
+    finally:
+        os.remove(fn)
+
+
+
+if __name__ == "__main__":
+    test_lopf_profile()
@@ -0,0 +1,128 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import pandas as pd
+
+import numpy as np
+
+import os
+
+
+
+def get_network():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/opf-storage-hvdc/opf-storage-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    network.storage_units.p_nom_extendable = False
+    network.storage_units.p_nom = 500.
+    network.storage_units.cyclic_state_of_charge = False
+    network.storage_units.state_of_charge_initial = 1000.
+
+    #without fixed states of charge all windows have the same structure
+    network.storage_units_t.state_of_charge_set.loc[:, :] = np.nan
+
+    #capacities cannot be optimised in a rolling horizon, so fix them
+    #with some headroom above their optimum
+    network.lopf(solver_name="cbc")
+    for c, attr in [("generators", "p_nom"), ("lines", "s_nom"), ("links", "p_nom")]:
+        df = getattr(network, c)
+        df.loc[:, attr] = 2*df[attr + "_opt"]
+        df.loc[:, attr + "_extendable"] = False
+
+    return network
+
+
+def dispatch_cost(network):
+    weightings = network.snapshot_weightings
+    return ((network.generators_t.p*network.generators.marginal_cost).sum(axis=1)
+            + (network.storage_units_t.p.clip(lower=0)*network.storage_units.marginal_cost).sum(axis=1)
+            + (network.links_t.p0*network.links.marginal_cost).sum(axis=1)).multiply(weightings).sum()
+
+
+def test_lopf_rolling():
+
+    solver_name = "cbc"
+
+    network = get_network()
+
+    network.lopf(solver_name=solver_name)
+
+    objective = network.objective
+
+    #a single window is the same as the full optimisation
+    network.lopf_rolling(horizon=len(network.snapshots), solver_name=solver_name)
+
+    np.testing.assert_almost_equal(network.objective/objective,1.,decimal=8)
+
+    #the pyomo model of the first window is updated for the others
+    models = []
+    def record_model(network, snapshots, duals):
+        models.append(network.model)
+
+    statuses = network.lopf_rolling(horizon=4, overlap=2, solver_name=solver_name,
+                                    extra_postprocessing=record_model)
+
+    assert statuses == [("ok", "optimal")]*5
+    assert len(models) == 5 and all(model is models[0] for model in models)
+
+    #the objective is the cost of the kept dispatch, without the
+    #overlaps counted twice
+    assert len(network.window_objectives) == 5
+    np.testing.assert_almost_equal(network.objective/dispatch_cost(network),1.,decimal=6)
+    assert sum(network.window_objectives) > network.objective
+
+    #the initial state of charge is restored
+    np.testing.assert_array_almost_equal(network.storage_units.state_of_charge_initial, 1000.)
+
+    #the state of charge is continuous across the windows
+    su = network.storage_units
+    elapsed_hours = network.snapshot_weightings
+    soc = network.storage_units_t.state_of_charge
+    p = network.storage_units_t.p
+    previous = soc.shift(1)
+    previous.iloc[0] = su.state_of_charge_initial
+
+    standing = pd.DataFrame(np.power(1-su.standing_loss.values,elapsed_hours.values[:,np.newaxis]),
+                            index=soc.index,columns=su.index)
+
+    expected = (previous*standing
+                - (p.clip(upper=0)*su.efficiency_store).multiply(elapsed_hours,axis=0)
+                - (p.clip(lower=0)/su.efficiency_dispatch).multiply(elapsed_hours,axis=0)
+                + (network.storage_units_t.inflow.reindex(columns=su.index,fill_value=0.)
+                   - network.storage_units_t.spill).multiply(elapsed_hours,axis=0))
+
+    np.testing.assert_array_almost_equal(soc,expected,decimal=3)
+
+    #reusing the pyomo model gives the same result as building each window
+    objective = network.objective
+    soc = soc.copy()
+
+    network = get_network()
+    network.lopf_rolling(horizon=4, overlap=2, solver_name=solver_name, pyomo=False)
+
+    np.testing.assert_almost_equal(network.objective/objective,1.,decimal=6)
+
+    np.testing.assert_array_almost_equal(network.storage_units_t.state_of_charge,soc,decimal=3)
+
+
+def test_lopf_rolling_extendable():
+
+    network = get_network()
+    network.generators.p_nom_extendable = True
+
+    try:
+        network.lopf_rolling(horizon=4, solver_name="cbc")
+    except ValueError:
+        pass
+    else:
+        assert False, "extendable generators must be rejected"
+
+
+
+if __name__ == "__main__":
+    test_lopf_rolling()
+    test_lopf_rolling_extendable()
@@ -0,0 +1,114 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import pandas as pd
+
+import numpy as np
+
+import os
+
+
+
+def test_lopf_without_pyomo():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    solver_name = "cbc"
+
+    for formulation in ["angles", "kirchhoff"]:
+        network.lopf(solver_name=solver_name,formulation=formulation)
+
+        objective = network.objective
+        marginal_price = network.buses_t.marginal_price.copy()
+        mu_upper = network.lines_t.mu_upper.copy()
+        mu = network.global_constraints.mu.copy()
+        generators_p = network.generators_t.p.copy()
+
+        for solver_io in ["lp", "mps"]:
+            network.lopf(solver_name=solver_name,formulation=formulation,
+                         pyomo=False,solver_io=solver_io)
+
+            assert network.model is None
+
+            np.testing.assert_almost_equal(network.objective/objective,1.,decimal=8)
+
+            np.testing.assert_array_almost_equal(network.buses_t.marginal_price,marginal_price,decimal=4)
+
+            np.testing.assert_array_almost_equal(network.lines_t.mu_upper,mu_upper,decimal=4)
+
+            np.testing.assert_array_almost_equal(network.global_constraints.mu,mu,decimal=4)
+
+            np.testing.assert_array_almost_equal(network.generators_t.p,generators_p,decimal=4)
+
+
+
+def test_lopf_scipy_highs():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/ac-dc-meshed/ac-dc-data")
+
+    network = pypsa.Network(csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lopf")
+
+    network_r = pypsa.Network(results_folder_name)
+
+    for formulation in ["angles", "cycles", "kirchhoff", "ptdf"]:
+        network.lopf(solver_name="cbc",formulation=formulation)
+
+        objective = network.objective
+        mu_upper = network.lines_t.mu_upper.copy()
+        mu = network.global_constraints.mu.copy()
+        marginal_price = network.buses_t.marginal_price.copy()
+
+        network.lopf(solver_name="scipy-highs",formulation=formulation)
+
+        np.testing.assert_almost_equal(network.objective/objective,1.,decimal=8)
+
+        np.testing.assert_array_almost_equal(network.lines_t.mu_upper,mu_upper,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.global_constraints.mu,mu,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price,marginal_price,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.generators_t.p.loc[:,network.generators.index],network_r.generators_t.p.loc[:,network.generators.index],decimal=3)
+
+        np.testing.assert_array_almost_equal(network.lines_t.p0.loc[:,network.lines.index],network_r.lines_t.p0.loc[:,network.lines.index],decimal=3)
+
+
+
+def test_lopf_empty_constraint_infeasible():
+
+    #the power balance of a bus with only a load has no variables
+
+    network = pypsa.Network()
+    network.set_snapshots(range(2))
+    network.add("Bus", "a")
+    network.add("Bus", "b")
+    network.add("Generator", "gen", bus="a", p_nom=100, marginal_cost=10)
+    network.add("Load", "load a", bus="a", p_set=1)
+    network.add("Load", "load b", bus="b", p_set=50)
+
+    for solver_io in ["lp", "mps"]:
+        status, termination_condition = network.lopf(solver_name="cbc", pyomo=False,
+                                                     solver_io=solver_io)
+        assert termination_condition == "infeasible"
+
+    status, termination_condition = network.lopf(solver_name="scipy-highs")
+    assert termination_condition == "infeasible"
+
+    #without the load the constraint holds and is left out
+    network.loads.loc["load b", "p_set"] = 0.
+    status, termination_condition = network.lopf(solver_name="cbc", pyomo=False)
+    assert termination_condition == "optimal"
+    np.testing.assert_almost_equal(network.objective, 20.)
+
+
+
+if __name__ == "__main__":
+    test_lopf_without_pyomo()
+    test_lopf_scipy_highs()
+    test_lopf_empty_constraint_infeasible()
@@ -0,0 +1,188 @@
+from __future__ import print_function, division
+from __future__ import absolute_import
+
+import pypsa
+
+import numpy as np
+
+import os
+
+import tempfile
+
+import pandas as pd
+
+
+
+def get_network():
+
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/scigrid-de/scigrid-with-load-gen-trafos/")
+
+    return pypsa.Network(csv_folder_name)
+
+
+def test_lpf_contingency():
+
+    network = get_network()
+
+    snapshots = network.snapshots[:4]
+    branch_outages = network.lines.index[:5]
+
+    p0 = network.lpf_contingency(snapshots, branch_outages=branch_outages)
+
+    assert list(p0.index.names) == ["snapshot"] + list(network.passive_branches().index.names)
+    assert p0.shape == (len(snapshots)*len(network.passive_branches()), 1 + len(branch_outages))
+
+    #the stacked frames are the same as for single snapshots
+    for snapshot in snapshots:
+        p0_single = network.lpf_contingency(snapshot, branch_outages=branch_outages)
+        np.testing.assert_array_almost_equal(p0.xs(snapshot).values, p0_single.values)
+
+    #the flows after an outage are the same as for the lpf without the branch
+    outage = branch_outages[1]
+
+    network.remove("Line", outage)
+    network.lpf(snapshots)
+
+    for snapshot in snapshots:
+        p0_outage = p0.xs(snapshot)[("Line", outage)]["Line"].drop(outage)
+        np.testing.assert_array_almost_equal(p0_outage, network.lines_t.p0.loc[snapshot, p0_outage.index])
+
+
+def test_lpf_contingency_overloads():
+
+    network = get_network()
+
+    snapshots = network.snapshots[:5]
+    branch_outages = [("Line", l) for l in network.lines.index[:30]]
+    rating_factor = 0.7
+
+    p0 = network.lpf_contingency(snapshots, branch_outages=branch_outages)
+    s_nom = network.passive_branches().s_nom.reindex(p0.index.droplevel(0))
+    loading = p0.drop("base", axis=1).abs().div(s_nom.values, axis=0)
+
+    #outages which split the network are skipped
+    loading = loading.loc[:, np.isfinite(loading).all()]
+
+    overloads = network.lpf_contingency_overloads(snapshots, branch_outages=branch_outages,
+                                                  rating_factor=rating_factor,
+                                                  block_size=7, snapshot_block_size=2)
+
+    assert len(overloads) > 0
+    assert (overloads.loading > rating_factor).all()
+
+    #the overloads are exactly the entries of the full output above the rating
+    expected = {(snapshot, outage, branch_type, branch) : loading.at[(snapshot, branch_type, branch), outage]
+                for (snapshot, branch_type, branch), row in loading.iterrows()
+                for outage, value in row.iteritems() if value > rating_factor}
+
+    assert len(overloads) == len(expected)
+    for o in overloads.itertuples():
+        np.testing.assert_almost_equal(o.loading, expected[(o.snapshot, (o.outage_type, o.outage), o.branch_type, o.branch)])
+
+    #the same overloads are written to disk block by block
+    filename = os.path.join(tempfile.mkdtemp(), "overloads.csv")
+    n_overloads = network.lpf_contingency_overloads(snapshots, branch_outages=branch_outages,
+                                                    rating_factor=rating_factor,
+                                                    block_size=7, filename=filename)
+
+    assert n_overloads == len(overloads)
+    assert len(pd.read_csv(filename)) == n_overloads
+
+
+def test_lazy_BODF():
+
+    network = get_network()
+
+    network.lpf(network.snapshots[0])
+
+    sn = network.sub_networks.obj.iat[0]
+    sn.calculate_BODF()
+    bodf = sn.BODF
+
+    cache = os.path.join(tempfile.mkdtemp(), "bodf.npy")
+    sn.calculate_BODF(lazy=True, cache=cache)
+    lazy_bodf = sn.BODF
+
+    assert isinstance(lazy_bodf, pypsa.contingency.LazyBODF)
+    assert lazy_bodf.shape == bodf.shape
+
+    #compare the columns which do not split the network
+    columns = np.flatnonzero(np.isfinite(bodf).all(axis=0))[::10]
+    np.testing.assert_array_almost_equal(lazy_bodf[:, columns], bodf[:, columns])
+    np.testing.assert_array_almost_equal(lazy_bodf.columns(columns), bodf[:, columns])
+    np.testing.assert_almost_equal(lazy_bodf[5, columns[3]], bodf[5, columns[3]])
+
+    rows = np.arange(0, bodf.shape[0], 50)
+    np.testing.assert_array_almost_equal(lazy_bodf[rows, :][:, columns], bodf[rows][:, columns])
+    np.testing.assert_array_almost_equal(lazy_bodf[rows[1]][columns], bodf[rows[1], columns])
+
+    #the splitting outages are detected in the same way
+    assert (np.isfinite(lazy_bodf[:, :]).all(axis=0) == np.isfinite(bodf).all(axis=0)).all()
+
+    #the computed columns are kept in the memory-mapped cache
+    assert lazy_bodf._computed.all()
+    assert os.path.exists(cache)
+
+    #a new LazyBODF with the same cache reuses the computed columns
+    reopened = pypsa.contingency.LazyBODF(sn, cache=cache)
+    assert reopened._computed.all()
+    np.testing.assert_array_almost_equal(reopened[:, columns], bodf[:, columns])
+
+    #the contingency analysis uses sub_network.BODF
+    assert pypsa.contingency._lazy_bodf(sn) is lazy_bodf
+
+    #after a change of the sub-network the cache starts afresh
+    line = sn.lines_i()[0]
+    network.lines.loc[line, "num_parallel"] *= 2
+    network.lpf(network.snapshots[0])
+    sn = network.sub_networks.at[network.lines.at[line, "sub_network"], "obj"]
+    sn.calculate_BODF(lazy=True, cache=cache)
+    assert not sn.BODF._computed.any()
+    assert pypsa.contingency._lazy_bodf(sn) is sn.BODF
+
+
+def test_lpf_contingency_nk():
+
+    network = get_network()
+
+    snapshots = network.snapshots[:3]
+    lines = [("Line", l) for l in network.lines.index[:5]]
+
+    outage_sets = [[lines[0]], [lines[1], lines[2]], [lines[3], lines[4], ("Transformer", network.transformers.index[0])],
+                   [("Line", "1"), ("Line", "419")]]
+
+    p0 = network.lpf_contingency_nk(snapshots, outage_sets=outage_sets)
+
+    assert p0.shape == (len(snapshots)*len(network.passive_branches()), 1 + len(outage_sets))
+
+    #single outages are the same as for lpf_contingency
+    p0_single = network.lpf_contingency(snapshots, branch_outages=outage_sets[0] + outage_sets[3])
+    np.testing.assert_array_almost_equal(p0.iloc[:, 1], p0_single.iloc[:, 1])
+
+    #the parallel lines 1 and 419 only split the network together
+    assert np.isfinite(p0_single.iloc[:, 2:]).all().all()
+    assert np.isnan(p0.iloc[:, 4]).all()
+
+    #the flows after an outage set are the same as for the lpf without the branches
+    for outage_set in outage_sets[1:3]:
+        p0_outage = p0[tuple(outage_set)]
+
+        reduced = network.copy()
+        for c, name in outage_set:
+            reduced.remove(c, name)
+        reduced.lpf(snapshots)
+
+        for snapshot in snapshots:
+            for c, name in outage_set:
+                assert p0_outage[(snapshot, c, name)] == 0.
+            for c in ["Line", "Transformer"]:
+                p0_reduced = reduced.pnl(c).p0.loc[snapshot]
+                np.testing.assert_array_almost_equal(p0_outage.xs(snapshot)[c].loc[p0_reduced.index], p0_reduced)
+
+
+
+if __name__ == "__main__":
+    test_lpf_contingency()
+    test_lpf_contingency_overloads()
+    test_lazy_BODF()
+    test_lpf_contingency_nk()
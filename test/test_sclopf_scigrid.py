@@ -24,6 +24,11 @@ def test_sclopf():
 
     network.sclopf(network.snapshots[0],branch_outages=branch_outages,solver_name=solver_name)
 
+    #the lopf and the contingency constraints are stages of the sclopf profile
+    names = [s["name"] for s in network.profile.stages]
+    assert names[0] == "sclopf"
+    assert "calculate_BODF" in names and "lopf" in names and "add_contingency_constraints" in names
+
     #For the PF, set the P to the optimised P
     network.generators_t.p_set = network.generators_t.p.copy()
     network.generators.loc[:,'p_set_t'] = True
@@ -42,5 +47,48 @@ def test_sclopf():
     np.testing.assert_array_almost_equal(max_loading,np.ones((len(max_loading))))
 
 
+def test_sclopf_lazy():
+    csv_folder_name = os.path.join(os.path.dirname(__file__), "../examples/scigrid-de/scigrid-with-load-gen-trafos/")
+
+    network = pypsa.Network(csv_folder_name)
+
+    solver_name = "cbc"
+
+    for line_name in ["316","527","602"]:
+        network.lines.loc[line_name,"s_nom"] = 1200
+
+    branch_outages = network.lines.index[:3]
+
+    snapshots = network.snapshots[:2]
+
+    status = network.sclopf(snapshots,branch_outages=branch_outages,solver_name=solver_name)
+    assert status == ("ok", "optimal")
+    objective = network.objective
+    n_full = len(network.model.contingency_flow_upper) + len(network.model.contingency_flow_lower)
+
+    status = network.sclopf(snapshots,branch_outages=branch_outages,solver_name=solver_name,lazy=True)
+    assert status == ("ok", "optimal")
+
+    #only the violated contingency constraints are added
+    names = [s["name"] for s in network.profile.stages]
+    assert "screen_contingencies" in names and "add_contingency_constraints" in names
+    n_constraints = sum(len(getattr(network.model, "contingency_flow_{}".format(i)))
+                        for i in range(names.count("add_contingency_constraints")))
+    assert 0 < n_constraints < n_full/100
+
+    np.testing.assert_almost_equal(network.objective, objective, decimal=2)
+
+    #no lines are overloaded after the outages
+    network.generators_t.p_set = network.generators_t.p.copy()
+    network.generators.loc[:,'p_set_t'] = True
+    network.storage_units_t.p_set = network.storage_units_t.p.copy()
+    network.storage_units.loc[:,'p_set_t'] = True
+
+    overloads = network.lpf_contingency_overloads(snapshots,branch_outages=branch_outages,
+                                                  rating_factor=1+1e-4)
+    assert len(overloads) == 0
+
+
 if __name__ == "__main__":
     test_sclopf()
+    test_sclopf_lazy()